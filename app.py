@@ -1,11 +1,24 @@
 import streamlit as st
 import pandas as pd
+from contextlib import nullcontext
 from datetime import datetime, timedelta
 import plotly.express as px
-from athena_connector import AthenaConnector
-from config import ATHENA_DATABASE, ATHENA_TABLE
+from athena_connector import get_shared_connector
+from local_engine import LocalQueryEngine
+from query_handle import QueryHandle, QueryCancelledError
+from query_filters import DELAY_HISTOGRAM_EDGES, compile_filters
+from session_store import SessionResultStore
+from downloads import DOWNLOAD_FORMATS, SessionDownloads, iter_frame_batches
+from result_pager import FramePages, KeysetPages, ResultPager, sort_for_display, visible
+from approximate import DELAY_PERCENTILES, estimate_metrics
+from charts import chart_frames
+from config import (ATHENA_DATABASE, ATHENA_TABLE, ATHENA_QUERY_TIMEOUT, DOWNLOAD_BATCH_SIZE, GRID_PAGE_SIZE,
+                    APPROX_SAMPLE_PERCENT, DOWNLOAD_DIR, DOWNLOAD_STATIC_DIR, STATIC_DIR, STATIC_MAX_FILE_BYTES)
 import base64
+import html
 import io
+import os
+import shutil
 
 # Set page config at the top level
 st.set_page_config(
@@ -41,24 +54,24 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-@st.cache_data(ttl=600)  # Cache for 10 minutes
-def get_unique_values(column_name):
-    """Get unique values for a specific column with partition optimization"""
+@st.cache_resource
+def get_connector():
+    """One connector per server process, shared by every session (clients, credentials, caches and planner)"""
+    return get_shared_connector()
+
+def get_dimension_catalog():
+    """The in-memory route catalog behind the journey type, origin and destination dropdowns, or None"""
     try:
-        connector = AthenaConnector()
-        result = connector.get_unique_values(column_name)
-        if result is not None and not result.empty:
-            return result[column_name].tolist()
-        return []
+        return get_connector().get_dimension_catalog()
     except Exception as e:
-        st.error(f"Error getting unique values for {column_name}: {str(e)}")
-        return []
+        st.error(f"Error getting journey types and airports: {str(e)}")
+        return None
 
 @st.cache_data(ttl=300)  # Cache for 5 minutes
 def get_data_summary():
     """Get data summary with partition information"""
     try:
-        connector = AthenaConnector()
+        connector = get_connector()
         result = connector.get_data_summary()
         if result is not None and not result.empty:
             return result.iloc[0].to_dict()
@@ -67,6 +80,465 @@ def get_data_summary():
         st.error(f"Error getting data summary: {str(e)}")
         return {}
 
+def get_data_summary_estimate():
+    """The stored data summary straight away (refreshed in the background), or {} if there's none yet"""
+    try:
+        result = get_connector().get_data_summary(approximate=True)
+        if result is not None and not result.empty:
+            return result.iloc[0].to_dict()
+        return {}
+    except Exception as e:
+        st.error(f"Error getting data summary: {str(e)}")
+        return {}
+
+def use_flight_code(code):
+    """Replace the flight code being typed with a suggestion (runs before the rerun it triggers)"""
+    terms = st.session_state.get('flight_code', '').replace(',', ' ').split()
+    st.session_state['flight_code'] = ', '.join(terms[:-1] + [code])
+
+def render_flight_code_suggestions(flight_code, date_from, date_to):
+    """Suggest codes for the last flight code term from the local index, flagging codes that don't exist"""
+    terms = flight_code.replace(',', ' ').split()
+    if not terms or terms[-1].endswith('*'):
+        return
+    try:
+        connector = get_connector()
+        suggestions = connector.suggest_flight_codes(terms[-1], date_from, date_to)
+        if connector.is_known_flight_code(terms[-1]):
+            return
+    except Exception as e:
+        st.sidebar.error(f"Error getting flight code suggestions: {str(e)}")
+        return
+    # Caught here instead of after an Athena round trip that matches nothing
+    st.sidebar.warning(f"⚠️ No flight code {terms[-1]}" + (". Did you mean:" if suggestions else ""))
+    columns = st.sidebar.columns(3)
+    for i, code in enumerate(suggestions):
+        with columns[i % 3]:
+            st.button(code, key=f"flight_suggestion_{code}", on_click=use_flight_code, args=(code,))
+
+def get_delay_histogram(date_from, date_to):
+    """Records per delay bucket on the selected dates, from the data summary (None before it has loaded)"""
+    try:
+        return get_connector().get_delay_histogram(date_from, date_to)
+    except Exception as e:
+        st.error(f"Error getting delay histogram: {str(e)}")
+        return None
+
+def delay_stop_label(stop):
+    """Slider label for a delay range stop (the infinite ends leave the range open)"""
+    if stop == float('-inf'):
+        return "No min"
+    if stop == float('inf'):
+        return "No max"
+    return f"{stop:g}"
+
+def delay_range_records(histogram, delay_min, delay_max):
+    """Records in the histogram buckets that make up [delay_min, delay_max) (infinite for an open end)"""
+    low = histogram['delay_min'].fillna(float('-inf'))
+    high = histogram['delay_max'].fillna(float('inf'))
+    return int(histogram['records'][(low >= delay_min) & (high <= delay_max)].sum())
+
+def parse_metrics(metrics_df):
+    """Extract the aggregated metrics (and any delay percentiles and ± bounds) from a metrics result"""
+    if metrics_df is None or metrics_df.empty:
+        return None
+    metrics = metrics_df.iloc[0]
+    parsed = {
+        'total_count': int(metrics['total_count']),
+        'avg_delay': float(metrics['avg_delay']) if pd.notna(metrics['avg_delay']) else 0,
+        'total_orders': float(metrics['total_orders']) if pd.notna(metrics['total_orders']) else 0,
+        'total_revenue': float(metrics['total_revenue']) if pd.notna(metrics['total_revenue']) else 0
+    }
+    for name, _ in DELAY_PERCENTILES:
+        value = metrics.get(name)
+        parsed[name] = float(value) if value is not None and pd.notna(value) else None
+    errors = {name: float(metrics[f"{name}_error"]) for name in ('total_count', 'avg_delay', 'total_orders',
+                                                                 'total_revenue')
+              if f"{name}_error" in metrics and pd.notna(metrics[f"{name}_error"])}
+    if errors:
+        parsed['errors'] = errors
+    return parsed
+
+def render_metrics(container, metrics):
+    """Display the metric cards for the full filtered result (an st.empty, so newer metrics replace older ones)"""
+    errors = metrics.get('errors')
+    
+    def shown(value, fmt, name):
+        # Estimates are marked ≈ with their 95% ± bound
+        if errors is None:
+            return fmt.format(value)
+        bound = f" ±{fmt.format(errors[name])}" if name in errors else ""
+        return f"≈{fmt.format(value)}{bound}"
+    
+    with container.container():
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Total Records", shown(metrics['total_count'], "{:,.0f}", 'total_count'))
+        with col2:
+            avg_delay = metrics['avg_delay']
+            st.metric("Avg Delay (min)", shown(avg_delay, "{:.1f}", 'avg_delay') if avg_delay > 0 else "N/A")
+        with col3:
+            total_orders = metrics['total_orders']
+            st.metric("Total Orders", shown(total_orders, "{:,.0f}", 'total_orders') if total_orders > 0 else "N/A")
+        with col4:
+            total_revenue = metrics['total_revenue']
+            st.metric("Total Revenue",
+                      "SAR " + shown(total_revenue, "{:,.2f}", 'total_revenue') if total_revenue > 0 else "N/A")
+        
+        percentiles = [(name, metrics.get(name)) for name, _ in DELAY_PERCENTILES]
+        if any(value is not None for _, value in percentiles):
+            for column, (name, value) in zip(st.columns(4), percentiles):
+                with column:
+                    st.metric(f"{name.split('_')[0].upper()} Delay (min)",
+                              f"{value:.1f}" if value is not None else "N/A")
+        if errors is not None:
+            st.caption(f"⚡ Estimated from a {APPROX_SAMPLE_PERCENT:g}% sample; ± is the 95% interval. "
+                       "Exact figures replace these when they arrive.")
+
+def turn_page(delta):
+    """Move the data grid by delta pages (runs before the rerun it triggers)"""
+    st.session_state['grid_page'] = max(0, st.session_state.get('grid_page', 0) + delta)
+
+def render_data(container, pager, filters):
+    """Display one page of the result rows and the download buttons"""
+    with container:
+        # Display data
+        st.subheader("📋 Flight Delays Data")
+        page_number = st.session_state.get('grid_page', 0)
+        while page_number > 0 and not pager.has_page(page_number):
+            page_number -= 1
+        try:
+            page = pager.page(page_number)
+        except Exception as e:
+            st.error(f"Error loading page {page_number + 1}: {str(e)}")
+            return
+        st.dataframe(page, use_container_width=True)
+        
+        page_count = pager.page_count
+        col_prev, col_page, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            st.button("◀ Previous", on_click=turn_page, args=(-1,), disabled=page_number == 0)
+        with col_page:
+            st.caption(f"Page {page_number + 1:,} of {page_count:,}" if page_count else f"Page {page_number + 1:,}")
+        with col_next:
+            st.button("Next ▶", on_click=turn_page, args=(1,), disabled=not pager.has_page(page_number + 1))
+        
+        st.subheader("📥 Download Data")
+        fmt = st.radio("Format", list(DOWNLOAD_FORMATS), horizontal=True)
+        extension, _ = DOWNLOAD_FORMATS[fmt]
+        file_name = f"flight_delays_{filters.get('date_from')}_{filters.get('date_to')}.{extension}"
+        downloads = get_session_downloads()
+        key = compile_filters(filters)
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            # Written once per page and format, so reruns hand back the same file
+            entry = downloads.get_or_write((key, 'page', page_number, len(page), fmt),
+                                           lambda: iter_frame_batches(page, DOWNLOAD_BATCH_SIZE), fmt)
+            render_download_button(entry, fmt, file_name.replace('.', f"_page{page_number + 1}.", 1),
+                                   "📥 Download This Page", "Download the rows shown above")
+        with col2:
+            full = downloads.get((key, 'full', fmt))
+            if full is None and st.button("📦 Prepare Full Export",
+                                          help="Export every matching record, not just the rows shown"):
+                try:
+                    with st.spinner("🔄 Exporting all matching records..."):
+                        if pager.complete:
+                            # Every row is already here, so there's nothing to ask Athena for
+                            batches = (visible(batch) for batch in
+                                       iter_frame_batches(pager.source.df, DOWNLOAD_BATCH_SIZE))
+                        else:
+                            batches = get_connector().stream_filtered_data(filters, batch_size=DOWNLOAD_BATCH_SIZE,
+                                                                          report_errors=False)
+                        full = downloads.write((key, 'full', fmt), batches, fmt)
+                except QueryCancelledError:
+                    st.warning("⚠️ Export stopped before it finished. Try again or narrow the filters.")
+                except Exception as e:
+                    st.error(f"Export failed: {str(e)}")
+            if full is not None:
+                render_download_button(full, fmt, file_name.replace('flight_delays_', 'flight_delays_full_', 1),
+                                       "📥 Download Full Result", "Download every record matching the filters")
+
+def render_download_button(entry, fmt, file_name, label, help):
+    """Download link or button for a file written by the session's download store
+
+    st.download_button reads the whole file into server memory, so it is the
+    last resort: files under the static dir are linked and streamed from disk
+    by Streamlit, and files past its static size limit are uploaded to S3 and
+    linked with a presigned URL.
+    """
+    path, rows = entry
+    _, mime = DOWNLOAD_FORMATS[fmt]
+    text = f"{label} ({rows:,} records)"
+    if os.path.getsize(path) > STATIC_MAX_FILE_BYTES:
+        url = published_download_url(path, file_name)
+        if url is not None:
+            render_download_link(url, file_name, text, help)
+            return
+    elif static_downloads() and os.path.commonpath([os.path.abspath(path), STATIC_DIR]) == STATIC_DIR:
+        url = 'app/static/' + '/'.join(os.path.relpath(os.path.abspath(path), STATIC_DIR).split(os.sep))
+        render_download_link(url, file_name, text, help)
+        return
+    with open(path, 'rb') as f:
+        st.download_button(
+            label=text,
+            data=f,
+            file_name=file_name,
+            mime=mime,
+            help=help
+        )
+
+def render_download_link(url, file_name, text, help):
+    st.markdown(f'<a href="{html.escape(url)}" download="{html.escape(file_name)}" '
+                f'title="{html.escape(help)}">{text}</a>', unsafe_allow_html=True)
+
+def published_download_url(path, file_name):
+    """Presigned S3 URL for a download file, uploaded the first time it is shown; None if the upload failed"""
+    published = st.session_state.setdefault('published_downloads', {})
+    if path not in published:
+        try:
+            with st.spinner("☁️ Preparing the download link..."):
+                published[path] = get_connector().publish_download(path)
+        except Exception as e:
+            published[path] = None
+            st.warning(f"Couldn't upload the file for download, serving it directly: {str(e)}")
+    if published[path] is None:
+        return None
+    return get_connector().download_url(published[path], file_name)
+
+def render_status(status_area, metrics_area, pager, metrics):
+    """Show how many records matched and how they are paged (or that nothing matched)"""
+    if pager is not None and pager.empty is False:
+        total_count = metrics['total_count'] if metrics is not None else pager.total_count
+        
+        # Fall back to what the pager knows if the metrics query failed
+        if metrics is None and total_count is not None:
+            metrics = {'total_count': total_count, 'avg_delay': 0, 'total_orders': 0, 'total_revenue': 0}
+            render_metrics(metrics_area, metrics)
+        
+        # Show pagination information
+        if total_count is None:
+            status_area.success(f"✅ Showing matching records {pager.page_size:,} per page")
+        elif total_count > pager.page_size:
+            status_area.success(f"✅ {total_count:,} records, {pager.page_size:,} per page")
+        else:
+            status_area.success(f"✅ Showing all {total_count:,} records")
+    else:
+        status_area.warning("⚠️ No data found for the selected filters. Try adjusting your criteria.")
+
+def get_session_results():
+    """This session's store of results already shown, kept across reruns"""
+    if 'session_results' not in st.session_state:
+        st.session_state['session_results'] = SessionResultStore()
+    return st.session_state['session_results']
+
+@st.cache_resource
+def clear_static_downloads():
+    """Once per server process: delete download files an earlier process left in the static dir"""
+    shutil.rmtree(DOWNLOAD_STATIC_DIR, ignore_errors=True)
+
+def static_downloads():
+    """Whether Streamlit serves the static dir, so download files can be linked from there"""
+    return bool(st.get_option('server.enableStaticServing'))
+
+def get_session_downloads():
+    """This session's download files, kept across reruns"""
+    if 'session_downloads' not in st.session_state:
+        directory = DOWNLOAD_STATIC_DIR if static_downloads() else DOWNLOAD_DIR
+        st.session_state['session_downloads'] = SessionDownloads(directory=directory)
+    return st.session_state['session_downloads']
+
+def new_result_pager(connector, filters, df, complete):
+    """Pager for a freshly loaded result: df is every matching row if complete, else the first page
+
+    Partial results keep their pager (cursors and recent pages) for this
+    session's reruns; complete ones are paged straight from the session store.
+    """
+    st.session_state['grid_page'] = 0
+    if complete:
+        st.session_state.pop('keyset_pager', None)
+        return ResultPager(FramePages(df))
+    pager = ResultPager(KeysetPages(connector, filters))
+    pager.put(0, df)
+    st.session_state['keyset_pager'] = (compile_filters(filters), pager)
+    return pager
+
+def get_result_pager(filters, df, metrics):
+    """Pager for the applied filters on a rerun, given the stored rows and metrics"""
+    stored = st.session_state.get('keyset_pager')
+    if stored is not None and stored[0] == compile_filters(filters):
+        pager = stored[1]
+        if pager.total_count is None and metrics is not None:
+            pager.total_count = metrics['total_count']
+        return pager
+    return ResultPager(FramePages(df))
+
+def new_session_handle():
+    """Stop this session's queries still running for an earlier request and return a handle for the new one"""
+    previous = st.session_state.get('query_handle')
+    if previous is not None:
+        previous.cancel()
+    st.session_state['query_handle'] = QueryHandle(timeout=ATHENA_QUERY_TIMEOUT)
+    return st.session_state['query_handle']
+
+def render_charts(container, charts):
+    """Plot the aggregated chart views loaded so far (an st.empty, so charts arriving later redraw it)"""
+    with container.container():
+        if not any(frame is not None and not frame.empty for frame in charts.values()):
+            st.info("📈 No chart data for the selected filters.")
+            return
+        col1, col2 = st.columns(2)
+        histogram = charts.get('delay_histogram')
+        with col1:
+            if histogram is not None and not histogram.empty:
+                fig = px.bar(histogram, x='delay_bin', y='flights', title="Departure Delay Distribution",
+                             labels={'delay_bin': 'Delay (min)', 'flights': 'Flights'})
+                st.plotly_chart(fig, use_container_width=True)
+        daily = charts.get('daily_delay')
+        with col2:
+            if daily is not None and not daily.empty:
+                fig = px.line(daily, x='departure_date', y='avg_delay', hover_data=['flights'],
+                              title="Average Delay by Day",
+                              labels={'departure_date': 'Departure Date', 'avg_delay': 'Avg Delay (min)'})
+                st.plotly_chart(fig, use_container_width=True)
+        
+        col3, col4 = st.columns(2)
+        routes = charts.get('worst_routes')
+        with col3:
+            if routes is not None and not routes.empty:
+                routes = routes.assign(route=routes['origin'] + ' → ' + routes['destination'])
+                fig = px.bar(routes, x='avg_delay', y='route', orientation='h', hover_data=['flights'],
+                             title="Most Delayed Routes", labels={'avg_delay': 'Avg Delay (min)', 'route': ''})
+                fig.update_yaxes(autorange='reversed')
+                st.plotly_chart(fig, use_container_width=True)
+        flights = charts.get('worst_flights')
+        with col4:
+            if flights is not None and not flights.empty:
+                fig = px.bar(flights, x='avg_delay', y='flight_code', orientation='h', hover_data=['flights'],
+                             title="Most Delayed Flight Codes",
+                             labels={'avg_delay': 'Avg Delay (min)', 'flight_code': ''})
+                fig.update_yaxes(autorange='reversed')
+                st.plotly_chart(fig, use_container_width=True)
+
+def result_areas():
+    """Placeholders for one result: status, metrics, and the data and charts tabs"""
+    status_area = st.empty()
+    metrics_area = st.empty()
+    data_tab, charts_tab = st.tabs(["📋 Data", "📈 Charts"])
+    return status_area, metrics_area, data_tab.container(), charts_tab.empty()
+
+def render_preview(placeholder, plan, loaded, total):
+    """Show the first rows of the chunks loaded so far while the rest of a long date range loads"""
+    with placeholder.container():
+        st.subheader("📋 Flight Delays Data")
+        st.caption(f"⏳ Loaded {loaded} of {total} date chunks, showing the rows so far")
+        st.dataframe(visible(sort_for_display(plan.partial())).head(GRID_PAGE_SIZE), use_container_width=True)
+
+def with_percentiles(metrics, estimate):
+    """metrics with any delay percentiles it lacks taken from the estimate"""
+    if estimate is None:
+        return metrics
+    return {**metrics, **{name: estimate[name] for name, _ in DELAY_PERCENTILES
+                          if metrics.get(name) is None and estimate.get(name) is not None}}
+
+def load_results(connector, filters, plan, metrics_area, data_area, charts_area, handle=None, approximate=False):
+    """Run the metrics, chart and first grid page queries together, render each as it arrives
+
+    plan is connector.plan_filtered_data(filters, limit=None). Returns (df, pager,
+    metrics, charts, window): df is every matching row in grid order when plan
+    loads the whole result (date ranges, via cached partitions) and otherwise
+    just the first page, fetched with keyset pagination. With
+    approximate, sampled metrics are shown first and replaced by the exact ones.
+    Long date ranges are fetched as concurrent partition chunks and previewed
+    as each chunk arrives.
+    """
+    df = None
+    pager = None
+    metrics = None
+    estimate = None
+    charts = {}
+    queries = {'metrics': connector.build_metrics_query(filters)}
+    # No sample when the exact metrics come from the rollup, which is cheaper still
+    sample_query = connector.build_approximate_metrics_query(filters) if approximate else None
+    if sample_query is not None:
+        queries['approx_metrics'] = sample_query
+    chart_queries = connector.build_chart_queries(filters)
+    
+    # Date-range queries load the whole range, fetching only the departure_date partitions not cached yet
+    chunks = {}
+    if plan is None:
+        queries['data'] = connector.build_page_query(filters, page_size=GRID_PAGE_SIZE)
+    elif plan.sql:
+        # Long ranges are fetched as several partition chunks at once, previewed as they arrive
+        chunks = plan.chunk_queries(connector.scatter_chunks(plan))
+        queries.update({name: sql for name, (_, sql) in chunks.items()})
+        remaining = len(chunks)
+        preview = data_area.empty()
+    else:
+        df = sort_for_display(plan.combine(None))
+        pager = new_result_pager(connector, filters, df, complete=True)
+        if not df.empty:
+            render_data(data_area, pager, filters)
+        # Every row is already here, so the charts are aggregated locally
+        charts = chart_frames(df)
+        chart_queries = {}
+        render_charts(charts_area, charts)
+    queries.update(chart_queries)
+    
+    # Chunks are cached per day by plan.add, not again whole
+    for name, result in connector.execute_queries(queries, max_age=connector.reuse_max_age(filters), handle=handle,
+                                                  uncached=chunks):
+        if name == 'metrics':
+            metrics = parse_metrics(result)
+            if metrics is not None:
+                metrics = with_percentiles(metrics, estimate)
+                render_metrics(metrics_area, metrics)
+        elif name in chart_queries:
+            if result is not None:
+                charts[name.split(':', 1)[1]] = result
+                render_charts(charts_area, charts)
+        elif name == 'approx_metrics':
+            estimate = parse_metrics(estimate_metrics(result))
+            if estimate is None:
+                continue
+            if metrics is None:
+                render_metrics(metrics_area, estimate)
+            elif any(metrics.get(column) is None for column, _ in DELAY_PERCENTILES):
+                # Exact metrics without percentiles (no delays known); the sample's fill them in
+                metrics = with_percentiles(metrics, estimate)
+                render_metrics(metrics_area, metrics)
+        else:
+            if name in chunks:
+                remaining -= 1
+                if result is not None:
+                    plan.add(result, chunks[name][0])
+                if remaining:
+                    render_preview(preview, plan, len(chunks) - remaining, len(chunks))
+                    continue
+                preview.empty()
+                # None if any chunk failed
+                result = plan.combine(None)
+            if plan is not None:
+                result = sort_for_display(result)
+            if result is not None:
+                df = result
+                # A first page that isn't full is the whole result
+                pager = new_result_pager(connector, filters, df, complete=plan is not None or len(df) < GRID_PAGE_SIZE)
+                if not df.empty:
+                    render_data(data_area, pager, filters)
+    
+    # If the exact metrics failed, the estimate is the best there is
+    if metrics is None:
+        metrics = estimate
+    
+    if pager is not None and pager.total_count is None and metrics is not None:
+        pager.total_count = metrics['total_count']
+    
+    # The complete result (every matching row) if we have it, for answering narrower filters
+    window = df if pager is not None and pager.complete else None
+    
+    return df, pager, metrics, charts, window
+
 def main():
     # Custom CSS
     st.markdown("""
@@ -96,10 +568,17 @@ def main():
     
     # Header
     st.markdown('<h1 class="main-header">✈️ Flight Delays Portal</h1>', unsafe_allow_html=True)
+    clear_static_downloads()
     
     # Data Summary Section
     with st.expander("📊 Data Summary & Partition Information", expanded=False):
-        summary = get_data_summary()
+        # In fast mode the stored summary shows at once, leaving out the newest partitions until it's refreshed
+        summary = get_data_summary_estimate() if st.session_state.get('fast_mode') else {}
+        if summary:
+            st.caption(f"⚡ As of {summary.get('latest_date')}; distinct counts are estimates "
+                       f"(±{summary.get('distinct_error', 0) * 2:.1%} at 95%)")
+        else:
+            summary = get_data_summary()
         if summary:
             col1, col2, col3, col4 = st.columns(4)
             with col1:
@@ -134,29 +613,52 @@ def main():
         help="Filter by departure date (partitioned column for optimal performance)"
     )
     
+    day_from = date_from.strftime('%Y-%m-%d') if date_from else None
+    day_to = date_to.strftime('%Y-%m-%d') if date_to else None
+    
     # Other filters
     st.sidebar.subheader("✈️ Flight Details")
     
-    journey_types = ['All'] + get_unique_values('journey_type')
+    # Each dropdown only offers values with routes under the choices above it
+    catalog = get_dimension_catalog()
+    journey_types = ['All'] + (catalog.journey_types() if catalog else [])
     journey_type = st.sidebar.selectbox("Journey Type", journey_types)
+    selected_journey = None if journey_type == 'All' else journey_type
     
-    origins = ['All'] + get_unique_values('origin')
+    origins = ['All'] + (catalog.origins(selected_journey) if catalog else [])
     origin = st.sidebar.selectbox("Origin", origins)
     
-    destinations = ['All'] + get_unique_values('destination')
+    destinations = ['All'] + (catalog.destinations(selected_journey, None if origin == 'All' else origin)
+                              if catalog else [])
     destination = st.sidebar.selectbox("Destination", destinations)
     
-    flight_code = st.sidebar.text_input("Flight Code", placeholder="e.g., QR-1117")
+    flight_code = st.sidebar.text_input(
+        "Flight Code",
+        key='flight_code',
+        placeholder="e.g., QR-1117, SV-2 or QR-*",
+        help="One or more codes separated by commas; a trailing * matches every code starting with it"
+    )
+    render_flight_code_suggestions(flight_code, day_from, day_to)
+    
+    # Departure delay range, stopping on the precomputed histogram's edges so its counts are exact
+    delay_stops = [float('-inf'), *DELAY_HISTOGRAM_EDGES, float('inf')]
+    delay_min, delay_max = st.sidebar.select_slider(
+        "Departure Delay (min)",
+        options=delay_stops,
+        value=(delay_stops[0], delay_stops[-1]),
+        format_func=delay_stop_label,
+        help="Flights delayed at least the lower bound and less than the upper bound"
+    )
+    histogram = get_delay_histogram(day_from, day_to)
+    if histogram is not None:
+        st.sidebar.caption(f"{delay_range_records(histogram, delay_min, delay_max):,} of "
+                           f"{int(histogram['records'].sum()):,} flights with a delay on these dates (all routes)")
     
-    # Departure delay filter
-    delay_options = [
-        'All', 
-        'Less than 15 minutes', 
-        '15-30 minutes', 
-        '30-60 minutes', 
-        'Greater than 60 minutes'
-    ]
-    dep_delayed = st.sidebar.selectbox("Departure Delay", delay_options)
+    fast_mode = st.sidebar.toggle(
+        "⚡ Fast approximate metrics",
+        key='fast_mode',
+        help="Show sampled estimates with error bounds right away while the exact figures load"
+    )
     
     # Apply filters button
     if st.sidebar.button("🚀 Apply Filters", type="primary"):
@@ -176,70 +678,70 @@ def main():
             filters['destination'] = destination
         if flight_code:
             filters['flight_code'] = flight_code
-        if dep_delayed != 'All':
-            filters['dep_delayed'] = dep_delayed
+        if delay_min != float('-inf'):
+            filters['delay_min'] = delay_min
+        if delay_max != float('inf'):
+            filters['delay_max'] = delay_max
         
-        # Execute query
         with st.spinner("🔄 Loading data..."):
-            connector = AthenaConnector()
-            df = connector.execute_query(connector.build_filtered_query(filters))
+            connector = get_connector()
+            handle = new_session_handle()
+            status_area, metrics_area, data_area, charts_area = result_areas()
             
-            if df is not None and not df.empty:
-                displayed_count = len(df)
-                
-                # Display metrics
-                metrics_df = connector.get_filtered_metrics(filters)
-                
-                # Get metrics from total dataset
-                if metrics_df is not None and not metrics_df.empty:
-                    total_count = int(metrics_df.iloc[0]['total_count'])
-                    avg_delay = float(metrics_df.iloc[0]['avg_delay']) if metrics_df.iloc[0]['avg_delay'] is not None else 0
-                    total_orders = float(metrics_df.iloc[0]['total_orders']) if metrics_df.iloc[0]['total_orders'] is not None else 0
-                    total_revenue = float(metrics_df.iloc[0]['total_revenue']) if metrics_df.iloc[0]['total_revenue'] is not None else 0
-                else:
-                    total_count = displayed_count
-                    avg_delay = 0
-                    total_orders = 0
-                    total_revenue = 0
-                
-                # Show pagination information
-                if total_count > displayed_count:
-                    st.success(f"✅ Showing {displayed_count:,} of {total_count:,} total records")
-                else:
-                    st.success(f"✅ Showing all {displayed_count:,} records")
-                
-                # Display metrics
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    st.metric("Total Records", f"{total_count:,}", f"Showing {displayed_count:,}")
-                with col2:
-                    st.metric("Avg Delay (min)", f"{avg_delay:.1f}" if avg_delay > 0 else "N/A")
-                with col3:
-                    st.metric("Total Orders", f"{total_orders:,.0f}" if total_orders > 0 else "N/A")
-                with col4:
-                    st.metric("Total Revenue", f"SAR {total_revenue:,.2f}" if total_revenue > 0 else "N/A")
-                
-                # Display data
-                st.subheader("📋 Flight Delays Data")
-                st.dataframe(df, use_container_width=True)
-                
-                # Simple download
-                st.subheader("📥 Download Data")
-                
-                # Download displayed data (1000 records)
-                csv_data = df.to_csv(index=False)
-                
-                st.download_button(
-                    label=f"📥 Download Data ({len(df):,} records)",
-                    data=csv_data,
-                    file_name=f"flight_delays_{date_from}_{date_to}.csv",
-                    mime="text/csv",
-                    help="Download the complete dataset"
-                )
-                
-
+            # Filters this session has loaded in full recently are shown again as they were
+            stored = get_session_results().complete_result(filters, connector.reuse_max_age(filters))
+            # Filters covered by a complete result already loaded (or loading) are answered locally
+            engine = connector.planner.lookup(filters) if stored is None else None
+            if stored is not None:
+                df, metrics, charts = stored
+                if metrics is not None:
+                    render_metrics(metrics_area, metrics)
+                pager = new_result_pager(connector, filters, df, complete=True)
+                if not df.empty:
+                    render_data(data_area, pager, filters)
+                render_charts(charts_area, charts or {})
+            elif engine is not None:
+                metrics = parse_metrics(engine.metrics(filters))
+                render_metrics(metrics_area, metrics)
+                df = engine.filter(filters, limit=None)
+                pager = new_result_pager(connector, filters, df, complete=True)
+                if not df.empty:
+                    render_data(data_area, pager, filters)
+                charts = engine.charts(filters)
+                render_charts(charts_area, charts)
             else:
-                st.warning("⚠️ No data found for the selected filters. Try adjusting your criteria.")
+                # Only a load of every matching row can answer later requests, so paged loads aren't registered
+                plan = connector.plan_filtered_data(filters, limit=None)
+                with connector.planner.loading(filters) if plan is not None else nullcontext() as load:
+                    df, pager, metrics, charts, window = load_results(connector, filters, plan, metrics_area,
+                                                                      data_area, charts_area, handle=handle,
+                                                                      approximate=fast_mode)
+                    if load is not None:
+                        load.set_result(LocalQueryEngine.from_window(window, filters))
+            
+            # Kept for reruns, so a download click or a page turn doesn't go back to Athena
+            get_session_results().put(filters, df if df is not None else pd.DataFrame(), metrics, charts=charts,
+                                      complete=pager is not None and pager.complete)
+            st.session_state['applied_charts'] = (compile_filters(filters), charts)
+            st.session_state['applied_filters'] = filters
+            render_status(status_area, metrics_area, pager, metrics)
+    
+    elif 'applied_filters' in st.session_state:
+        # Any other rerun shows the last applied result again from this session's store
+        filters = st.session_state['applied_filters']
+        stored = get_session_results().get(filters)
+        if stored is not None:
+            df, metrics = stored
+            pager = get_result_pager(filters, df, metrics)
+            status_area, metrics_area, data_area, charts_area = result_areas()
+            if metrics is not None:
+                render_metrics(metrics_area, metrics)
+            if not df.empty:
+                render_data(data_area, pager, filters)
+            stored_charts = st.session_state.get('applied_charts')
+            if stored_charts is not None and stored_charts[0] == compile_filters(filters):
+                render_charts(charts_area, stored_charts[1])
+            render_status(status_area, metrics_area, pager, metrics)
     
     # Performance tips
     with st.sidebar.expander(""):
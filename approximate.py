@@ -0,0 +1,86 @@
+import math
+
+import pandas as pd
+
+from config import APPROX_SAMPLE_PERCENT, APPROX_SAMPLE_METHOD
+
+# Delay percentiles added to the metrics, as (column, quantile)
+DELAY_PERCENTILES = (('p50_delay', 0.5), ('p90_delay', 0.9), ('p99_delay', 0.99))
+
+# Two-sided 95% normal quantile, for the ± bounds shown with estimates
+Z_95 = 1.96
+
+
+def percentile_columns():
+    """approx_percentile select-list entries for the delay percentiles"""
+    return ",\n            ".join(
+        f"approx_percentile(CAST(dep_delayed AS DOUBLE), {quantile}) as {name}"
+        for name, quantile in DELAY_PERCENTILES
+    )
+
+
+def delay_digest():
+    """qdigest of the delays in a group, as VARBINARY so it can be stored in Parquet and merged later"""
+    return "CAST(qdigest_agg(CAST(dep_delayed AS DOUBLE)) AS VARBINARY)"
+
+
+def digest_percentile_columns(column):
+    """The delay percentile columns from merging the stored delay_digest values in column"""
+    return ",\n            ".join(
+        f"value_at_quantile(merge(CAST({column} AS qdigest(double))), {quantile}) as {name}"
+        for name, quantile in DELAY_PERCENTILES
+    )
+
+
+def build_approximate_metrics_query(table, where, percent=APPROX_SAMPLE_PERCENT, method=APPROX_SAMPLE_METHOD):
+    """Metrics over a TABLESAMPLE of the rows matching where, with the moments the error bounds need"""
+    sample = f" TABLESAMPLE {method} ({percent:g})" if percent < 100 else ""
+    return f"""
+        SELECT
+            COUNT(*) as sample_count,
+            COUNT(CAST(dep_delayed AS DOUBLE)) as delay_count,
+            AVG(CAST(dep_delayed AS DOUBLE)) as avg_delay,
+            STDDEV_SAMP(CAST(dep_delayed AS DOUBLE)) as delay_stddev,
+            SUM(CAST(order_c AS DOUBLE)) as sample_orders,
+            SUM(POWER(CAST(order_c AS DOUBLE), 2)) as sample_orders_sq,
+            SUM(CAST(selling_price_sum AS DOUBLE)) as sample_revenue,
+            SUM(POWER(CAST(selling_price_sum AS DOUBLE), 2)) as sample_revenue_sq,
+            {percentile_columns()}
+        FROM {table}{sample}
+        WHERE {where}
+        """
+
+
+def _value(row, column):
+    value = row.get(column)
+    return float(value) if value is not None and pd.notna(value) else 0.0
+
+
+def estimate_metrics(sample_df, percent=APPROX_SAMPLE_PERCENT):
+    """Scale a sampled metrics result up to the metrics columns, plus a 95% ± bound for each estimate
+
+    Each row is in a Bernoulli sample with probability q, so a total is the
+    sample sum over q with variance (1 - q) / q^2 times the sample sum of squares
+    (a count is a sum of ones); the average's bound is the usual stddev / sqrt(n).
+    """
+    if sample_df is None or sample_df.empty:
+        return None
+    row = sample_df.iloc[0]
+    q = min(percent, 100) / 100
+    scale = 1 / q
+    spread = math.sqrt(1 - q) / q
+    sample_count = _value(row, 'sample_count')
+    delay_count = _value(row, 'delay_count')
+    estimates = {
+        'total_count': int(round(sample_count * scale)),
+        'avg_delay': row.get('avg_delay'),
+        'total_orders': _value(row, 'sample_orders') * scale,
+        'total_revenue': _value(row, 'sample_revenue') * scale,
+        'total_count_error': Z_95 * spread * math.sqrt(sample_count),
+        'avg_delay_error': Z_95 * _value(row, 'delay_stddev') / math.sqrt(delay_count) if delay_count > 1 else None,
+        'total_orders_error': Z_95 * spread * math.sqrt(_value(row, 'sample_orders_sq')),
+        'total_revenue_error': Z_95 * spread * math.sqrt(_value(row, 'sample_revenue_sq')),
+    }
+    for name, _ in DELAY_PERCENTILES:
+        estimates[name] = row.get(name)
+    return pd.DataFrame([estimates])
@@ -1,7 +1,17 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 import boto3
+import logging
+import threading
+from botocore.config import Config
 import os
+import queue
+import uuid
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import partial
 from config import (
     ATHENA_DATABASE,
     ATHENA_TABLE,
@@ -9,11 +19,60 @@ from config import (
     ATHENA_REGION,
     ATHENA_CATALOG,
     ATHENA_SCHEMA,
-    ATHENA_WORKGROUP
+    ATHENA_WORKGROUP,
+    ATHENA_EXPORT_WORKGROUP,
+    ATHENA_RESULT_FETCH_MODE,
+    ATHENA_UNLOAD_DIR,
+    ATHENA_MAX_POOL_CONNECTIONS,
+    ATHENA_MAX_RETRY_ATTEMPTS,
+    ATHENA_RESULT_REUSE_MAX_AGE,
+    ATHENA_QUERY_TIMEOUT,
+    ATHENA_EXPORT_TIMEOUT,
+    GRID_PAGE_SIZE,
+    PARTITION_LOAD_MAX_ROWS,
+    DOWNLOAD_S3_DIR,
+    DOWNLOAD_URL_EXPIRY
 )
+from result_store import S3ResultStore
+from query_poller import QueryPoller
+from result_cache import ResultCache, query_fingerprint
+from partition_cache import PartitionCache, date_range_days, estimated_rows, scatter_chunks
+from query_filters import compile_filters, keyset_condition
+from query_planner import QueryPlanner
+from rollup import DailyRollup
+from data_summary import DataSummary
+from flight_codes import FlightCodeIndex
+from dimension_catalog import CATALOG_DIMENSIONS, DimensionCatalog
+from approximate import build_approximate_metrics_query, estimate_metrics, percentile_columns
+from charts import build_chart_queries
+from query_scheduler import QueryScheduler, INTERACTIVE, EXPORT, CANCEL_CHECK_INTERVAL
+from query_handle import QueryHandle, QueryCancelledError, QueryTimeoutError
+from query_reuse import ExecutionHistory, reuse_configuration
+from result_decoder import arrow_schema, decode_rows, csv_convert_options, csv_read_options, to_dataframe
+
+logger = logging.getLogger(__name__)
+
+
+class QueryFailedError(Exception):
+    """Raised when an Athena query finishes in a state other than SUCCEEDED"""
+
+
+_shared_connector = None
+_shared_connector_lock = threading.Lock()
+
+
+def get_shared_connector():
+    """The process-wide AthenaConnector: credentials, clients and caches are set up once and reused"""
+    global _shared_connector
+    with _shared_connector_lock:
+        if _shared_connector is None:
+            _shared_connector = AthenaConnector()
+        return _shared_connector
+
 
 class AthenaConnector:
-    def __init__(self):
+    def __init__(self, athena_client=None, result_store=None, result_fetch_mode=ATHENA_RESULT_FETCH_MODE,
+                 result_cache=None):
         # Load credentials dynamically
         self.credentials = self._get_aws_credentials()
         
@@ -25,9 +84,40 @@ class AthenaConnector:
             region_name=ATHENA_REGION
         )
         
+        # Clients are thread-safe and shared by every session, so size the connection
+        # pool for concurrent queries and let botocore back off when Athena throttles
+        client_config = Config(
+            max_pool_connections=ATHENA_MAX_POOL_CONNECTIONS,
+            retries={'mode': 'adaptive', 'max_attempts': ATHENA_MAX_RETRY_ATTEMPTS}
+        )
+        
         # Initialize Athena client
-        self.athena_client = self.athena_session.client('athena')
+        self.athena_client = athena_client or self.athena_session.client('athena', config=client_config)
         self.output_location = ATHENA_S3_STAGING_DIR
+        self.poller = QueryPoller(self.athena_client)
+        
+        # Where finished result files are read from (S3, or a local stand-in for tests)
+        self.result_store = result_store or S3ResultStore(self.athena_session, client_config=client_config)
+        self.result_fetch_mode = result_fetch_mode
+        
+        # Local Parquet cache consulted before any query is sent to Athena
+        self.result_cache = result_cache if result_cache is not None else ResultCache()
+        self.partition_cache = PartitionCache(self.result_cache)
+        self.planner = QueryPlanner(max_age=self.partition_cache.reuse_max_age)
+        
+        # Every session's Athena work goes through one scheduler (this connector is shared per process)
+        self.scheduler = QueryScheduler()
+        # Last successful execution per query, so repeats only pay for the result fetch
+        self.execution_history = ExecutionHistory()
+        
+        # Metrics, summary and dimension lookups are answered from the daily rollup where filters allow
+        self.rollup = DailyRollup(self._run_statement, self._run_uncached_query, self._table_properties,
+                                  self.result_store.remove)
+        # Data summary kept on local disk and brought up to date from new partitions only
+        self.data_summary = DataSummary()
+        # Flight codes for autocomplete and the routes behind the sidebar dropdowns, indexed in memory
+        self.flight_codes = FlightCodeIndex(self._run_index_query)
+        self.dimensions = DimensionCatalog(self._run_index_query, self.rollup)
     
     def _get_aws_credentials(self):
         """Get AWS credentials from Streamlit secrets or environment variables"""
@@ -88,128 +178,579 @@ class AthenaConnector:
         
         return credentials
     
-    def execute_athena_query(self, query):
-        """Execute a query using boto3 Athena client with pagination"""
+    def execute_athena_query(self, query, max_age=ATHENA_RESULT_REUSE_MAX_AGE, handle=None, report_errors=True):
+        """Execute a query using boto3 Athena client with pagination
+        
+        A run of the same SQL finished at most max_age seconds ago is reused
+        rather than started again (0 always runs the query). Cancelling handle,
+        or reaching its timeout, stops the wait and returns None. Errors are
+        shown in the app, or raised if report_errors is False (for callers off
+        the script thread, where Streamlit calls fail).
+        """
         try:
-            # Start query execution
-            response = self.athena_client.start_query_execution(
-                QueryString=query,
-                QueryExecutionContext={
-                    'Database': ATHENA_DATABASE
-                },
-                ResultConfiguration={
-                    'OutputLocation': self.output_location
-                }
+            query_execution = self._run_to_completion(query, max_age=max_age, handle=handle)
+            return self._collect_results(query_execution)
+        
+        except Exception as e:
+            if not report_errors:
+                raise
+            self._report_error(e)
+            return None
+    
+    def execute_queries(self, queries, ttl=None, max_age=ATHENA_RESULT_REUSE_MAX_AGE, handle=None, use_cache=True,
+                        uncached=(), report_errors=True):
+        """Run several named queries concurrently and yield (name, DataFrame) as each one is ready
+        
+        Cached results are yielded first. The rest are submitted up front and
+        polled together (or joined, if another session is already running the
+        same SQL), and results are fetched on a thread pool, so a small
+        aggregate is yielded while a large result is still downloading. A failed
+        query yields None for its name. Executions finished at most max_age
+        seconds ago are reused instead of being started again. With use_cache
+        False the result cache is neither read nor written, and neither is it
+        for the names in uncached (results the caller caches itself). With
+        report_errors False errors are logged rather than shown in the app, for
+        callers off the script thread.
+        
+        Cancelling handle (by default a new one with the interactive timeout),
+        or closing the generator early, stops the queries still running.
+        """
+        handle = handle or QueryHandle(timeout=ATHENA_QUERY_TIMEOUT)
+        report = self._report_error if report_errors else self._log_error
+        finished = {}
+        flights = {}
+        tokens = {}
+        pool = None
+        try:
+            for name, query in queries.items():
+                df = self.result_cache.get(query, max_age=max_age) if use_cache and name not in uncached else None
+                if df is not None:
+                    yield name, df
+                    continue
+                key = self._flight_key(query)
+                reused = self._reusable_execution(key, max_age)
+                if reused is not None:
+                    # Nothing to run, only the result to fetch
+                    finished[name] = reused
+                    continue
+                flight, is_leader = self.scheduler.join_or_lead(key)
+                flights[name] = (flight, is_leader)
+                tokens[name] = handle.attach(partial(self._abandon, flight))
+            
+            self._launch(
+                [(flight, queries[name]) for name, (flight, is_leader) in flights.items() if is_leader],
+                INTERACTIVE, max_age, handle
             )
+            started = {}
+            for name, (flight, _) in flights.items():
+                try:
+                    started.setdefault(self._execution_id(flight, handle), []).append(name)
+                except Exception as e:
+                    handle.abandon(tokens[name])
+                    report(e)
+                    yield name, None
             
-            query_execution_id = response['QueryExecutionId']
+            expected = len(finished) + sum(len(names) for names in started.values())
+            if not expected:
+                return
             
-            # Wait for query completion
-            import time
-            while True:
-                status_response = self.athena_client.get_query_execution(QueryExecutionId=query_execution_id)
-                status = status_response['QueryExecution']['Status']['State']
-                
-                if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-                    break
-                    
-                time.sleep(2)
+            ready = queue.Queue()
             
-            if status == 'SUCCEEDED':
-                # Get all results using pagination
-                all_rows = []
-                next_token = None
-                
-                while True:
-                    if next_token:
-                        results = self.athena_client.get_query_results(
-                            QueryExecutionId=query_execution_id,
-                            NextToken=next_token
-                        )
-                    else:
-                        results = self.athena_client.get_query_results(QueryExecutionId=query_execution_id)
-                    
-                    # Extract column names from first call
-                    if not all_rows:
-                        columns = [col['Label'] for col in results['ResultSet']['ResultSetMetadata']['ColumnInfo']]
-                    
-                    # Extract data rows (skip header on first call)
-                    start_idx = 1 if not all_rows else 0
-                    for row in results['ResultSet']['Rows'][start_idx:]:
-                        data_row = []
-                        for data in row['Data']:
-                            data_row.append(data.get('VarCharValue', ''))
-                        all_rows.append(data_row)
-                    
-                    # Check if there are more results
-                    next_token = results.get('NextToken')
-                    if not next_token:
-                        break
-                
-                # Create DataFrame
-                if all_rows:
-                    df = pd.DataFrame(all_rows, columns=columns)
-                    return df
-                else:
-                    return pd.DataFrame()
-            else:
-                error_info = status_response['QueryExecution']['Status'].get('StateChangeReason', 'No error details')
-                st.error(f"Query failed: {error_info}")
-                return None
-                
+            def fetch(name, query_execution):
+                try:
+                    df = self._collect_results(query_execution)
+                    if use_cache and name not in uncached:
+                        self._cache_result(queries[name], df, ttl, max_age)
+                    ready.put((name, df, None))
+                except Exception as e:
+                    ready.put((name, None, e))
+            
+            def watch():
+                pending = dict(started)
+                try:
+                    for query_execution_id, query_execution in self.poller.iter_completed(list(pending), handle):
+                        for name in pending.pop(query_execution_id):
+                            flight = flights[name][0]
+                            handle.detach(tokens[name])
+                            self.scheduler.close(flight)
+                            self.execution_history.record(flight.key, query_execution)
+                            pool.submit(fetch, name, query_execution)
+                except Exception as e:
+                    for names in pending.values():
+                        for name in names:
+                            handle.abandon(tokens[name])
+                            ready.put((name, None, e))
+            
+            pool = ThreadPoolExecutor(max_workers=expected + 1)
+            if started:
+                pool.submit(watch)
+            for name, query_execution in finished.items():
+                pool.submit(fetch, name, query_execution)
+            
+            # Streamlit calls must stay on the script thread, so errors are reported here
+            for _ in range(expected):
+                name, df, error = ready.get()
+                if error is not None:
+                    report(error)
+                yield name, df
+        
+        except GeneratorExit:
+            # Nobody will read the remaining results, so stop the queries still running
+            handle.cancel()
+            raise
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+    
+    def _report_error(self, error):
+        """Show a query error in the app; cancellations are silent since a newer request replaced them"""
+        if isinstance(error, QueryTimeoutError):
+            st.error(f"Query timed out: {str(error)}")
+        elif isinstance(error, QueryCancelledError):
+            return
+        elif isinstance(error, QueryFailedError):
+            st.error(f"Query failed: {str(error)}")
+        else:
+            st.error(f"Query execution failed: {str(error)}")
+    
+    def _log_error(self, error):
+        """Log a query error from a background thread, which can't show it in the app"""
+        if not isinstance(error, QueryCancelledError):
+            logger.warning("Background query failed: %s", error)
+    
+    def _flight_key(self, query, priority=INTERACTIVE):
+        """Identifies a query execution that callers asking for the same SQL can share"""
+        return self._workgroup(priority), query_fingerprint(query)
+    
+    def _workgroup(self, priority):
+        """Exports run in their own workgroup so they don't compete with on-screen queries"""
+        return ATHENA_EXPORT_WORKGROUP if priority == EXPORT else ATHENA_WORKGROUP
+    
+    def _timeout(self, priority):
+        """How long a query of this priority may run before it is stopped"""
+        return ATHENA_EXPORT_TIMEOUT if priority == EXPORT else ATHENA_QUERY_TIMEOUT
+    
+    def _run_to_completion(self, query, priority=INTERACTIVE, max_age=ATHENA_RESULT_REUSE_MAX_AGE, handle=None):
+        """Run a query through the scheduler and return its finished QueryExecution
+        
+        A successful run of the same SQL at most max_age seconds old is returned
+        as is, and if the same SQL is already running, for this session or any
+        other, its execution is shared instead of submitting the query again.
+        Waiting is bounded by handle (by default a new one with the priority's
+        timeout); giving up stops the execution unless another caller still wants it.
+        """
+        handle = handle or QueryHandle(timeout=self._timeout(priority))
+        key = self._flight_key(query, priority)
+        reused = self._reusable_execution(key, max_age)
+        if reused is not None:
+            return reused
+        
+        flight, is_leader = self.scheduler.join_or_lead(key, priority)
+        token = handle.attach(partial(self._abandon, flight))
+        try:
+            if is_leader:
+                self._launch([(flight, query)], priority, max_age, handle)
+            query_execution = self.poller.wait(self._execution_id(flight, handle), handle)
+        except Exception:
+            handle.abandon(token)
+            raise
+        handle.detach(token)
+        self.scheduler.close(flight)
+        self.execution_history.record(key, query_execution)
+        return query_execution
+    
+    def _launch(self, flights, priority, max_age, handle):
+        """Take slots for the flights this caller leads and start their executions
+        
+        A flight that fails to start is closed with the error, which reaches
+        every caller waiting on it. If handle gives up while queued for slots,
+        the flights are handed to another caller waiting on them (see
+        _execution_id); one nobody else wants is closed when its leader leaves.
+        """
+        if not flights:
+            return
+        for flight, query in flights:
+            flight.query, flight.max_age = query, max_age
+        try:
+            self.scheduler.acquire(priority, count=len(flights), handle=handle)
+        except (QueryCancelledError, QueryTimeoutError):
+            for flight, _ in flights:
+                self.scheduler.step_down(flight)
+            return
         except Exception as e:
-            st.error(f"Query execution failed: {str(e)}")
+            for flight, _ in flights:
+                self.scheduler.close(flight, error=e)
+            return
+        
+        for flight, query in flights:
+            try:
+                query_execution_id = self._start_query_execution(query, priority, max_age)
+            except Exception as e:
+                self.scheduler.release(priority)
+                self.scheduler.close(flight, error=e)
+                continue
+            if not self.scheduler.started(flight, query_execution_id):
+                # Everyone waiting gave up while it was being submitted
+                self.scheduler.release(priority)
+                self._stop_query_execution(query_execution_id)
+    
+    def _execution_id(self, flight, handle):
+        """Wait for flight to be started and return its QueryExecutionId, giving up if handle is cancelled
+        
+        If the flight's leader gave up before starting it, this caller starts it.
+        """
+        while True:
+            try:
+                return flight.started.result(timeout=CANCEL_CHECK_INTERVAL)
+            except FutureTimeoutError:
+                handle.check()
+                if self.scheduler.take_lead(flight):
+                    self._launch([(flight, flight.query)], flight.priority, flight.max_age, handle)
+    
+    def _abandon(self, flight):
+        """Stop waiting on flight, and stop its execution in Athena if no other caller is waiting on it"""
+        if not self.scheduler.leave(flight):
+            return
+        if flight.started.done() and flight.started.exception() is None:
+            self._stop_query_execution(flight.started.result())
+        self.scheduler.close(flight, error=QueryCancelledError("Query was cancelled"))
+    
+    def _stop_query_execution(self, query_execution_id):
+        """Ask Athena to stop a query (a no-op if it has already finished)"""
+        try:
+            self.athena_client.stop_query_execution(QueryExecutionId=query_execution_id)
+        except Exception:
+            pass
+    
+    def _run_statement(self, query, priority=EXPORT):
+        """Run a statement (DDL, CTAS, INSERT INTO) to completion, raising if it fails (export workgroup by default)"""
+        query_execution = self._run_to_completion(query, priority, max_age=0)
+        if query_execution['Status']['State'] != 'SUCCEEDED':
+            raise QueryFailedError(query_execution['Status'].get('StateChangeReason', 'No error details'))
+        return query_execution
+    
+    def _run_uncached_query(self, query):
+        """Run a query fresh (no result cache or reuse), raising if it fails"""
+        return self._collect_results(self._run_statement(query))
+    
+    def _run_index_query(self, query):
+        """Run a query fresh at interactive priority, raising if it fails
+        
+        For the in-memory indexes the sidebar waits on, which shouldn't queue
+        behind exports and rollup builds.
+        """
+        return self._collect_results(self._run_statement(query, INTERACTIVE))
+    
+    def _table_properties(self, table_name):
+        """A table's properties in the Athena database, or None if it doesn't exist"""
+        try:
+            response = self.athena_client.get_table_metadata(CatalogName=ATHENA_CATALOG,
+                                                             DatabaseName=ATHENA_DATABASE, TableName=table_name)
+        except self.athena_client.exceptions.MetadataException:
             return None
+        return response['TableMetadata'].get('Parameters', {})
     
-    def execute_query(self, query):
-        """Execute a query and return results as pandas DataFrame"""
-        return self.execute_athena_query(query)
+    def _reusable_execution(self, key, max_age):
+        """The finished QueryExecution of a recent successful run of key, or None"""
+        query_execution_id = self.execution_history.lookup(key, max_age)
+        if query_execution_id is None:
+            return None
+        try:
+            query_execution = self.poller.poll([query_execution_id]).get(query_execution_id)
+        except Exception:
+            return None
+        if query_execution is None or query_execution['Status']['State'] != 'SUCCEEDED':
+            self.execution_history.forget(key)
+            return None
+        return query_execution
+    
+    def _start_query_execution(self, query, priority=INTERACTIVE, max_age=None):
+        """Submit a query to Athena and return its execution ID
+        
+        With a max_age (seconds), Athena may answer from a result of the same
+        query it produced within that window instead of scanning again.
+        """
+        request = {
+            'QueryString': query,
+            'QueryExecutionContext': {
+                'Database': ATHENA_DATABASE
+            },
+            'ResultConfiguration': {
+                'OutputLocation': self.output_location
+            },
+            'WorkGroup': self._workgroup(priority)
+        }
+        result_reuse = reuse_configuration(max_age)
+        if result_reuse:
+            request['ResultReuseConfiguration'] = result_reuse
+        response = self.athena_client.start_query_execution(**request)
+        return response['QueryExecutionId']
+    
+    def _collect_results(self, query_execution):
+        """Return the DataFrame for a finished query, raising QueryFailedError if it didn't succeed"""
+        status = query_execution['Status']['State']
+        if status != 'SUCCEEDED':
+            raise QueryFailedError(query_execution['Status'].get('StateChangeReason', 'No error details'))
+        
+        if self.result_fetch_mode == 's3':
+            df = self._read_results_from_s3(query_execution)
+            if df is not None:
+                return df
+        
+        # Fall back to paging through GetQueryResults
+        return self._fetch_results_paginated(query_execution['QueryExecutionId'])
+    
+    def _read_results_from_s3(self, query_execution):
+        """Read the CSV Athena wrote to the staging dir in one streamed GET; None if unavailable"""
+        schema = self._result_schema_for_s3(query_execution)
+        if schema is None:
+            return None
+        
+        try:
+            with self.result_store.open(self._output_location(query_execution)) as body:
+                table = pa_csv.read_csv(
+                    body,
+                    read_options=csv_read_options(schema),
+                    convert_options=csv_convert_options(schema)
+                )
+        except Exception:
+            return None
+        
+        if table.num_rows == 0:
+            return pd.DataFrame()
+        return to_dataframe(table)
+    
+    def _output_location(self, query_execution):
+        """The S3 URI of a finished query's result file"""
+        return query_execution.get('ResultConfiguration', {}).get('OutputLocation', '')
+    
+    def _result_schema_for_s3(self, query_execution):
+        """Arrow schema for a query whose result CSV can be read from S3; None if there is no CSV"""
+        if not self._output_location(query_execution).endswith('.csv'):
+            # DDL and UNLOAD statements don't produce a CSV result file
+            return None
+        
+        try:
+            # One tiny call for the column names and types, then the whole result from S3
+            metadata = self.athena_client.get_query_results(
+                QueryExecutionId=query_execution['QueryExecutionId'],
+                MaxResults=1
+            )
+        except Exception:
+            return None
+        return arrow_schema(metadata['ResultSet']['ResultSetMetadata']['ColumnInfo'])
     
-    def build_filtered_query(self, filters):
+    def _iter_result_pages(self, query_execution_id):
+        """Yield each GetQueryResults page (up to 1,000 rows) as a typed Arrow record batch"""
+        schema = None
+        next_token = None
+        
+        while True:
+            if next_token:
+                results = self.athena_client.get_query_results(
+                    QueryExecutionId=query_execution_id,
+                    NextToken=next_token
+                )
+            else:
+                results = self.athena_client.get_query_results(QueryExecutionId=query_execution_id)
+            
+            rows = results['ResultSet']['Rows']
+            # Build the schema from the first page and skip its header row
+            if schema is None:
+                schema = arrow_schema(results['ResultSet']['ResultSetMetadata']['ColumnInfo'])
+                rows = rows[1:]
+            
+            yield decode_rows(rows, schema)
+            
+            # Check if there are more results
+            next_token = results.get('NextToken')
+            if not next_token:
+                break
+    
+    def _fetch_results_paginated(self, query_execution_id):
+        """Fetch all results through GetQueryResults, decoding each 1,000-row page into typed columns"""
+        batches = [batch for batch in self._iter_result_pages(query_execution_id) if batch.num_rows]
+        
+        # Create DataFrame
+        if batches:
+            return to_dataframe(pa.Table.from_batches(batches))
+        else:
+            return pd.DataFrame()
+    
+    def iter_query_batches(self, query, batch_size=10000, priority=EXPORT, max_age=ATHENA_RESULT_REUSE_MAX_AGE,
+                           handle=None, report_errors=True):
+        """Run a query once and yield its rows as DataFrames of batch_size rows
+        
+        Rows are streamed from the result file (or GetQueryResults pages) as they
+        are read, so memory stays bounded by the batch size whatever the result size.
+        The timeout of handle (by default the export timeout) covers the download too.
+        Errors are shown in the app and end the stream, or raised if report_errors is False.
+        """
+        handle = handle or QueryHandle(timeout=self._timeout(priority))
+        try:
+            query_execution = self._run_to_completion(query, priority, max_age, handle)
+            if query_execution['Status']['State'] != 'SUCCEEDED':
+                raise QueryFailedError(query_execution['Status'].get('StateChangeReason', 'No error details'))
+            
+            pending = []
+            pending_rows = 0
+            for batch in self._iter_result_batches(query_execution):
+                handle.check()
+                pending.append(batch)
+                pending_rows += batch.num_rows
+                if pending_rows >= batch_size:
+                    # Re-chunk to exactly batch_size rows and carry the remainder over
+                    table = pa.Table.from_batches(pending)
+                    offset = 0
+                    while pending_rows - offset >= batch_size:
+                        yield to_dataframe(table.slice(offset, batch_size))
+                        offset += batch_size
+                    pending = table.slice(offset).to_batches()
+                    pending_rows -= offset
+            if pending_rows:
+                yield to_dataframe(pa.Table.from_batches(pending))
+        
+        except Exception as e:
+            if not report_errors:
+                raise
+            self._report_error(e)
+    
+    def _iter_result_batches(self, query_execution):
+        """Yield a finished query's rows as Arrow record batches, streaming from S3 when possible"""
+        schema = self._result_schema_for_s3(query_execution) if self.result_fetch_mode == 's3' else None
+        body = None
+        if schema is not None:
+            try:
+                body = self.result_store.open(self._output_location(query_execution))
+                reader = pa_csv.open_csv(
+                    body,
+                    read_options=csv_read_options(schema),
+                    convert_options=csv_convert_options(schema)
+                )
+            except Exception:
+                if body is not None:
+                    body.close()
+                body = None
+        
+        if body is None:
+            # Fall back to paging through GetQueryResults
+            yield from self._iter_result_pages(query_execution['QueryExecutionId'])
+            return
+        
+        with body:
+            for batch in reader:
+                yield batch
+    
+    def execute_query(self, query, ttl=None, max_age=ATHENA_RESULT_REUSE_MAX_AGE):
+        """Execute a query and return results as pandas DataFrame, served from the result cache when possible"""
+        df = self.result_cache.get(query, max_age=max_age)
+        if df is not None:
+            return df
+        
+        df = self.execute_athena_query(query, max_age=max_age)
+        if df is not None:
+            self._cache_result(query, df, ttl, max_age)
+        return df
+    
+    def _cache_result(self, query, df, ttl, max_age):
+        """Store a result for at most max_age seconds, the freshness callers asked for (0 stores nothing)"""
+        ttl = min(self.result_cache.default_ttl if ttl is None else ttl, max_age)
+        if ttl > 0:
+            try:
+                self.result_cache.put(query, df, ttl=ttl)
+            except Exception:
+                # A full disk or an unwritable column type only costs the next run a query
+                logger.exception("Could not cache a query result")
+    
+    def plan_filtered_data(self, filters, limit=50000, max_rows=PARTITION_LOAD_MAX_ROWS):
+        """Plan a date-range filtered query against the per-partition cache
+        
+        Returns a PartitionedQuery whose sql fetches only the uncached days (None
+        if every day is cached) and whose combine() merges them with the cached
+        days, or None when the filters have no closed date range. Without a
+        limit, ranges the data summary can't show to hold at most max_rows
+        records get None too, so they are paged rather than loaded whole.
+        """
+        if limit is None:
+            days = date_range_days(filters)
+            rows = estimated_rows(days, self.data_summary.day_counts()) if days is not None else None
+            if rows is None or rows > max_rows:
+                return None
+        return self.partition_cache.plan(filters, self.build_filtered_query, limit=limit)
+    
+    def scatter_chunks(self, plan):
+        """Split a plan's missing days into chunks to query concurrently, sized from the summary's day counts
+        
+        The counts are of every row in a partition, so chunks of a filtered
+        query hold at most the target rows.
+        """
+        return scatter_chunks(plan.missing, self.data_summary.day_counts())
+    
+    def get_filtered_data(self, filters, limit=50000):
+        """Get filtered records, reusing cached departure_date partitions for date-range queries
+        
+        Long ranges are fetched as concurrent chunks of partitions.
+        """
+        plan = self.plan_filtered_data(filters, limit=limit)
+        max_age = self.reuse_max_age(filters)
+        if plan is None:
+            return self.execute_query(self.build_filtered_query(filters, limit=limit), max_age=max_age)
+        if not plan.sql:
+            return plan.combine(None)
+        chunks = plan.chunk_queries(self.scatter_chunks(plan))
+        queries = {name: sql for name, (_, sql) in chunks.items()}
+        # Each chunk is cached per day by plan.add, not again whole
+        for name, fetched in self.execute_queries(queries, max_age=max_age, use_cache=False):
+            if fetched is None:
+                return None
+            plan.add(fetched, chunks[name][0])
+        return plan.combine(None)
+    
+    def reuse_max_age(self, filters):
+        """Freshness for filtered queries: earlier runs are reused for long only if today's partition can't match"""
+        return self.partition_cache.reuse_max_age(filters)
+    
+    def build_filtered_query(self, filters, limit=50000, ordered=True):
         """Build a filtered query based on user inputs with partition optimization"""
         base_query = f"""
         SELECT flight_code, origin, destination, dep_delayed, cal_dep_delayed_minutes, 
                scheduled_departure_date_time_utc, actual_departure_date_utc, journey_type, 
                order_c, selling_price_sum, gbv_sum, departure_date
         FROM {ATHENA_DATABASE}.{ATHENA_TABLE}
-        WHERE departure_date IS NOT NULL
+        WHERE {compile_filters(filters).where_clause()}
         """
         
-        # Always add partition filters for optimal performance
-        if filters.get('date_from'):
-            base_query += f" AND departure_date >= '{filters['date_from']}'"
-        if filters.get('date_to'):
-            base_query += f" AND departure_date <= '{filters['date_to']}'"
-        
-        # Add other filters
-        if filters.get('journey_type'):
-            base_query += f" AND journey_type = '{filters['journey_type']}'"
-        if filters.get('origin'):
-            base_query += f" AND origin = '{filters['origin']}'"
-        if filters.get('destination'):
-            base_query += f" AND destination = '{filters['destination']}'"
-        if filters.get('flight_code'):
-            base_query += f" AND flight_code = '{filters['flight_code']}'"
-        if filters.get('dep_delayed'):
-            base_query += self._build_delay_filter(filters['dep_delayed'])
-        
-        # Add ordering with larger limit for display (50,000 records)
-        base_query += " ORDER BY order_c LIMIT 50000"
+        # Add ordering with larger limit for display (50,000 records by default, None for no limit)
+        if ordered:
+            base_query += " ORDER BY order_c"
+        if limit is not None:
+            base_query += f" LIMIT {limit}"
         
         return base_query
     
-    def _build_delay_filter(self, delay_range):
-        """Build delay filter based on range"""
-        if delay_range == 'Less than 15 minutes':
-            return " AND CAST(dep_delayed AS DECIMAL(10,2)) < 15"
-        elif delay_range == '15-30 minutes':
-            return " AND CAST(dep_delayed AS DECIMAL(10,2)) >= 15 AND CAST(dep_delayed AS DECIMAL(10,2)) < 30"
-        elif delay_range == '30-60 minutes':
-            return " AND CAST(dep_delayed AS DECIMAL(10,2)) >= 30 AND CAST(dep_delayed AS DECIMAL(10,2)) < 60"
-        elif delay_range == 'Greater than 60 minutes':
-            return " AND CAST(dep_delayed AS DECIMAL(10,2)) > 60"
-        else:
-            return ""
+    def build_page_query(self, filters, after=None, page_size=GRID_PAGE_SIZE):
+        """Build the query for one grid page: the page_size rows after an (order_c, join_key) cursor
+        
+        join_key breaks order_c ties so the sort is stable and each page starts
+        exactly where the previous one ended, without an OFFSET scan.
+        """
+        where = compile_filters(filters).where_clause()
+        if after is not None:
+            where += f" AND {keyset_condition(after)}"
+        return f"""
+        SELECT flight_code, origin, destination, dep_delayed, cal_dep_delayed_minutes, 
+               scheduled_departure_date_time_utc, actual_departure_date_utc, journey_type, 
+               order_c, selling_price_sum, gbv_sum, departure_date, join_key
+        FROM {ATHENA_DATABASE}.{ATHENA_TABLE}
+        WHERE {where}
+        ORDER BY order_c NULLS LAST, join_key
+        LIMIT {page_size}
+        """
+    
+    def get_page(self, filters, after=None, page_size=GRID_PAGE_SIZE, report_errors=True):
+        """Get one grid page of filtered records (None if the query failed, or raised if report_errors is False)"""
+        return self.execute_athena_query(self.build_page_query(filters, after=after, page_size=page_size),
+                                         max_age=self.reuse_max_age(filters), report_errors=report_errors)
     
     def get_sample_data(self):
         """Get sample data from the table"""
@@ -222,8 +763,22 @@ class AthenaConnector:
         """
         return self.execute_query(query)
     
+    def get_dimension_catalog(self):
+        """The route catalog behind the sidebar dropdowns, built on first use and then refreshed in the background"""
+        if self.dimensions.ready:
+            self.dimensions.maybe_refresh()
+        else:
+            self.dimensions.refresh()
+        return self.dimensions
+    
     def get_unique_values(self, column_name):
-        """Get unique values for a specific column"""
+        """Get unique values for a specific column (from the dimension catalog for the sidebar dimensions)"""
+        if column_name in CATALOG_DIMENSIONS:
+            catalog = self.get_dimension_catalog()
+            values = {'journey_type': catalog.journey_types, 'origin': catalog.origins,
+                      'destination': catalog.destinations}[column_name]()
+            return pd.DataFrame({column_name: values})
+        
         query = f"""
         SELECT DISTINCT {column_name} 
         FROM {ATHENA_DATABASE}.{ATHENA_TABLE}
@@ -232,159 +787,158 @@ class AthenaConnector:
         """
         return self.execute_query(query)
     
-    def get_data_summary(self):
-        """Get data summary with partition information"""
-        query = f"""
-        SELECT 
-            COUNT(*) as total_records,
-            COUNT(DISTINCT departure_date) as unique_dates,
-            MIN(departure_date) as earliest_date,
-            MAX(departure_date) as latest_date,
-            COUNT(DISTINCT origin) as unique_origins,
-            COUNT(DISTINCT destination) as unique_destinations,
-            COUNT(DISTINCT flight_code) as unique_flights
-        FROM {ATHENA_DATABASE}.{ATHENA_TABLE}
+    def suggest_flight_codes(self, text, date_from=None, date_to=None):
+        """Flight codes completing text (prefix matches, then close misspellings) from the local index
+        
+        Nothing is queried here; the index is built and refreshed in the
+        background, so there are no suggestions until it has been built.
+        """
+        self.flight_codes.maybe_refresh()
+        return self.flight_codes.complete(text, date_from, date_to)
+    
+    def is_known_flight_code(self, code):
+        """False if the flight code index is built and doesn't have code (True while it isn't built)"""
+        return not self.flight_codes.ready or code in self.flight_codes
+    
+    def get_data_summary(self, approximate=False):
+        """Get data summary with partition information, updated from partitions newer than the stored state
+        
+        approximate returns the stored state straight away (without the newest
+        partitions) and brings it up to date in the background.
+        """
+        if approximate:
+            snapshot = self.data_summary.snapshot()
+            if snapshot is not None:
+                self.data_summary.refresh_in_background(self._run_summary_queries)
+                return snapshot
+        return self.data_summary.refresh(self._run_summary_queries)
+    
+    def get_delay_histogram(self, date_from=None, date_to=None):
+        """Records per delay bucket on the given departure dates, from the data summary without a scan
+        
+        The summary is brought up to date in the background; None until it has
+        been refreshed once.
         """
-        return self.execute_query(query) 
+        self.data_summary.refresh_in_background(self._run_summary_queries)
+        return self.data_summary.delay_histogram(date_from, date_to)
+    
+    def _run_summary_queries(self, queries):
+        # Today's partition is summarised again on every call, so nothing older than a second run is reused,
+        # and the small per-day results are kept in the summary state rather than the result cache.
+        # Refreshes mostly run on a background thread, so failures are logged and retried on the next refresh
+        return dict(self.execute_queries(queries, max_age=0, use_cache=False, report_errors=False))
 
     def get_filtered_count(self, filters):
         """Get total count of records matching filters (without LIMIT)"""
         base_query = f"""
         SELECT COUNT(*) as total_count
         FROM {ATHENA_DATABASE}.{ATHENA_TABLE}
-        WHERE departure_date IS NOT NULL
+        WHERE {compile_filters(filters).where_clause()}
         """
         
-        # Always add partition filters for optimal performance
-        if filters.get('date_from'):
-            base_query += f" AND departure_date >= '{filters['date_from']}'"
-        if filters.get('date_to'):
-            base_query += f" AND departure_date <= '{filters['date_to']}'"
-        
-        # Add other filters
-        if filters.get('journey_type'):
-            base_query += f" AND journey_type = '{filters['journey_type']}'"
-        if filters.get('origin'):
-            base_query += f" AND origin = '{filters['origin']}'"
-        if filters.get('destination'):
-            base_query += f" AND destination = '{filters['destination']}'"
-        if filters.get('flight_code'):
-            base_query += f" AND flight_code = '{filters['flight_code']}'"
-        if filters.get('dep_delayed'):
-            base_query += self._build_delay_filter(filters['dep_delayed'])
-        
-        return self.execute_query(base_query) 
+        return self.execute_query(base_query, max_age=self.reuse_max_age(filters)) 
 
-    def get_filtered_metrics(self, filters):
-        """Get aggregated metrics for records matching filters (without LIMIT)"""
+    def get_filtered_metrics(self, filters, approximate=False):
+        """Get aggregated metrics for records matching filters (without LIMIT)
+        
+        approximate estimates them from a sample instead, adding a 95% ± bound
+        column (<metric>_error) for each estimated total and the average delay,
+        unless the daily rollup answers them exactly for less.
+        """
+        sample_query = self.build_approximate_metrics_query(filters) if approximate else None
+        if sample_query is not None:
+            return estimate_metrics(self.execute_query(sample_query, max_age=self.reuse_max_age(filters)))
+        return self.execute_query(self.build_metrics_query(filters), max_age=self.reuse_max_age(filters))
+    
+    def build_metrics_query(self, filters):
+        """Build the aggregated metrics query for records matching filters, on the daily rollup when filters allow"""
+        rollup_query = self.rollup.metrics_query(filters)
+        if rollup_query is not None:
+            return rollup_query
+        
         base_query = f"""
         SELECT 
             COUNT(*) as total_count,
             AVG(CAST(dep_delayed AS DECIMAL(10,2))) as avg_delay,
             SUM(CAST(order_c AS DECIMAL(10,2))) as total_orders,
-            SUM(CAST(selling_price_sum AS DECIMAL(10,2))) as total_revenue
+            SUM(CAST(selling_price_sum AS DECIMAL(10,2))) as total_revenue,
+            {percentile_columns()}
         FROM {ATHENA_DATABASE}.{ATHENA_TABLE}
-        WHERE departure_date IS NOT NULL
+        WHERE {compile_filters(filters).where_clause()}
         """
         
-        # Always add partition filters for optimal performance
-        if filters.get('date_from'):
-            base_query += f" AND departure_date >= '{filters['date_from']}'"
-        if filters.get('date_to'):
-            base_query += f" AND departure_date <= '{filters['date_to']}'"
-        
-        # Add other filters
-        if filters.get('journey_type'):
-            base_query += f" AND journey_type = '{filters['journey_type']}'"
-        if filters.get('origin'):
-            base_query += f" AND origin = '{filters['origin']}'"
-        if filters.get('destination'):
-            base_query += f" AND destination = '{filters['destination']}'"
-        if filters.get('flight_code'):
-            base_query += f" AND flight_code = '{filters['flight_code']}'"
-        if filters.get('dep_delayed'):
-            base_query += self._build_delay_filter(filters['dep_delayed'])
-        
-        return self.execute_query(base_query) 
+        return base_query 
+    
+    def build_approximate_metrics_query(self, filters):
+        """Build the sampled metrics query behind fast mode (see approximate.estimate_metrics)
+        
+        None when the daily rollup answers the exact metrics: that reads a
+        fraction of what even the sample scans.
+        """
+        if self.rollup.metrics_query(filters) is not None:
+            return None
+        return build_approximate_metrics_query(f"{ATHENA_DATABASE}.{ATHENA_TABLE}",
+                                               compile_filters(filters).where_clause())
+
+    def build_chart_queries(self, filters):
+        """Build the GROUP BY queries behind the charts tab, as {'chart:<name>': sql} (see charts.py)"""
+        return build_chart_queries(f"{ATHENA_DATABASE}.{ATHENA_TABLE}", compile_filters(filters).where_clause())
 
     def get_all_filtered_data(self, filters):
-        """Get all records matching filters (without LIMIT) for export using pagination"""
-        # First, get the total count
-        count_query = f"""
-        SELECT COUNT(*) as total_count
-        FROM {ATHENA_DATABASE}.{ATHENA_TABLE}
-        WHERE departure_date IS NOT NULL
-        """
-        
-        # Always add partition filters for optimal performance
-        if filters.get('date_from'):
-            count_query += f" AND departure_date >= '{filters['date_from']}'"
-        if filters.get('date_to'):
-            count_query += f" AND departure_date <= '{filters['date_to']}'"
-        
-        # Add other filters
-        if filters.get('journey_type'):
-            count_query += f" AND journey_type = '{filters['journey_type']}'"
-        if filters.get('origin'):
-            count_query += f" AND origin = '{filters['origin']}'"
-        if filters.get('destination'):
-            count_query += f" AND destination = '{filters['destination']}'"
-        if filters.get('flight_code'):
-            count_query += f" AND flight_code = '{filters['flight_code']}'"
-        if filters.get('dep_delayed'):
-            count_query += self._build_delay_filter(filters['dep_delayed'])
-        
-        count_df = self.execute_query(count_query)
-        total_count = int(count_df.iloc[0]['total_count']) if count_df is not None and not count_df.empty else 0
-        
-        if total_count == 0:
+        """Get all records matching filters (without LIMIT) for export"""
+        batches = list(self.stream_filtered_data(filters))
+        if batches:
+            return pd.concat(batches, ignore_index=True)
+        else:
             return pd.DataFrame()
+    
+    def stream_filtered_data(self, filters, batch_size=10000, report_errors=True):
+        """Yield all records matching filters as DataFrame batches from a single query pass"""
+        return self.iter_query_batches(self.build_filtered_query(filters, limit=None), batch_size=batch_size,
+                                       max_age=self.reuse_max_age(filters), report_errors=report_errors)
+
+    
+    def build_unload_query(self, filters, location):
+        """Wrap the filtered query in an UNLOAD that writes Parquet files under location"""
+        # UNLOAD output order isn't guaranteed, so the sort would only cost time
+        select_query = self.build_filtered_query(filters, limit=None, ordered=False)
+        return f"""
+        UNLOAD ({select_query})
+        TO '{location}'
+        WITH (format = 'PARQUET', compression = 'SNAPPY')
+        """
+    
+    def publish_download(self, path, download_dir=DOWNLOAD_S3_DIR):
+        """Upload a download file under an unguessable prefix in download_dir and return its URI"""
+        uri = f"{download_dir.rstrip('/')}/{uuid.uuid4().hex}/{os.path.basename(path)}"
+        self.result_store.upload(path, uri)
+        return uri
+    
+    def download_url(self, uri, file_name, expires_in=DOWNLOAD_URL_EXPIRY):
+        """Short-lived URL the browser downloads a published file from, saved as file_name"""
+        return self.result_store.download_url(uri, file_name, expires_in)
+    
+    def unload_filtered_data(self, filters, unload_dir=ATHENA_UNLOAD_DIR):
+        """Export all records matching filters as Parquet via UNLOAD; returns the written file URIs"""
+        # UNLOAD needs an empty destination, so every export gets its own scratch prefix
+        location = f"{unload_dir.rstrip('/')}/{uuid.uuid4().hex}/"
+        try:
+            # Each UNLOAD writes to a fresh prefix, so an earlier run's files are never reusable
+            query_execution = self._run_to_completion(self.build_unload_query(filters, location), EXPORT, max_age=0)
+            if query_execution['Status']['State'] != 'SUCCEEDED':
+                raise QueryFailedError(query_execution['Status'].get('StateChangeReason', 'No error details'))
+            return self.result_store.list(location)
         
-        # Use pagination to get all data
-        all_data = []
-        batch_size = 10000  # Process in batches of 10,000
-        offset = 0
-        
-        while offset < total_count:
-            # Build query with pagination
-            base_query = f"""
-            SELECT flight_code, origin, destination, dep_delayed, cal_dep_delayed_minutes, 
-                   scheduled_departure_date_time_utc, actual_departure_date_utc, journey_type, 
-                   order_c, selling_price_sum, gbv_sum, departure_date
-            FROM {ATHENA_DATABASE}.{ATHENA_TABLE}
-            WHERE departure_date IS NOT NULL
-            """
-            
-            # Always add partition filters for optimal performance
-            if filters.get('date_from'):
-                base_query += f" AND departure_date >= '{filters['date_from']}'"
-            if filters.get('date_to'):
-                base_query += f" AND departure_date <= '{filters['date_to']}'"
-            
-            # Add other filters
-            if filters.get('journey_type'):
-                base_query += f" AND journey_type = '{filters['journey_type']}'"
-            if filters.get('origin'):
-                base_query += f" AND origin = '{filters['origin']}'"
-            if filters.get('destination'):
-                base_query += f" AND destination = '{filters['destination']}'"
-            if filters.get('flight_code'):
-                base_query += f" AND flight_code = '{filters['flight_code']}'"
-            if filters.get('dep_delayed'):
-                base_query += self._build_delay_filter(filters['dep_delayed'])
-            
-            # Add ordering and pagination
-            base_query += f" ORDER BY order_c LIMIT {batch_size} OFFSET {offset}"
-            
-            batch_df = self.execute_query(base_query)
-            if batch_df is not None and not batch_df.empty:
-                all_data.append(batch_df)
-                offset += len(batch_df)
-            else:
-                break
-        
-        # Combine all batches
-        if all_data:
-            return pd.concat(all_data, ignore_index=True)
-        else:
-            return pd.DataFrame() 
\ No newline at end of file
+        except (QueryFailedError, QueryCancelledError) as e:
+            self._report_error(e)
+            return None
+        except Exception as e:
+            st.error(f"Export failed: {str(e)}")
+            return None
+    
+    def iter_parquet_batches(self, uris, batch_size=10000):
+        """Yield Arrow record batches from UNLOAD output files without loading them all at once"""
+        for uri in uris:
+            with self.result_store.open_input_file(uri) as source:
+                for batch in pq.ParquetFile(source).iter_batches(batch_size=batch_size):
+                    yield batch
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+from config import CHART_DELAY_BIN_MINUTES, CHART_DELAY_CLIP_MINUTES, CHART_TOP_N, CHART_MIN_FLIGHTS
+
+# Aggregated chart views, in the order they are shown
+CHART_NAMES = ('delay_histogram', 'daily_delay', 'worst_routes', 'worst_flights')
+
+# Columns each worst-N chart is grouped by
+WORST_GROUPS = {
+    'worst_routes': ('origin', 'destination'),
+    'worst_flights': ('flight_code',),
+}
+
+DELAY = "CAST(dep_delayed AS DOUBLE)"
+
+
+def build_chart_queries(table, where, bin_minutes=CHART_DELAY_BIN_MINUTES, clip=CHART_DELAY_CLIP_MINUTES,
+                        top_n=CHART_TOP_N, min_flights=CHART_MIN_FLIGHTS):
+    """GROUP BY queries for every chart over the rows matching where, as {'chart:<name>': sql}
+
+    Each returns at most a few hundred rows: delays in bin_minutes bins (clipped
+    to ±clip, so outliers land in the end bins), one row per day, and the top_n
+    routes and flight codes by average delay among those with min_flights
+    delayed flights.
+    """
+    queries = {
+        'delay_histogram': f"""
+        SELECT GREATEST(LEAST(FLOOR({DELAY} / {bin_minutes}) * {bin_minutes}, {clip}), -{clip}) AS delay_bin,
+               COUNT(*) AS flights
+        FROM {table}
+        WHERE {where} AND {DELAY} IS NOT NULL
+        GROUP BY 1
+        ORDER BY 1
+        """,
+        'daily_delay': f"""
+        SELECT departure_date, COUNT(*) AS flights, AVG({DELAY}) AS avg_delay
+        FROM {table}
+        WHERE {where}
+        GROUP BY departure_date
+        ORDER BY departure_date
+        """,
+    }
+    for name, columns in WORST_GROUPS.items():
+        group = ', '.join(columns)
+        queries[name] = f"""
+        SELECT {group}, COUNT(*) AS flights, AVG({DELAY}) AS avg_delay
+        FROM {table}
+        WHERE {where}
+        GROUP BY {group}
+        HAVING COUNT({DELAY}) >= {min_flights}
+        ORDER BY avg_delay DESC, {group}
+        LIMIT {top_n}
+        """
+    return {f"chart:{name}": queries[name] for name in CHART_NAMES}
+
+
+def chart_frames(df, bin_minutes=CHART_DELAY_BIN_MINUTES, clip=CHART_DELAY_CLIP_MINUTES,
+                 top_n=CHART_TOP_N, min_flights=CHART_MIN_FLIGHTS):
+    """The same aggregates as build_chart_queries, computed from rows already in memory, as {name: DataFrame}"""
+    delay = pd.to_numeric(df['dep_delayed'], errors='coerce') if not df.empty else pd.Series(dtype=float)
+    rows = pd.DataFrame({column: df[column] for column in ('departure_date', 'origin', 'destination', 'flight_code')
+                         if column in df}).assign(delay=delay)
+
+    known = delay.dropna()
+    bins = (np.floor(known / bin_minutes) * bin_minutes).clip(-clip, clip)
+    histogram = bins.value_counts().sort_index()
+    frames = {
+        'delay_histogram': pd.DataFrame({'delay_bin': histogram.index.to_numpy(dtype=float),
+                                         'flights': histogram.to_numpy()}),
+    }
+    if rows.empty:
+        frames['daily_delay'] = pd.DataFrame(columns=['departure_date', 'flights', 'avg_delay'])
+        for name, columns in WORST_GROUPS.items():
+            frames[name] = pd.DataFrame(columns=[*columns, 'flights', 'avg_delay'])
+        return frames
+
+    days = rows.assign(departure_date=rows['departure_date'].astype(str).str[:10])
+    frames['daily_delay'] = days.groupby('departure_date').agg(
+        flights=('delay', 'size'), avg_delay=('delay', 'mean')).reset_index()
+    for name, columns in WORST_GROUPS.items():
+        grouped = rows.groupby(list(columns)).agg(
+            flights=('delay', 'size'), delayed=('delay', 'count'), avg_delay=('delay', 'mean')).reset_index()
+        grouped = grouped[grouped['delayed'] >= min_flights].drop(columns='delayed')
+        # Ties broken by the group columns, like the SQL ORDER BY
+        frames[name] = grouped.sort_values(['avg_delay', *columns], ascending=[False] + [True] * len(columns),
+                                           kind='mergesort').head(top_n).reset_index(drop=True)
+    return frames
@@ -13,6 +13,120 @@ ATHENA_CATALOG = os.getenv('ATHENA_CATALOG', "awsdatacatalog")  # Data source is
 ATHENA_SCHEMA = os.getenv('ATHENA_SCHEMA', "l1_almosafer")  # Schema name (same as database)
 ATHENA_WORKGROUP = os.getenv('ATHENA_WORKGROUP', "primary")  # Primary workgroup (available via API)
 
+# Result fetching: 's3' reads the CSV Athena writes to the staging dir, 'paginate' uses GetQueryResults
+ATHENA_RESULT_FETCH_MODE = os.getenv('ATHENA_RESULT_FETCH_MODE', "s3")
+
+# Scratch prefix for UNLOAD-to-Parquet exports (each export writes under its own sub-prefix)
+ATHENA_UNLOAD_DIR = os.getenv('ATHENA_UNLOAD_DIR', ATHENA_S3_STAGING_DIR.rstrip('/') + "/unload/")
+
+# On-disk Parquet cache for query results (LRU-evicted above the byte budget, entries expire after the TTL)
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "results"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))  # 2 GB
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', "3600"))  # Seconds
+
+# Data summary state, updated from new departure_date partitions only (distinct counts kept as HyperLogLog sketches)
+SUMMARY_STATE_PATH = os.getenv('SUMMARY_STATE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "summary.json"))
+SUMMARY_SKETCH_PRECISION = int(os.getenv('SUMMARY_SKETCH_PRECISION', "12"))  # 2^p registers, ~1.04 / sqrt(2^p) error
+
+# Per-partition result cache: past departure_date partitions never change, today's is still being written
+PARTITION_CACHE_TODAY_TTL = int(os.getenv('PARTITION_CACHE_TODAY_TTL', "300"))  # Seconds
+PARTITION_CACHE_HISTORY_TTL = int(os.getenv('PARTITION_CACHE_HISTORY_TTL', str(30 * 24 * 3600)))  # Seconds
+
+# Long date ranges are fetched as concurrent partition-aligned chunks (month, week or day) of about this many rows,
+# at most this many per request
+SCATTER_TARGET_ROWS = int(os.getenv('SCATTER_TARGET_ROWS', "1000000"))
+SCATTER_MAX_CHUNKS = int(os.getenv('SCATTER_MAX_CHUNKS', "8"))
+
+# Largest loaded date window kept in memory for answering narrower filters locally
+LOCAL_ENGINE_MAX_ROWS = int(os.getenv('LOCAL_ENGINE_MAX_ROWS', "2000000"))
+
+# Largest date range (in records, per the data summary) loaded whole; bigger ranges are paged with keyset queries
+PARTITION_LOAD_MAX_ROWS = int(os.getenv('PARTITION_LOAD_MAX_ROWS', "2000000"))
+
+# Complete filtered results remembered for answering narrower filters locally
+PLANNER_MAX_WINDOWS = int(os.getenv('PLANNER_MAX_WINDOWS', "4"))
+# Seconds a remembered result is reused; the connector keeps windows ending before today longer
+PLANNER_WINDOW_MAX_AGE = int(os.getenv('PLANNER_WINDOW_MAX_AGE', "300"))
+# Longest a request waits for covering loads still in flight before running its own query (seconds)
+PLANNER_WAIT_TIMEOUT = float(os.getenv('PLANNER_WAIT_TIMEOUT', "10"))
+
+# Per-session store of results already shown, so reruns (downloads, sorting) don't query again
+SESSION_RESULT_MAX_BYTES = int(os.getenv('SESSION_RESULT_MAX_BYTES', str(256 * 1024 ** 2)))  # In memory, rest spilled to disk
+SESSION_RESULT_MAX_ENTRIES = int(os.getenv('SESSION_RESULT_MAX_ENTRIES', "20"))
+SESSION_SPILL_DIR = os.getenv('SESSION_SPILL_DIR') or None  # Defaults to the system temp dir
+
+# Data grid: rows fetched per page (keyset-paginated) and pages kept in memory per session
+GRID_PAGE_SIZE = int(os.getenv('GRID_PAGE_SIZE', "500"))
+GRID_MAX_PAGES = int(os.getenv('GRID_MAX_PAGES', "5"))
+
+# Download files are written batch by batch to a per-session scratch dir instead of built in memory
+DOWNLOAD_DIR = os.getenv('DOWNLOAD_DIR') or None  # Defaults to the system temp dir
+DOWNLOAD_BATCH_SIZE = int(os.getenv('DOWNLOAD_BATCH_SIZE', "50000"))  # Rows per write
+DOWNLOAD_MAX_FILES = int(os.getenv('DOWNLOAD_MAX_FILES', "4"))  # Files kept per session
+# Where downloads go when Streamlit serves ./static (server.enableStaticServing): the browser then fetches
+# them from disk through a link, instead of st.download_button holding each file in server memory
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DOWNLOAD_STATIC_DIR = os.path.join(STATIC_DIR, 'downloads')
+# Streamlit's static handler answers 404 above this size (MAX_APP_STATIC_FILE_SIZE)
+STATIC_MAX_FILE_BYTES = 200 * 1024 ** 2
+# Larger downloads are uploaded under this prefix and linked with a presigned URL valid for DOWNLOAD_URL_EXPIRY
+# seconds; give the prefix an S3 lifecycle rule so old files are deleted
+DOWNLOAD_S3_DIR = os.getenv('DOWNLOAD_S3_DIR', ATHENA_S3_STAGING_DIR.rstrip('/') + "/downloads/")
+DOWNLOAD_URL_EXPIRY = int(os.getenv('DOWNLOAD_URL_EXPIRY', "3600"))
+
+# Daily rollup (departure_date x origin x destination x journey_type) answering metrics, the summary and
+# dimension lookups; finished partitions are added incrementally, at most once per refresh interval (seconds).
+# Opt-in: it creates and writes a table in ATHENA_DATABASE and files under ATHENA_ROLLUP_LOCATION
+ATHENA_ROLLUP_ENABLED = os.getenv('ATHENA_ROLLUP_ENABLED', "false").lower() in ("1", "true", "yes")
+# The default name carries a schema version: changing the rollup's columns needs a new table (and location)
+ATHENA_ROLLUP_TABLE = os.getenv('ATHENA_ROLLUP_TABLE', f"{ATHENA_TABLE}_daily_rollup_v2")
+ATHENA_ROLLUP_LOCATION = os.getenv('ATHENA_ROLLUP_LOCATION',
+                                   ATHENA_S3_STAGING_DIR.rstrip('/') + f"/rollup/{ATHENA_ROLLUP_TABLE}/")
+ATHENA_ROLLUP_REFRESH_INTERVAL = int(os.getenv('ATHENA_ROLLUP_REFRESH_INTERVAL', "3600"))
+
+# Fast approximate mode: metrics estimated from a TABLESAMPLE of the matching rows (percent of rows, method);
+# SYSTEM skips whole splits, so it scans less than BERNOULLI but its ± bounds are looser than shown
+APPROX_SAMPLE_PERCENT = float(os.getenv('APPROX_SAMPLE_PERCENT', "10"))
+APPROX_SAMPLE_METHOD = os.getenv('APPROX_SAMPLE_METHOD', "BERNOULLI")
+
+# Sidebar dropdowns: in-memory catalog of (journey_type, origin, destination) routes, refreshed from new
+# partitions at most this often (seconds)
+DIMENSION_CATALOG_REFRESH_INTERVAL = int(os.getenv('DIMENSION_CATALOG_REFRESH_INTERVAL', "3600"))
+
+# Flight code autocomplete: a local index of distinct codes, refreshed from new partitions at most this often (seconds)
+FLIGHT_INDEX_REFRESH_INTERVAL = int(os.getenv('FLIGHT_INDEX_REFRESH_INTERVAL', "3600"))
+FLIGHT_SUGGESTION_LIMIT = int(os.getenv('FLIGHT_SUGGESTION_LIMIT', "6"))
+
+# Charts tab: GROUP BY aggregates instead of raw rows (delay histogram bin width and clip, in minutes,
+# and the worst routes / flight codes shown, among those with at least CHART_MIN_FLIGHTS known delays)
+CHART_DELAY_BIN_MINUTES = int(os.getenv('CHART_DELAY_BIN_MINUTES', "15"))
+CHART_DELAY_CLIP_MINUTES = int(os.getenv('CHART_DELAY_CLIP_MINUTES', "240"))
+CHART_TOP_N = int(os.getenv('CHART_TOP_N', "15"))
+CHART_MIN_FLIGHTS = int(os.getenv('CHART_MIN_FLIGHTS', "5"))
+
+# AWS client tuning for the shared, process-wide connector
+ATHENA_MAX_POOL_CONNECTIONS = int(os.getenv('ATHENA_MAX_POOL_CONNECTIONS', "50"))  # HTTPS connections kept per client
+ATHENA_MAX_RETRY_ATTEMPTS = int(os.getenv('ATHENA_MAX_RETRY_ATTEMPTS', "10"))  # With adaptive (client-side rate limited) retries
+
+# Server-wide query scheduling: identical SQL in flight is shared, concurrency is capped and
+# interactive queries go before exports, which run in their own workgroup
+ATHENA_EXPORT_WORKGROUP = os.getenv('ATHENA_EXPORT_WORKGROUP', ATHENA_WORKGROUP)
+ATHENA_MAX_CONCURRENT_QUERIES = int(os.getenv('ATHENA_MAX_CONCURRENT_QUERIES', "15"))
+ATHENA_MAX_CONCURRENT_EXPORTS = int(os.getenv('ATHENA_MAX_CONCURRENT_EXPORTS', "3"))
+
+# Reuse of earlier Athena executions for identical SQL, by default and for today's still-changing partition (seconds)
+ATHENA_RESULT_REUSE_MAX_AGE = int(os.getenv('ATHENA_RESULT_REUSE_MAX_AGE', "3600"))
+ATHENA_RESULT_REUSE_TODAY_MAX_AGE = int(os.getenv('ATHENA_RESULT_REUSE_TODAY_MAX_AGE', "300"))
+ATHENA_RESULT_REUSE_HISTORY_MAX_AGE = int(os.getenv('ATHENA_RESULT_REUSE_HISTORY_MAX_AGE', str(7 * 24 * 3600)))
+
+# Longest a query may run before it is stopped (seconds); exports include the result download
+ATHENA_QUERY_TIMEOUT = float(os.getenv('ATHENA_QUERY_TIMEOUT', "300"))
+ATHENA_EXPORT_TIMEOUT = float(os.getenv('ATHENA_EXPORT_TIMEOUT', "1800"))
+
+# Completion polling: start fast, back off exponentially (with jitter) up to the max delay, in seconds
+ATHENA_POLL_INITIAL_DELAY = float(os.getenv('ATHENA_POLL_INITIAL_DELAY', "0.1"))
+ATHENA_POLL_MAX_DELAY = float(os.getenv('ATHENA_POLL_MAX_DELAY', "5.0"))
+
 # Default query to fetch all data
 DEFAULT_QUERY = f"""
 SELECT 
@@ -0,0 +1,255 @@
+import base64
+import hashlib
+import json
+import math
+import os
+import threading
+from datetime import date
+
+import pandas as pd
+
+from config import ATHENA_DATABASE, ATHENA_TABLE, SUMMARY_STATE_PATH, SUMMARY_SKETCH_PRECISION
+from query_filters import DELAY_HISTOGRAM_EDGES, day_string, delay_range_predicate, sql_literal
+
+# Columns whose distinct values are counted with sketches
+SKETCHED_COLUMNS = ('origin', 'destination', 'flight_code')
+
+
+def delay_buckets(edges=DELAY_HISTOGRAM_EDGES):
+    """[min, max) minute ranges between the histogram edges, open below the first and above the last"""
+    bounds = (None,) + tuple(edges) + (None,)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class HyperLogLog:
+    """Distinct-count sketch: 2^precision one-byte registers, merged by taking the register-wise max"""
+
+    def __init__(self, precision=SUMMARY_SKETCH_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << precision)
+
+    def add(self, value):
+        h = int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """A new sketch counting the union of both"""
+        return HyperLogLog(self.precision, bytes(max(a, b) for a, b in zip(self.registers, other.registers)))
+
+    def estimate(self):
+        m = len(self.registers)
+        raw = (0.7213 / (1 + 1.079 / m)) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities (a few hundred airports)
+            return m * math.log(m / zeros)
+        return raw
+
+    def to_json(self):
+        return base64.b64encode(bytes(self.registers)).decode('ascii')
+
+    @classmethod
+    def from_json(cls, data, precision=SUMMARY_SKETCH_PRECISION):
+        return cls(precision, base64.b64decode(data))
+
+
+class DataSummary:
+    """Data summary maintained incrementally from new departure_date partitions, persisted to local disk
+
+    Finished partitions (before today) are folded into the stored state once:
+    their record and date counts are added, and their distinct origins,
+    destinations and flight codes go into HyperLogLog sketches, which merge
+    without looking at older data again. Each day's records per delay bucket
+    are kept too, so delay histograms for any date range need no scan. Today's
+    (and any later) partition is still being written, so it is summarised
+    afresh on every refresh and merged in on top of the stored state.
+    """
+
+    def __init__(self, path=SUMMARY_STATE_PATH, precision=SUMMARY_SKETCH_PRECISION, today=date.today,
+                 delay_edges=DELAY_HISTOGRAM_EDGES):
+        self.path = path
+        self.precision = precision
+        self.today = today
+        self.delay_edges = list(delay_edges)
+        # _refresh_lock serialises refreshes; _lock guards the state, so snapshots never wait on Athena
+        self._refresh_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._state = self._load()
+        # Record and delay bucket counts of today's (and later) partitions as of the last refresh
+        self._recent_records = {}
+        self._recent_delays = {}
+
+    def build_queries(self):
+        """The day counts and distinct values of every partition after the stored state"""
+        table = f"{ATHENA_DATABASE}.{ATHENA_TABLE}"
+        through = self._state['through']
+        where = f"departure_date > {sql_literal(through)}" if through else "departure_date IS NOT NULL"
+        today = sql_literal(self.today().strftime('%Y-%m-%d'))
+        recent = f"CASE WHEN departure_date >= {today} THEN 1 ELSE 0 END"
+        values = ' UNION ALL '.join(f"""
+            SELECT '{column}' AS dimension, {column} AS value, {recent} AS recent
+            FROM {table}
+            WHERE {where} AND {column} IS NOT NULL
+            GROUP BY {column}, {recent}""" for column in SKETCHED_COLUMNS)
+        delays = ''.join(f",\n                   COUNT_IF({delay_range_predicate(low, high)}) AS delay_{i}"
+                         for i, (low, high) in enumerate(delay_buckets(self.delay_edges)))
+        return {
+            'days': f"""
+            SELECT departure_date, COUNT(*) AS records{delays}
+            FROM {table}
+            WHERE {where}
+            GROUP BY departure_date
+            """,
+            'values': values,
+        }
+
+    def refresh(self, run_queries):
+        """Fold new finished partitions into the stored state and return the summary (None if a query failed)
+
+        run_queries takes {name: query} and returns {name: DataFrame or None}.
+        """
+        with self._refresh_lock:
+            with self._lock:
+                queries = self.build_queries()
+            results = run_queries(queries)
+            days, values = results.get('days'), results.get('values')
+            if days is None or values is None:
+                return None
+            delay_columns = [f"delay_{i}" for i in range(len(self.delay_edges) + 1)]
+            if days.empty:
+                days = pd.DataFrame(columns=['departure_date', 'records', *delay_columns])
+            if values.empty:
+                values = pd.DataFrame(columns=['dimension', 'value', 'recent'])
+
+            today = self.today().strftime('%Y-%m-%d')
+            day_records = {day_string(day): int(records)
+                           for day, records in zip(days['departure_date'], days['records'])}
+            day_delays = {day_string(row[0]): [int(count) for count in row[1:]]
+                          for row in days[['departure_date', *delay_columns]].itertuples(index=False)}
+            finished = {day: records for day, records in day_records.items() if day < today}
+            recent = {day: records for day, records in day_records.items() if day >= today}
+            recent_values = values['recent'].astype(int) == 1
+            return self._fold(finished, recent, values, recent_values, day_delays)
+
+    def _fold(self, finished, recent, values, recent_values, day_delays):
+        """Add finished days to the stored state and return the summary including today's"""
+        with self._lock:
+            # Finished partitions never change, so they are added to the stored state for good
+            state = self._state
+            sketches = self._sketches()
+            for dimension, value in zip(values['dimension'][~recent_values], values['value'][~recent_values]):
+                sketches[dimension].add(value)
+            if finished:
+                state['total_records'] += sum(finished.values())
+                state['unique_dates'] += len(finished)
+                state['earliest_date'] = min(finished) if state['earliest_date'] is None \
+                    else min(state['earliest_date'], min(finished))
+                state['through'] = max(finished)
+                state['day_records'].update(finished)
+                state['day_delays'].update({day: day_delays[day] for day in finished})
+            self._recent_records = dict(recent)
+            self._recent_delays = {day: day_delays[day] for day in recent}
+            state['sketches'] = {column: sketch.to_json() for column, sketch in sketches.items()}
+            self._save()
+
+            # Today's partition is merged into a copy, since it will have grown by the next refresh
+            recent_sketches = {column: HyperLogLog(self.precision, sketch.registers)
+                               for column, sketch in sketches.items()}
+            for dimension, value in zip(values['dimension'][recent_values], values['value'][recent_values]):
+                recent_sketches[dimension].add(value)
+            return self._summary(recent_sketches, recent)
+
+    def snapshot(self):
+        """The summary as of the stored state, without querying (None before the first refresh)
+
+        It leaves out partitions newer than the state's last finished day.
+        """
+        with self._lock:
+            if self._state['through'] is None:
+                return None
+            return self._summary(self._sketches(), {})
+
+    def day_counts(self):
+        """Records per departure_date (YYYY-MM-DD) as far as the summary has seen, for sizing query chunks"""
+        with self._lock:
+            return {**self._state['day_records'], **self._recent_records}
+
+    def delay_histogram(self, date_from=None, date_to=None):
+        """Records per delay bucket on departure dates from date_from to date_to, without querying
+
+        A DataFrame of delay_min, delay_max (None for an open end) and records,
+        counting the days the summary has seen; None before the first refresh.
+        """
+        with self._lock:
+            day_delays = {**self._state['day_delays'], **self._recent_delays}
+        if not day_delays:
+            return None
+        counts = [0] * (len(self.delay_edges) + 1)
+        for day, buckets in day_delays.items():
+            if (date_from is None or day >= date_from) and (date_to is None or day <= date_to):
+                counts = [total + count for total, count in zip(counts, buckets)]
+        return pd.DataFrame([{'delay_min': low, 'delay_max': high, 'records': count}
+                             for (low, high), count in zip(delay_buckets(self.delay_edges), counts)])
+
+    def refresh_in_background(self, run_queries):
+        """Start a refresh in a background thread unless one is already running"""
+        if self._refresh_lock.locked():
+            return
+        threading.Thread(target=self.refresh, args=(run_queries,), daemon=True).start()
+
+    def _sketches(self):
+        """The stored sketches, decoded (lock held)"""
+        stored = self._state['sketches']
+        return {
+            column: HyperLogLog.from_json(stored[column], self.precision) if column in stored
+            else HyperLogLog(self.precision)
+            for column in SKETCHED_COLUMNS
+        }
+
+    def _summary(self, sketches, recent):
+        """One-row summary from the stored state, sketches and today's day counts (lock held)"""
+        state = self._state
+        dates = [day for day in (state['earliest_date'], state['through']) if day] + list(recent)
+        return pd.DataFrame([{
+            'total_records': state['total_records'] + sum(recent.values()),
+            'unique_dates': state['unique_dates'] + len(recent),
+            'earliest_date': min(dates) if dates else None,
+            'latest_date': max(dates) if dates else None,
+            'unique_origins': round(sketches['origin'].estimate()),
+            'unique_destinations': round(sketches['destination'].estimate()),
+            'unique_flights': round(sketches['flight_code'].estimate()),
+            # Relative standard error of the sketched distinct counts
+            'distinct_error': 1.04 / math.sqrt(1 << self.precision)
+        }])
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = {}
+        if state.get('precision') != self.precision or state.get('delay_edges') != self.delay_edges:
+            # Sketches of another size can't be merged, nor buckets with other edges; start over
+            state = {}
+        return {
+            'precision': self.precision,
+            'delay_edges': self.delay_edges,
+            'through': state.get('through'),
+            'total_records': state.get('total_records', 0),
+            'unique_dates': state.get('unique_dates', 0),
+            'earliest_date': state.get('earliest_date'),
+            'sketches': state.get('sketches', {}),
+            'day_records': state.get('day_records', {}),
+            'day_delays': state.get('day_delays', {})
+        }
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._state, f)
+        os.replace(tmp_path, self.path)
@@ -17,6 +17,7 @@ headless = true
 port = 8501
 enableCORS = false
 enableXsrfProtection = false
+enableStaticServing = true
 
 [browser]
 gatherUsageStats = false
@@ -0,0 +1,79 @@
+import time
+from datetime import date
+
+from config import ATHENA_DATABASE, ATHENA_TABLE, DIMENSION_CATALOG_REFRESH_INTERVAL
+from incremental_index import IncrementalIndex
+
+# Sidebar dimensions, each narrowing the next
+CATALOG_DIMENSIONS = ('journey_type', 'origin', 'destination')
+
+
+class DimensionCatalog(IncrementalIndex):
+    """Every (journey_type, origin, destination) route in the fact table, kept in memory as a route graph
+
+    One grouped query fills all three sidebar dropdowns, and destinations are
+    narrowed by the chosen origin and journey type without another query. The
+    first build reads the daily rollup when it is ready (only days after it from
+    the raw table), and later refreshes only read new partitions.
+    """
+
+    def __init__(self, run_query, rollup=None, today=date.today, refresh_interval=DIMENSION_CATALOG_REFRESH_INTERVAL,
+                 clock=time.monotonic):
+        super().__init__(run_query, today=today, refresh_interval=refresh_interval, clock=clock)
+        self.rollup = rollup
+        # journey_type -> origin -> set of destinations (None where a row had no value)
+        self._graph = {}
+
+    def build_query(self):
+        """The distinct routes in the partitions not read yet"""
+        if self.through is None and self.rollup is not None:
+            rollup_query = self.rollup.routes_query()
+            if rollup_query is not None:
+                return rollup_query
+        return f"""
+        SELECT journey_type, origin, destination
+        FROM {ATHENA_DATABASE}.{ATHENA_TABLE}
+        WHERE {self.new_partitions()}
+        GROUP BY journey_type, origin, destination
+        """
+
+    def _fold(self, result):
+        for journey_type, origin, destination in zip(result['journey_type'], result['origin'],
+                                                     result['destination']):
+            self._graph.setdefault(_value(journey_type), {}).setdefault(_value(origin), set()) \
+                .add(_value(destination))
+
+    def journey_types(self):
+        """Every journey type, sorted"""
+        with self._lock:
+            return _sorted(self._graph)
+
+    def origins(self, journey_type=None):
+        """Origins with a route of journey_type (any journey type if None), sorted"""
+        with self._lock:
+            return _sorted({origin for routes in self._journeys(journey_type) for origin in routes})
+
+    def destinations(self, journey_type=None, origin=None):
+        """Destinations reached from origin with journey_type (either one any if None), sorted"""
+        with self._lock:
+            return _sorted({
+                destination
+                for routes in self._journeys(journey_type)
+                for route_origin, destinations in routes.items() if origin is None or route_origin == origin
+                for destination in destinations
+            })
+
+    def _journeys(self, journey_type):
+        """Origin -> destinations maps of journey_type, or of every journey type (lock held)"""
+        if journey_type is None:
+            return list(self._graph.values())
+        return [self._graph[journey_type]] if journey_type in self._graph else []
+
+
+def _value(value):
+    """A dimension value from a result row, None for SQL NULL"""
+    return None if value is None or value != value else value
+
+
+def _sorted(values):
+    return sorted(value for value in values if value is not None)
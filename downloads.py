@@ -0,0 +1,133 @@
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import DOWNLOAD_BATCH_SIZE, DOWNLOAD_DIR, DOWNLOAD_MAX_FILES
+
+# Download formats offered in the app: label -> (file extension, MIME type)
+DOWNLOAD_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'CSV (gzip)': ('csv.gz', 'application/gzip'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def iter_frame_batches(df, batch_size=DOWNLOAD_BATCH_SIZE):
+    """Slice a DataFrame into batches of batch_size rows (views, not copies)"""
+    for start in range(0, len(df), batch_size):
+        yield df.iloc[start:start + batch_size]
+
+
+def write_download(batches, path, fmt='CSV'):
+    """Write DataFrame batches to path in the given download format, one batch at a time; returns the row count
+
+    Only the current batch (plus the writer's buffer) is held in memory, so
+    exports of millions of rows stay flat however large the file gets.
+    """
+    if fmt not in DOWNLOAD_FORMATS:
+        raise ValueError(f"Unknown download format: {fmt}")
+    
+    rows = 0
+    if fmt == 'Parquet':
+        writer = None
+        try:
+            for batch in batches:
+                if writer is None:
+                    table = pa.Table.from_pandas(batch, preserve_index=False)
+                    writer = pq.ParquetWriter(path, table.schema, compression='snappy')
+                else:
+                    # Later batches follow the first one's schema (e.g. a column that was all null so far)
+                    table = pa.Table.from_pandas(batch, schema=writer.schema, preserve_index=False)
+                writer.write_table(table)
+                rows += len(batch)
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            # Nothing matched: still hand back a valid (empty) file
+            pq.write_table(pa.table({}), path)
+        return rows
+    
+    opener = gzip.open if fmt == 'CSV (gzip)' else open
+    with opener(path, 'wt', newline='', encoding='utf-8') as f:
+        for batch in batches:
+            batch.to_csv(f, index=False, header=rows == 0)
+            rows += len(batch)
+    return rows
+
+
+class SessionDownloads:
+    """Download files one session has generated, reused across reruns and deleted with the session
+
+    Files live in a per-session scratch dir; past max_files the least recently
+    used is deleted. The dir is removed when the store is garbage collected.
+    """
+
+    def __init__(self, directory=DOWNLOAD_DIR, max_files=DOWNLOAD_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+        # key -> (path, rows)
+        self._files = OrderedDict()
+        self._scratch_dir = None
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """(path, rows) of the file written for key, or None"""
+        with self._lock:
+            entry = self._files.get(key)
+            if entry is None or not os.path.exists(entry[0]):
+                self._files.pop(key, None)
+                return None
+            self._files.move_to_end(key)
+            return entry
+
+    def write(self, key, batches, fmt='CSV'):
+        """Write batches to a new file for key in the given format and return (path, rows)"""
+        extension, _ = DOWNLOAD_FORMATS[fmt]
+        with self._lock:
+            path = os.path.join(self._scratch(), f"{self._counter}.{extension}")
+            self._counter += 1
+        try:
+            rows = write_download(batches, path, fmt)
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        
+        with self._lock:
+            self._remove(key)
+            self._files[key] = (path, rows)
+            while len(self._files) > self.max_files:
+                self._remove(next(iter(self._files)))
+        return path, rows
+
+    def get_or_write(self, key, make_batches, fmt='CSV'):
+        """The file for key, written from make_batches() only if there isn't one yet"""
+        entry = self.get(key)
+        if entry is None:
+            entry = self.write(key, make_batches(), fmt)
+        return entry
+
+    def _scratch(self):
+        if self._scratch_dir is None:
+            if self.directory:
+                os.makedirs(self.directory, exist_ok=True)
+            self._scratch_dir = tempfile.mkdtemp(prefix='downloads-', dir=self.directory)
+            weakref.finalize(self, shutil.rmtree, self._scratch_dir, True)
+        return self._scratch_dir
+
+    def _remove(self, key):
+        entry = self._files.pop(key, None)
+        if entry is not None:
+            try:
+                os.remove(entry[0])
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,82 @@
+import bisect
+import difflib
+import time
+from datetime import date
+
+from config import ATHENA_DATABASE, ATHENA_TABLE, FLIGHT_INDEX_REFRESH_INTERVAL, FLIGHT_SUGGESTION_LIMIT
+from incremental_index import IncrementalIndex
+from query_filters import day_string
+
+
+class FlightCodeIndex(IncrementalIndex):
+    """Distinct flight codes in a sorted array, for instant prefix and fuzzy autocomplete without Athena
+
+    Each code keeps the first and last departure_date it was seen on, so
+    suggestions can be narrowed to a date window (codes whose span overlaps
+    it). The index is built by one GROUP BY flight_code query; later refreshes
+    only read partitions from yesterday on, since earlier ones never change,
+    and widen the spans of the codes they contain.
+    """
+
+    def __init__(self, run_query, today=date.today, refresh_interval=FLIGHT_INDEX_REFRESH_INTERVAL,
+                 clock=time.monotonic):
+        super().__init__(run_query, today=today, refresh_interval=refresh_interval, clock=clock)
+        # Upper-cased codes in sorted order and, at the same positions, the codes as stored
+        self._keys = []
+        self._codes = []
+        # Code -> [first departure_date, last departure_date]
+        self._spans = {}
+
+    def build_query(self):
+        """The span of every flight code in the partitions not read yet"""
+        return f"""
+        SELECT flight_code, MIN(departure_date) AS first_day, MAX(departure_date) AS last_day
+        FROM {ATHENA_DATABASE}.{ATHENA_TABLE}
+        WHERE {self.new_partitions()} AND flight_code IS NOT NULL
+        GROUP BY flight_code
+        """
+
+    def _fold(self, result):
+        spans = dict(self._spans)
+        for code, first_day, last_day in zip(result['flight_code'], result['first_day'], result['last_day']):
+            first_day, last_day = day_string(first_day), day_string(last_day)
+            span = spans.get(code)
+            spans[code] = [min(span[0], first_day), max(span[1], last_day)] if span else [first_day, last_day]
+        codes = sorted(spans, key=str.upper)
+        self._spans = spans
+        self._codes = codes
+        self._keys = [code.upper() for code in codes]
+
+    def __contains__(self, code):
+        with self._lock:
+            return code in self._spans
+
+    def __len__(self):
+        with self._lock:
+            return len(self._codes)
+
+    def complete(self, text, date_from=None, date_to=None, limit=FLIGHT_SUGGESTION_LIMIT):
+        """Codes starting with text (any case), then close misspellings, among codes flown in the window"""
+        key = text.strip().upper()
+        if not key:
+            return []
+        with self._lock:
+            keys, codes, spans = self._keys, self._codes, self._spans
+
+        def in_window(code):
+            first_day, last_day = spans[code]
+            return (date_to is None or first_day <= date_to) and (date_from is None or last_day >= date_from)
+
+        matches = []
+        for i in range(bisect.bisect_left(keys, key), len(keys)):
+            if not keys[i].startswith(key) or len(matches) == limit:
+                break
+            if in_window(codes[i]):
+                matches.append(codes[i])
+        if len(matches) < limit:
+            # Typos: the closest codes by edit similarity
+            candidates = {keys[i]: codes[i] for i in range(len(codes)) if in_window(codes[i])}
+            for close in difflib.get_close_matches(key, candidates, n=limit - len(matches), cutoff=0.6):
+                if candidates[close] not in matches:
+                    matches.append(candidates[close])
+        return matches
@@ -0,0 +1,79 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import date, timedelta
+
+from query_filters import sql_literal
+
+
+class IncrementalIndex(ABC):
+    """In-memory index over the fact table, folded from new partitions and refreshed in the background
+
+    Subclasses build the query for the partitions after through (build_query)
+    and fold its result in (_fold). Partitions before today never change, so
+    after a refresh only today's onwards are read again.
+    """
+
+    def __init__(self, run_query, today=date.today, refresh_interval=3600, clock=time.monotonic):
+        self.run_query = run_query
+        self.today = today
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        # Every partition up to this departure_date has been read (None until the first refresh)
+        self.through = None
+        self.last_error = None
+        self._refreshed_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def ready(self):
+        """Whether the index has been built"""
+        return self.through is not None
+
+    def new_partitions(self):
+        """Predicate for the partitions not read yet"""
+        return f"departure_date > {sql_literal(self.through)}" if self.through else "departure_date IS NOT NULL"
+
+    @abstractmethod
+    def build_query(self):
+        """The query for the partitions not read yet (new_partitions)"""
+
+    @abstractmethod
+    def _fold(self, result):
+        """Merge a build_query result into the index (lock held)"""
+
+    def refresh(self):
+        """Fold new partitions into the index"""
+        with self._refresh_lock:
+            through = (self.today() - timedelta(days=1)).strftime('%Y-%m-%d')
+            result = self.run_query(self.build_query())
+            with self._lock:
+                if result is not None:
+                    self._fold(result)
+                self.through = through
+                self._refreshed_at = self.clock()
+
+    def maybe_refresh(self):
+        """Start a background refresh if the index wasn't refreshed within the refresh interval"""
+        with self._lock:
+            if self._refreshing:
+                return
+            if self._refreshed_at is not None and self.clock() - self._refreshed_at < self.refresh_interval:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+            self.last_error = None
+        except Exception as e:
+            # Answers keep coming from what is indexed; retried next interval
+            self.last_error = e
+            with self._lock:
+                self._refreshed_at = self.clock()
+        finally:
+            with self._lock:
+                self._refreshing = False
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+from approximate import DELAY_PERCENTILES
+from charts import chart_frames
+from config import LOCAL_ENGINE_MAX_ROWS
+from query_filters import DELAY_COLUMN, EQUALITY_COLUMNS, compile_filters
+
+# Equality and flight code filters answered from dictionary-encoded columns
+INDEXED_COLUMNS = EQUALITY_COLUMNS + ('flight_code',)
+
+
+class DictionaryIndex:
+    """Dictionary-encoded column with lazily built per-value bitmaps"""
+
+    def __init__(self, values):
+        self.codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        self.lookup = {value: code for code, value in enumerate(uniques)}
+        self._bitmaps = {}
+
+    def bitmap(self, value):
+        """Boolean mask of the rows equal to value"""
+        code = self.lookup.get(value)
+        if code is None:
+            return np.zeros(len(self.codes), dtype=bool)
+        if code not in self._bitmaps:
+            self._bitmaps[code] = self.codes == code
+        return self._bitmaps[code]
+
+    def matching(self, values=(), prefixes=()):
+        """Boolean mask of the rows equal to one of values or (for strings) starting with one of prefixes"""
+        wanted = {value for value in values if value in self.lookup}
+        if prefixes:
+            wanted.update(value for value in self.lookup if isinstance(value, str) and value.startswith(prefixes))
+        return np.isin(self.codes, [self.lookup[value] for value in wanted])
+
+
+class LocalQueryEngine:
+    """Answers narrower filters from an in-memory columnar copy of a complete result
+
+    The window is every row matching some base filter (a date-range load, or any
+    result that came back under its LIMIT). Any request the base filter covers is
+    answered with vectorized masks instead of a new Athena query.
+    """
+
+    def __init__(self, window_df, base_filter):
+        self.base_filter = compile_filters(base_filter)
+        # Kept in ORDER BY order_c order so a mask plus head() matches the SQL LIMIT
+        self.df = window_df.sort_values('order_c', kind='mergesort').reset_index(drop=True) \
+            if not window_df.empty else window_df
+        self.indexes = {
+            column: DictionaryIndex(self.df[column]) for column in INDEXED_COLUMNS if column in self.df
+        }
+        if not self.df.empty:
+            self.days = pd.to_datetime(self.df['departure_date']).values.astype('datetime64[D]')
+            self.delay = pd.to_numeric(self.df['dep_delayed'], errors='coerce').to_numpy(dtype=float)
+            # The column delay range filters compare, as in the SQL
+            self.delay_minutes = pd.to_numeric(self.df[DELAY_COLUMN], errors='coerce').to_numpy(dtype=float)
+            self.orders = pd.to_numeric(self.df['order_c'], errors='coerce').to_numpy(dtype=float)
+            self.revenue = pd.to_numeric(self.df['selling_price_sum'], errors='coerce').to_numpy(dtype=float)
+
+    @classmethod
+    def from_window(cls, window_df, filters):
+        """Build an engine for a complete result, or None if it's too large to keep"""
+        if window_df is None or len(window_df) > LOCAL_ENGINE_MAX_ROWS:
+            return None
+        return cls(window_df, filters)
+
+    def covers(self, filters):
+        """Whether a request can be answered entirely from this window"""
+        return self.base_filter.covers(compile_filters(filters))
+
+    def _mask(self, filters):
+        """Combined boolean mask for a covered request"""
+        compiled = compile_filters(filters)
+        mask = np.ones(len(self.df), dtype=bool)
+        if self.df.empty:
+            return mask
+        if compiled.date_from:
+            mask &= self.days >= np.datetime64(compiled.date_from)
+        if compiled.date_to:
+            mask &= self.days <= np.datetime64(compiled.date_to)
+        if compiled.departure_dates:
+            mask &= np.isin(self.days, np.array(compiled.departure_dates, dtype='datetime64[D]'))
+        for column in EQUALITY_COLUMNS:
+            value = getattr(compiled, column)
+            if column in self.indexes and value and value != getattr(self.base_filter, column):
+                mask &= self.indexes[column].bitmap(value)
+        if compiled.flight_code and compiled.flight_code != self.base_filter.flight_code:
+            mask &= self.indexes['flight_code'].matching(*compiled.flight_code_terms)
+        # NaN compares False, like SQL NULL
+        if compiled.delay_min is not None and compiled.delay_min != self.base_filter.delay_min:
+            mask &= self.delay_minutes >= compiled.delay_min
+        if compiled.delay_max is not None and compiled.delay_max != self.base_filter.delay_max:
+            mask &= self.delay_minutes < compiled.delay_max
+        return mask
+
+    def filter(self, filters, limit=50000):
+        """Rows matching a covered request, in order_c order"""
+        rows = self.df[self._mask(filters)]
+        if limit is not None:
+            rows = rows.head(limit)
+        return rows.reset_index(drop=True)
+
+    def metrics(self, filters):
+        """Same columns as AthenaConnector.get_filtered_metrics, computed locally"""
+        mask = self._mask(filters)
+        total_count = int(mask.sum())
+        if self.df.empty or total_count == 0:
+            metrics = {'total_count': 0, 'avg_delay': np.nan, 'total_orders': np.nan, 'total_revenue': np.nan}
+            metrics.update({name: np.nan for name, _ in DELAY_PERCENTILES})
+            return pd.DataFrame([metrics])
+        delay = self.delay[mask]
+        known_delay = delay[~np.isnan(delay)]
+        metrics = {
+            'total_count': total_count,
+            'avg_delay': known_delay.mean() if len(known_delay) else np.nan,
+            'total_orders': np.nansum(self.orders[mask]),
+            'total_revenue': np.nansum(self.revenue[mask])
+        }
+        # Exact here, since every row is at hand
+        for name, quantile in DELAY_PERCENTILES:
+            metrics[name] = np.percentile(known_delay, quantile * 100) if len(known_delay) else np.nan
+        return pd.DataFrame([metrics])
+
+    def charts(self, filters):
+        """Same frames as the AthenaConnector.build_chart_queries results, computed locally"""
+        return chart_frames(self.df[self._mask(filters)])
@@ -0,0 +1,186 @@
+import logging
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from config import (
+    PARTITION_CACHE_TODAY_TTL,
+    PARTITION_CACHE_HISTORY_TTL,
+    ATHENA_RESULT_REUSE_TODAY_MAX_AGE,
+    ATHENA_RESULT_REUSE_HISTORY_MAX_AGE,
+    SCATTER_TARGET_ROWS,
+    SCATTER_MAX_CHUNKS
+)
+from query_filters import compile_filters
+
+logger = logging.getLogger(__name__)
+
+
+def date_range_days(filters):
+    """The departure_date partitions covered by a closed date_from/date_to range, or None"""
+    if not filters.get('date_from') or not filters.get('date_to'):
+        return None
+    start = datetime.strptime(filters['date_from'], '%Y-%m-%d').date()
+    end = datetime.strptime(filters['date_to'], '%Y-%m-%d').date()
+    return [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((end - start).days + 1)]
+
+
+def days_query(filters, build_query, days):
+    """The unordered, unlimited filtered query restricted to the given departure dates"""
+    day_filters = {key: value for key, value in filters.items() if key not in ('date_from', 'date_to')}
+    day_filters['departure_dates'] = list(days)
+    return build_query(day_filters, limit=None, ordered=False)
+
+
+class PartitionedQuery:
+    """A date-range query split into cached partitions and one query for the days still missing"""
+
+    def __init__(self, partition_cache, filters, build_query, days, cached, limit):
+        self.partition_cache = partition_cache
+        self.filters = filters
+        self.build_query = build_query
+        self.days = days
+        self.cached = cached
+        self.missing = [day for day in days if day not in cached]
+        self.limit = limit
+        # Every row in the range (before ORDER BY/LIMIT), set by combine()
+        self.window = None
+        # One query for every missing day, or None when the whole range is cached
+        self.sql = days_query(filters, build_query, self.missing) if self.missing else None
+
+    def chunk_queries(self, chunks):
+        """One query per chunk of missing days, as {name: (days, sql)}, for running them concurrently"""
+        return {f"chunk:{days[0]}": (days, days_query(self.filters, self.build_query, days)) for days in chunks}
+
+    def add(self, fetched, days):
+        """Cache the rows fetched for some of the missing days (a chunk), so they count as loaded"""
+        fetched_days = fetched['departure_date'].astype(str).str[:10] if not fetched.empty else None
+        for day in days:
+            day_df = fetched if fetched_days is None else fetched[fetched_days == day].reset_index(drop=True)
+            self.partition_cache.put(days_query(self.filters, self.build_query, [day]), day, day_df)
+            self.cached[day] = day_df
+
+    def partial(self):
+        """Every row of the days loaded so far, in day order (for showing progress)"""
+        non_empty = [self.cached[day] for day in self.days if day in self.cached and not self.cached[day].empty]
+        return pd.concat(non_empty, ignore_index=True) if non_empty else pd.DataFrame()
+
+    def combine(self, fetched):
+        """Cache the fetched days and merge them with the cached ones; None if any day failed to load"""
+        if fetched is not None:
+            self.add(fetched, [day for day in self.missing if day not in self.cached])
+        if any(day not in self.cached for day in self.days):
+            return None
+
+        df = self.window = self.partial()
+        if self.limit is not None and not df.empty:
+            # Same rows the single ORDER BY order_c LIMIT query would have returned
+            df = df.sort_values('order_c', kind='mergesort').head(self.limit).reset_index(drop=True)
+        return df
+
+
+def estimated_rows(days, day_counts):
+    """Rows in the given departure_date partitions per day_counts (unknown days assumed average); None without counts"""
+    if not day_counts:
+        return None
+    average = sum(day_counts.values()) / len(day_counts)
+    return sum(day_counts.get(day, average) for day in days)
+
+
+def scatter_chunks(days, day_counts=None, target_rows=SCATTER_TARGET_ROWS, max_chunks=SCATTER_MAX_CHUNKS):
+    """Split days into partition-aligned chunks (month, week or single day) of about target_rows each
+
+    The coarsest granularity whose largest chunk stays within target_rows is
+    used, and neighbouring chunks are merged down to at most max_chunks, which
+    caps how many queries one request runs at once. day_counts (departure_date ->
+    rows) sizes the chunks; days without a count are assumed average, and with
+    no counts at all a month is assumed to be about target_rows. A range that
+    fits in one chunk comes back as a single chunk.
+    """
+    days = sorted(days)
+    if not days:
+        return []
+    day_counts = day_counts or {}
+    known = [day_counts[day] for day in days if day in day_counts]
+    default = sum(known) / len(known) if known else target_rows // 31
+    rows = {day: day_counts.get(day, default) for day in days}
+    if sum(rows.values()) <= target_rows:
+        return [days]
+
+    granularities = (
+        lambda day: day[:7],
+        lambda day: datetime.strptime(day, '%Y-%m-%d').isocalendar()[:2],
+        lambda day: day,
+    )
+    for granularity in granularities:
+        chunks = []
+        for day in days:
+            if chunks and granularity(chunks[-1][-1]) == granularity(day):
+                chunks[-1].append(day)
+            else:
+                chunks.append([day])
+        if max(sum(rows[day] for day in chunk) for chunk in chunks) <= target_rows:
+            break
+
+    if len(chunks) > max_chunks:
+        # Merge neighbours into max_chunks runs of roughly equal rows
+        per_run = sum(rows.values()) / max_chunks
+        runs = [[]]
+        run_rows = 0
+        for chunk in chunks:
+            if runs[-1] and run_rows >= per_run and len(runs) < max_chunks:
+                runs.append([])
+                run_rows = 0
+            runs[-1].extend(chunk)
+            run_rows += sum(rows[day] for day in chunk)
+        chunks = runs
+    return chunks
+
+
+class PartitionCache:
+    """Filtered results cached per departure_date partition, so widening or sliding a range only fetches new days
+
+    Entries live in the shared ResultCache, keyed by the single-day form of the
+    filtered query. Past days never change and get a long TTL; today's (and any
+    later) partition is still being written and gets a short one.
+    """
+
+    def __init__(self, result_cache, today_ttl=PARTITION_CACHE_TODAY_TTL,
+                 history_ttl=PARTITION_CACHE_HISTORY_TTL, today=date.today,
+                 today_max_age=ATHENA_RESULT_REUSE_TODAY_MAX_AGE, history_max_age=ATHENA_RESULT_REUSE_HISTORY_MAX_AGE):
+        self.result_cache = result_cache
+        self.today_ttl = today_ttl
+        self.history_ttl = history_ttl
+        self.today = today
+        self.today_max_age = today_max_age
+        self.history_max_age = history_max_age
+
+    def plan(self, filters, build_query, limit=None):
+        """Split a filtered date-range query into cached days and missing days; None without a closed range"""
+        days = date_range_days(filters)
+        if days is None:
+            return None
+
+        cached = {}
+        for day in days:
+            df = self.result_cache.get(days_query(filters, build_query, [day]))
+            if df is not None:
+                cached[day] = df
+        return PartitionedQuery(self, filters, build_query, days, cached, limit)
+
+    def put(self, day_query, day, df):
+        """Cache one day's filtered rows with the TTL its partition deserves"""
+        ttl = self.today_ttl if day >= self.today().strftime('%Y-%m-%d') else self.history_ttl
+        try:
+            self.result_cache.put(day_query, df, ttl=ttl)
+        except Exception:
+            # The rows are already in hand; the day is only queried again next time
+            logger.exception("Could not cache a departure_date partition")
+
+    def reuse_max_age(self, filters):
+        """How old a reused Athena execution for filters may be: short if today's partition can match"""
+        compiled = compile_filters(filters)
+        last_day = compiled.date_to or (compiled.departure_dates[-1] if compiled.departure_dates else None)
+        if last_day is None or last_day >= self.today().strftime('%Y-%m-%d'):
+            return self.today_max_age
+        return self.history_max_age
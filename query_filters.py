@@ -0,0 +1,242 @@
+import math
+import numbers
+import re
+from datetime import datetime
+
+# Delay ranges are compared on the numeric delay column, so no row is cast
+DELAY_COLUMN = 'cal_dep_delayed_minutes'
+
+# The former sidebar delay buckets, still accepted as dep_delayed, as [min, max) minute ranges (None is open)
+DELAY_BUCKETS = {
+    'Less than 15 minutes': (None, 15),
+    '15-30 minutes': (15, 30),
+    '30-60 minutes': (30, 60),
+    'Greater than 60 minutes': (60, None),
+}
+
+# Bucket edges (minutes) of the precomputed delay histogram; the sidebar delay range stops on these
+DELAY_HISTOGRAM_EDGES = (0, 15, 30, 45, 60, 90, 120, 180, 240)
+
+# Columns filtered by plain equality, in the order they appear in the WHERE clause (flight_code goes after them)
+EQUALITY_COLUMNS = ('journey_type', 'origin', 'destination')
+
+
+def sql_literal(value):
+    """Quote a value as a SQL string literal"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def keyset_literal(value):
+    """SQL literal for a sort key value taken from a result row (numbers unquoted)"""
+    if isinstance(value, numbers.Number) and not isinstance(value, bool):
+        return str(value)
+    return sql_literal(value)
+
+
+def keyset_condition(after):
+    """Predicate for the rows after an (order_c, join_key) cursor in ORDER BY order_c NULLS LAST, join_key order
+
+    A None order_c means the cursor is already among the trailing NULL order_c rows.
+    """
+    order_c, join_key = after
+    key = keyset_literal(join_key)
+    if order_c is None:
+        return f"(order_c IS NULL AND join_key > {key})"
+    value = keyset_literal(order_c)
+    return f"(order_c > {value} OR (order_c = {value} AND join_key > {key}) OR order_c IS NULL)"
+
+
+def flight_code_terms(value):
+    """Split a flight code filter into (codes, prefixes): terms are separated by commas or spaces, and a
+    trailing * makes a term an airline or number prefix (QR-*)
+    """
+    codes, prefixes = set(), set()
+    for term in re.split(r'[\s,]+', value or ''):
+        if term.endswith('*'):
+            prefixes.add(term.rstrip('*'))
+        elif term:
+            codes.add(term)
+    return tuple(sorted(codes)), tuple(sorted(prefixes))
+
+
+def flight_code_predicate(codes, prefixes):
+    """SQL predicate for flight codes equal to one of codes or starting with one of prefixes"""
+    conditions = []
+    if len(codes) == 1:
+        conditions.append(f"flight_code = {sql_literal(codes[0])}")
+    elif codes:
+        conditions.append(f"flight_code IN ({', '.join(sql_literal(code) for code in codes)})")
+    for prefix in prefixes:
+        pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        conditions.append(f"flight_code LIKE {sql_literal(pattern)} ESCAPE '\\'")
+    return conditions[0] if len(conditions) == 1 else f"({' OR '.join(conditions)})"
+
+
+def delay_range_predicate(delay_min, delay_max):
+    """SQL predicate for delays in [delay_min, delay_max) minutes (either end None for open); NULL never matches"""
+    conditions = []
+    if delay_min is not None:
+        conditions.append(f"{DELAY_COLUMN} >= {delay_min}")
+    if delay_max is not None:
+        conditions.append(f"{DELAY_COLUMN} < {delay_max}")
+    return " AND ".join(conditions)
+
+
+def _parse_minutes(value):
+    """Validate a delay bound and return it as an int when whole, so equal bounds compile alike"""
+    if value is None or value == '':
+        return None
+    minutes = float(value)
+    if not math.isfinite(minutes):
+        # Open ends of the sidebar range
+        return None
+    return int(minutes) if minutes.is_integer() else minutes
+
+
+def day_string(value):
+    """A departure_date as it comes back in a result (date, timestamp or string) in YYYY-MM-DD form"""
+    return value.strftime('%Y-%m-%d') if hasattr(value, 'strftime') else str(value)[:10]
+
+
+def _parse_date(value):
+    """Validate a YYYY-MM-DD date (or date object) and return it in canonical form"""
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%d')
+    return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+
+
+class CompiledFilter:
+    """Canonical, hashable form of the sidebar filters dict
+
+    Empty values are dropped, dates are validated and values are quoted once, so
+    two dicts that mean the same thing compile to equal objects with the same SQL.
+    """
+
+    FIELDS = ('date_from', 'date_to', 'departure_dates') + EQUALITY_COLUMNS + \
+        ('flight_code', 'delay_min', 'delay_max')
+
+    def __init__(self, date_from=None, date_to=None, departure_dates=None, journey_type=None,
+                 origin=None, destination=None, flight_code=None, delay_min=None, delay_max=None,
+                 dep_delayed=None):
+        self.date_from = _parse_date(date_from) if date_from else None
+        self.date_to = _parse_date(date_to) if date_to else None
+        self.departure_dates = tuple(sorted({_parse_date(day) for day in departure_dates})) \
+            if departure_dates else None
+        self.journey_type = journey_type or None
+        self.origin = origin or None
+        self.destination = destination or None
+        # Codes and prefixes in canonical order, so 'SV-2, QR-*' and 'QR-* SV-2' compile alike
+        codes, prefixes = flight_code_terms(flight_code)
+        self.flight_code = None if '' in prefixes or not (codes or prefixes) \
+            else ', '.join(codes + tuple(f"{prefix}*" for prefix in prefixes))
+        if dep_delayed not in (None, '', 'All'):
+            if dep_delayed not in DELAY_BUCKETS:
+                raise ValueError(f"Unknown delay range: {dep_delayed}")
+            delay_min, delay_max = DELAY_BUCKETS[dep_delayed]
+        self.delay_min = _parse_minutes(delay_min)
+        self.delay_max = _parse_minutes(delay_max)
+        if self.delay_min is not None and self.delay_max is not None and self.delay_min >= self.delay_max:
+            raise ValueError(f"Empty delay range: {self.delay_min} to {self.delay_max}")
+
+    @classmethod
+    def compile(cls, filters):
+        """Compile a filters dict (a CompiledFilter is returned unchanged)"""
+        if isinstance(filters, cls):
+            return filters
+        unknown = set(filters) - set(cls.FIELDS) - {'dep_delayed'}
+        if unknown:
+            raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+        return cls(**filters)
+
+    @property
+    def key(self):
+        return tuple(getattr(self, field) for field in self.FIELDS)
+
+    def __eq__(self, other):
+        return isinstance(other, CompiledFilter) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f"CompiledFilter({self.to_dict()!r})"
+
+    @property
+    def flight_code_terms(self):
+        """(codes, prefixes) of the flight code filter"""
+        return flight_code_terms(self.flight_code)
+
+    @property
+    def has_delay_range(self):
+        return self.delay_min is not None or self.delay_max is not None
+
+    def to_dict(self):
+        """The filters dict this compiles from (only the fields that are set)"""
+        values = {field: getattr(self, field) for field in self.FIELDS if getattr(self, field) is not None}
+        if 'departure_dates' in values:
+            values['departure_dates'] = list(values['departure_dates'])
+        return values
+
+    def where_clause(self):
+        """SQL predicate for the filters, partition filters first for pruning"""
+        conditions = ["departure_date IS NOT NULL"]
+        if self.date_from:
+            conditions.append(f"departure_date >= {sql_literal(self.date_from)}")
+        if self.date_to:
+            conditions.append(f"departure_date <= {sql_literal(self.date_to)}")
+        if self.departure_dates:
+            conditions.append(f"departure_date IN ({', '.join(sql_literal(day) for day in self.departure_dates)})")
+        for column in EQUALITY_COLUMNS:
+            value = getattr(self, column)
+            if value:
+                conditions.append(f"{column} = {sql_literal(value)}")
+        if self.flight_code:
+            conditions.append(flight_code_predicate(*self.flight_code_terms))
+        if self.has_delay_range:
+            conditions.append(delay_range_predicate(self.delay_min, self.delay_max))
+        return " AND ".join(conditions)
+
+    def _covers_dates(self, other):
+        """Whether every departure_date other can match is one self can match"""
+        if self.departure_dates is not None:
+            return other.departure_dates is not None and set(other.departure_dates) <= set(self.departure_dates)
+        if other.departure_dates is not None:
+            return all(
+                (not self.date_from or day >= self.date_from) and (not self.date_to or day <= self.date_to)
+                for day in other.departure_dates
+            )
+        if self.date_from and (not other.date_from or other.date_from < self.date_from):
+            return False
+        if self.date_to and (not other.date_to or other.date_to > self.date_to):
+            return False
+        return True
+
+    def _covers_flight_codes(self, other):
+        """Whether every flight code other can match is one self can match"""
+        if self.flight_code is None:
+            return True
+        if other.flight_code is None:
+            return False
+        codes, prefixes = self.flight_code_terms
+        other_codes, other_prefixes = other.flight_code_terms
+        return all(code in codes or code.startswith(prefixes) for code in other_codes) and \
+            all(prefix.startswith(prefixes) for prefix in other_prefixes)
+
+    def covers(self, other):
+        """Whether every row matching other also matches self (self is the same or broader)"""
+        if not self._covers_dates(other) or not self._covers_flight_codes(other):
+            return False
+        for field in EQUALITY_COLUMNS:
+            value = getattr(self, field)
+            if value is not None and getattr(other, field) != value:
+                return False
+        if self.delay_min is not None and (other.delay_min is None or other.delay_min < self.delay_min):
+            return False
+        if self.delay_max is not None and (other.delay_max is None or other.delay_max > self.delay_max):
+            return False
+        return True
+
+
+def compile_filters(filters):
+    """Compile the sidebar filters dict into a CompiledFilter"""
+    return CompiledFilter.compile(filters)
@@ -0,0 +1,83 @@
+import itertools
+import threading
+import time
+
+
+class QueryCancelledError(Exception):
+    """Raised when waiting on a query whose handle was cancelled"""
+
+
+class QueryTimeoutError(QueryCancelledError):
+    """Raised when a query is still running when its handle's timeout is reached"""
+
+
+class QueryHandle:
+    """Cancellation and timeout for the Athena executions started by one call, or by one session
+
+    Each execution is attached with a callback that abandons it (stopping it in
+    Athena if nobody else is waiting on it). cancel() abandons everything still
+    attached and wakes any thread polling on the handle's behalf; waiting past
+    the timeout raises QueryTimeoutError, and the waiter abandons the execution.
+    """
+
+    def __init__(self, timeout=None, clock=time.monotonic):
+        self.timeout = timeout
+        self.clock = clock
+        self.deadline = clock() + timeout if timeout else None
+        self._cancelled = threading.Event()
+        self._executions = {}
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+
+    def attach(self, abandon):
+        """Track a running execution; returns a token for detach()"""
+        token = next(self._tokens)
+        with self._lock:
+            self._executions[token] = abandon
+        if self.cancelled:
+            # Cancelled while this was being set up
+            abandon = self.detach(token)
+            if abandon:
+                abandon()
+        return token
+
+    def detach(self, token):
+        """Stop tracking an execution; returns its abandon callback if it was still attached"""
+        with self._lock:
+            return self._executions.pop(token, None)
+
+    def abandon(self, token):
+        """Detach an execution and abandon it (no-op if already detached)"""
+        abandon = self.detach(token)
+        if abandon:
+            abandon()
+
+    def cancel(self):
+        """Abandon every attached execution and wake threads waiting on this handle"""
+        self._cancelled.set()
+        with self._lock:
+            pending = list(self._executions.values())
+            self._executions.clear()
+        for abandon in pending:
+            abandon()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def expired(self):
+        return self.deadline is not None and self.clock() >= self.deadline
+
+    def check(self):
+        """Raise if the handle was cancelled or its timeout has passed"""
+        if self.cancelled:
+            raise QueryCancelledError("Query was cancelled")
+        if self.expired():
+            raise QueryTimeoutError(f"Query did not finish within {self.timeout:g} seconds")
+
+    def sleep(self, delay):
+        """Wait up to delay seconds, returning early on cancel, then check()"""
+        if self.deadline is not None:
+            delay = min(delay, max(0.0, self.deadline - self.clock()))
+        self._cancelled.wait(delay)
+        self.check()
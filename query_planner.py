@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from config import PLANNER_MAX_WINDOWS, PLANNER_WAIT_TIMEOUT, PLANNER_WINDOW_MAX_AGE
+from query_filters import compile_filters
+
+
+class QueryPlanner:
+    """Remembers complete filtered results, loaded or still in flight, and reuses them for narrower requests
+
+    Each entry maps a CompiledFilter to a Future that resolves to a
+    LocalQueryEngine over every row matching it (or None if the load failed or
+    was too large). A request that an entry covers, e.g. origin=JED within the
+    same dates as an entry without an origin, is answered from that entry; if
+    the entry is still loading, the request waits for it instead of starting a
+    second Athena query.
+
+    An entry expires max_age(filters) seconds after its load started, so new
+    rows in partitions it covers (today's, mostly) show up again.
+    """
+
+    def __init__(self, max_windows=PLANNER_MAX_WINDOWS, max_age=None, clock=time.monotonic):
+        self.max_windows = max_windows
+        self.max_age = max_age or (lambda filters: PLANNER_WINDOW_MAX_AGE)
+        self.clock = clock
+        # CompiledFilter -> (Future, expiry time)
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, filters, timeout=PLANNER_WAIT_TIMEOUT):
+        """Return a LocalQueryEngine that can answer filters, waiting for a covering load in flight; else None
+
+        Loads in flight are waited on for at most timeout seconds in total.
+        """
+        compiled = compile_filters(filters)
+        with self._lock:
+            now = self.clock()
+            for key in [key for key, (_, expires_at) in self._windows.items() if expires_at <= now]:
+                del self._windows[key]
+            candidates = [(key, future) for key, (future, _) in self._windows.items() if key.covers(compiled)]
+        # Prefer windows that are already loaded over ones still in flight
+        candidates.sort(key=lambda item: not item[1].done())
+        deadline = time.monotonic() + timeout
+        for key, future in candidates:
+            try:
+                engine = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except Exception:
+                continue
+            if engine is not None:
+                with self._lock:
+                    if key in self._windows:
+                        self._windows.move_to_end(key)
+                return engine
+        return None
+
+    @contextmanager
+    def loading(self, filters):
+        """Register a load in flight for filters; the caller sets the Future's result to the finished engine
+
+        Waiting lookups are released with None if the block exits without a result.
+        """
+        compiled = compile_filters(filters)
+        future = Future()
+        expires_at = self.clock() + self.max_age(filters)
+        with self._lock:
+            self._windows[compiled] = (future, expires_at)
+            self._windows.move_to_end(compiled)
+            while len(self._windows) > self.max_windows:
+                self._windows.popitem(last=False)
+        try:
+            yield future
+        finally:
+            if not future.done():
+                future.set_result(None)
+            if future.result() is None:
+                with self._lock:
+                    if self._windows.get(compiled, (None,))[0] is future:
+                        del self._windows[compiled]
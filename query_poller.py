@@ -0,0 +1,77 @@
+import random
+import time
+
+from config import ATHENA_POLL_INITIAL_DELAY, ATHENA_POLL_MAX_DELAY
+
+TERMINAL_STATES = ('SUCCEEDED', 'FAILED', 'CANCELLED')
+
+# batch_get_query_execution accepts at most 50 IDs per call
+BATCH_SIZE = 50
+
+
+class QueryPoller:
+    """Waits for Athena query executions, polling fast at first and backing off with jitter"""
+
+    def __init__(self, athena_client, initial_delay=ATHENA_POLL_INITIAL_DELAY,
+                 max_delay=ATHENA_POLL_MAX_DELAY, backoff=2.0, jitter=0.5, sleep=time.sleep):
+        self.athena_client = athena_client
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.jitter = jitter
+        self.sleep = sleep
+
+    def delays(self):
+        """Yield successive poll delays: exponential growth capped at max_delay, with jitter"""
+        delay = self.initial_delay
+        while True:
+            yield random.uniform(delay * (1 - self.jitter), delay)
+            delay = min(delay * self.backoff, self.max_delay)
+
+    def poll(self, query_execution_ids):
+        """Fetch the current QueryExecution for each ID in as few calls as possible"""
+        executions = {}
+        ids = list(query_execution_ids)
+        for start in range(0, len(ids), BATCH_SIZE):
+            response = self.athena_client.batch_get_query_execution(
+                QueryExecutionIds=ids[start:start + BATCH_SIZE]
+            )
+            for execution in response.get('QueryExecutions', []):
+                executions[execution['QueryExecutionId']] = execution
+        return executions
+
+    def wait_any(self, query_execution_ids, handle=None):
+        """Block until at least one query finishes; return {id: QueryExecution} for all that have
+        
+        With a QueryHandle, waiting stops (raising) as soon as it is cancelled or times out.
+        """
+        ids = list(query_execution_ids)
+        if not ids:
+            return {}
+        for delay in self.delays():
+            if handle is not None:
+                handle.check()
+            executions = self.poll(ids)
+            finished = {
+                query_execution_id: execution
+                for query_execution_id, execution in executions.items()
+                if execution['Status']['State'] in TERMINAL_STATES
+            }
+            if finished:
+                return finished
+            if handle is not None:
+                handle.sleep(delay)
+            else:
+                self.sleep(delay)
+
+    def iter_completed(self, query_execution_ids, handle=None):
+        """Yield (id, QueryExecution) pairs in the order the queries finish"""
+        pending = list(query_execution_ids)
+        while pending:
+            for query_execution_id, execution in self.wait_any(pending, handle).items():
+                pending.remove(query_execution_id)
+                yield query_execution_id, execution
+
+    def wait(self, query_execution_id, handle=None):
+        """Block until a single query finishes and return its QueryExecution"""
+        return self.wait_any([query_execution_id], handle)[query_execution_id]
@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import OrderedDict
+
+from config import ATHENA_RESULT_REUSE_MAX_AGE
+
+# Athena keeps reusable results for at most 7 days
+ATHENA_MAX_REUSE_MINUTES = 7 * 24 * 60
+
+
+def reuse_configuration(max_age):
+    """Athena ResultReuseConfiguration for results at most max_age seconds old; None when reuse is off"""
+    minutes = min(int(max_age or 0) // 60, ATHENA_MAX_REUSE_MINUTES)
+    if minutes < 1:
+        return None
+    return {'ResultReuseByAgeConfiguration': {'Enabled': True, 'MaxAgeInMinutes': minutes}}
+
+
+def completed_at(query_execution, clock=time.time):
+    """When a finished execution's data was produced, as a Unix timestamp
+
+    An execution Athena answered from an earlier result is only known to be as
+    fresh as the reuse window it was started with, so the oldest time that
+    window allows is assumed.
+    """
+    status = query_execution.get('Status', {})
+    finished = status.get('CompletionDateTime')
+    finished = finished.timestamp() if hasattr(finished, 'timestamp') else clock()
+    reuse = query_execution.get('Statistics', {}).get('ResultReuseInformation', {})
+    if reuse.get('ReusedPreviousResult'):
+        max_age = query_execution.get('ResultReuseConfiguration', {}) \
+            .get('ResultReuseByAgeConfiguration', {}).get('MaxAgeInMinutes', 0)
+        finished -= max_age * 60
+    return finished
+
+
+class ExecutionHistory:
+    """Last successful QueryExecutionId per query, so a repeat can skip start_query_execution entirely
+
+    A repeated query whose last run is recent enough only pays for fetching the
+    result Athena already wrote to the staging dir.
+    """
+
+    def __init__(self, max_entries=10000, clock=time.time):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._executions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, key, query_execution):
+        """Remember a SUCCEEDED execution for key"""
+        if query_execution['Status']['State'] != 'SUCCEEDED':
+            return
+        with self._lock:
+            self._executions[key] = (query_execution['QueryExecutionId'], completed_at(query_execution, self.clock))
+            self._executions.move_to_end(key)
+            while len(self._executions) > self.max_entries:
+                self._executions.popitem(last=False)
+
+    def lookup(self, key, max_age=ATHENA_RESULT_REUSE_MAX_AGE):
+        """The QueryExecutionId of the last run of key if it is at most max_age seconds old, else None"""
+        if not max_age:
+            return None
+        with self._lock:
+            entry = self._executions.get(key)
+        if entry is None:
+            return None
+        query_execution_id, finished = entry
+        if self.clock() - finished > max_age:
+            return None
+        return query_execution_id
+
+    def forget(self, key):
+        """Drop key, e.g. after its result files turned out to be gone"""
+        with self._lock:
+            self._executions.pop(key, None)
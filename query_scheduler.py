@@ -0,0 +1,159 @@
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+
+from config import ATHENA_MAX_CONCURRENT_QUERIES, ATHENA_MAX_CONCURRENT_EXPORTS
+
+# Lower runs first: screen queries jump ahead of exports waiting for a slot
+INTERACTIVE = 0
+EXPORT = 1
+
+# How often a caller queued for a slot checks whether it was cancelled, in seconds
+CANCEL_CHECK_INTERVAL = 0.1
+
+
+class Flight:
+    """One Athena execution, shared by every caller that asked for the same SQL while it ran"""
+
+    def __init__(self, key, priority):
+        self.key = key
+        self.priority = priority
+        # Resolves to the QueryExecutionId once the leader has started it
+        self.started = Future()
+        self.waiters = 1
+        self.holds_slot = False
+        self.closed = False
+        # The leader gave up waiting for a slot before starting it; another caller may take over
+        self.leaderless = False
+        # What the leader was starting, for whoever takes over
+        self.query = None
+        self.max_age = None
+
+
+class QueryScheduler:
+    """Server-wide gate in front of Athena
+
+    Identical SQL already running is joined instead of re-submitted
+    (single-flight), at most max_concurrent queries run at once, and when slots
+    are scarce interactive queries go before exports, which are also capped
+    separately so they can never take every slot.
+    """
+
+    def __init__(self, max_concurrent=ATHENA_MAX_CONCURRENT_QUERIES, max_exports=ATHENA_MAX_CONCURRENT_EXPORTS):
+        self.max_concurrent = max_concurrent
+        self.max_exports = max_exports
+        self._condition = threading.Condition()
+        self._running = 0
+        self._running_exports = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._in_flight = {}
+        self.merged = 0
+
+    def join_or_lead(self, key, priority=INTERACTIVE):
+        """Return (flight, is_leader): the leader starts the execution, everyone else waits on flight.started"""
+        with self._condition:
+            flight = self._in_flight.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self.merged += 1
+                return flight, False
+            flight = self._in_flight[key] = Flight(key, priority)
+            return flight, True
+
+    def started(self, flight, query_execution_id):
+        """The leader started flight's execution in a slot it acquired; False if flight was closed meanwhile"""
+        with self._condition:
+            if flight.closed:
+                return False
+            flight.holds_slot = True
+        flight.started.set_result(query_execution_id)
+        return True
+
+    def step_down(self, flight):
+        """The leader gave up before starting flight; a caller still waiting on it can take_lead"""
+        with self._condition:
+            flight.leaderless = True
+
+    def take_lead(self, flight):
+        """Claim a flight whose leader stepped down; True for exactly one caller"""
+        with self._condition:
+            if not flight.leaderless or flight.closed:
+                return False
+            flight.leaderless = False
+            return True
+
+    def leave(self, flight):
+        """A caller stopped waiting on flight; True if it was the last one and the execution can be stopped"""
+        with self._condition:
+            flight.waiters -= 1
+            return flight.waiters <= 0 and not flight.closed
+
+    def close(self, flight, error=None):
+        """The execution finished, failed to start or was stopped: free its slot and let new callers lead again
+
+        Safe to call more than once. Callers still waiting for it to start get error.
+        """
+        with self._condition:
+            if flight.closed:
+                return
+            flight.closed = True
+            holds_slot = flight.holds_slot
+            if self._in_flight.get(flight.key) is flight:
+                del self._in_flight[flight.key]
+        if holds_slot:
+            self.release(flight.priority)
+        if not flight.started.done():
+            flight.started.set_exception(error or RuntimeError("Query was never started"))
+
+    def acquire(self, priority=INTERACTIVE, count=1, handle=None):
+        """Block until count query slots are free for this priority
+
+        A batch takes its slots together so a caller never holds some slots while
+        waiting for more; a batch larger than the limit waits for an idle server.
+        A cancelled or expired handle gives up its place in the queue and raises.
+        """
+        ticket = (priority, next(self._sequence), count)
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            while not self._can_start(ticket):
+                self._condition.wait(CANCEL_CHECK_INTERVAL if handle else None)
+                if handle is not None and (handle.cancelled or handle.expired()):
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._condition.notify_all()
+                    handle.check()
+            heapq.heappop(self._waiting)
+            self._running += count
+            if priority == EXPORT:
+                self._running_exports += count
+            # Let the next waiter re-check now that the head of the queue moved
+            self._condition.notify_all()
+
+    def release(self, priority=INTERACTIVE, count=1):
+        """Give query slots back"""
+        with self._condition:
+            self._running -= count
+            if priority == EXPORT:
+                self._running_exports -= count
+            self._condition.notify_all()
+
+    def _can_start(self, ticket):
+        priority, _, count = ticket
+        if self._waiting[0] != ticket:
+            return False
+        if self._running and self._running + count > self.max_concurrent:
+            return False
+        return priority != EXPORT or not self._running_exports or self._running_exports + count <= self.max_exports
+
+    def stats(self):
+        """Current load, for display and debugging"""
+        with self._condition:
+            return {
+                'running': self._running,
+                'running_exports': self._running_exports,
+                'waiting': len(self._waiting),
+                'in_flight': len(self._in_flight),
+                'merged': self.merged
+            }
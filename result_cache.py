@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL
+
+INDEX_FILE = 'index.json'
+
+# Hits only move last_access, so the index is saved for them at most this often (seconds); writes save it at once
+INDEX_SAVE_INTERVAL = 60
+
+# Single-quoted SQL string literals ('' is an escaped quote inside one)
+_STRING_LITERAL = re.compile(r"('(?:[^']|'')*')")
+
+
+def normalize_sql(query):
+    """Canonical form of a query: whitespace collapsed and keywords lowercased, literals untouched"""
+    parts = _STRING_LITERAL.split(query.strip().rstrip(';'))
+    normalized = []
+    for i, part in enumerate(parts):
+        # Odd indexes are the captured string literals
+        normalized.append(part if i % 2 else ' '.join(part.lower().split()))
+    return ' '.join(p for p in normalized if p)
+
+
+def query_fingerprint(query):
+    """Stable cache key for a query"""
+    return hashlib.sha256(normalize_sql(query).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Query results stored as Parquet files on local disk, with per-entry TTLs and size-bounded LRU eviction"""
+
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES,
+                 default_ttl=RESULT_CACHE_TTL, clock=time.time):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index = self._load_index()
+        self._saved_at = clock()
+
+    def get(self, query, max_age=None):
+        """Return the cached DataFrame for a query, or None on a miss or expired entry
+        
+        With max_age, entries stored more than max_age seconds ago count as
+        misses too (0 never reads the cache).
+        """
+        key = query_fingerprint(query)
+        with self._lock:
+            now = self.clock()
+            entry = self._index.get(key)
+            if entry is not None and entry['expires_at'] <= now:
+                self._remove(key)
+                self._save_index()
+                entry = None
+            if entry is not None and max_age is not None and now - entry.get('stored_at', float('-inf')) > max_age:
+                # Too old for this caller, though still fresh enough for others
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+        
+        try:
+            df = pq.read_table(self._path(key)).to_pandas(date_as_object=False)
+        except Exception:
+            # The file was evicted meanwhile or is corrupt; treat it as a miss
+            with self._lock:
+                self._remove(key)
+                self._save_index()
+                self.misses += 1
+            return None
+        
+        with self._lock:
+            if key in self._index:
+                now = self.clock()
+                self._index[key]['last_access'] = now
+                if now - self._saved_at >= INDEX_SAVE_INTERVAL:
+                    self._save_index()
+            self.hits += 1
+        return df
+
+    def put(self, query, df, ttl=None):
+        """Store a query result, then evict least recently used entries until under max_bytes"""
+        key = query_fingerprint(query)
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        now = self.clock()
+        with self._lock:
+            os.replace(tmp_path, path)
+            self._index[key] = {
+                'size': os.path.getsize(path),
+                'expires_at': now + (self.default_ttl if ttl is None else ttl),
+                'stored_at': now,
+                'last_access': now
+            }
+            self._evict(now)
+            self._save_index()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._index),
+                'bytes': sum(entry['size'] for entry in self._index.values())
+            }
+
+    def clear(self):
+        """Remove every cached result"""
+        with self._lock:
+            for key in list(self._index):
+                self._remove(key)
+            self._save_index()
+
+    def _evict(self, now):
+        """Drop expired entries, then the least recently used ones while over the size budget"""
+        for key in [key for key, entry in self._index.items() if entry['expires_at'] <= now]:
+            self._remove(key)
+            self.evictions += 1
+        total = sum(entry['size'] for entry in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]['last_access']):
+            if total <= self.max_bytes:
+                break
+            total -= self._index[key]['size']
+            self._remove(key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        self._index.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.cache_dir, INDEX_FILE)) as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        # Forget entries whose files are gone (e.g. cleaned up by hand)
+        return {key: entry for key, entry in index.items() if os.path.exists(self._path(key))}
+
+    def _save_index(self):
+        index_path = os.path.join(self.cache_dir, INDEX_FILE)
+        tmp_path = f"{index_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, index_path)
+        self._saved_at = self.clock()
@@ -0,0 +1,73 @@
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+# Athena (Trino) column types -> Arrow types. DECIMAL is decoded to float64 so the
+# pandas side gets a NumPy-backed column instead of per-cell decimal.Decimal objects.
+ATHENA_TYPE_MAP = {
+    'varchar': pa.string(),
+    'char': pa.string(),
+    'string': pa.string(),
+    'boolean': pa.bool_(),
+    'tinyint': pa.int8(),
+    'smallint': pa.int16(),
+    'integer': pa.int32(),
+    'int': pa.int32(),
+    'bigint': pa.int64(),
+    'real': pa.float32(),
+    'float': pa.float32(),
+    'double': pa.float64(),
+    'decimal': pa.float64(),
+    'date': pa.date32(),
+    'timestamp': pa.timestamp('ms'),
+}
+
+
+def arrow_type(athena_type):
+    """Map an Athena ColumnInfo type name to an Arrow type (unknown types stay strings)"""
+    base_type = athena_type.split('(')[0].strip().lower()
+    return ATHENA_TYPE_MAP.get(base_type, pa.string())
+
+
+def arrow_schema(column_info):
+    """Build an Arrow schema from ResultSetMetadata['ColumnInfo']"""
+    return pa.schema([(col['Label'], arrow_type(col.get('Type', 'varchar'))) for col in column_info])
+
+
+def _to_typed_array(values, arrow_field_type):
+    """Convert a column of VarCharValue strings (None for NULL) to a typed Arrow array"""
+    if pa.types.is_string(arrow_field_type):
+        return pa.array(values, type=pa.string())
+    # Empty strings in non-text columns are NULLs, not values
+    strings = pa.array([value if value != '' else None for value in values], type=pa.string())
+    return strings.cast(arrow_field_type)
+
+
+def decode_rows(rows, schema):
+    """Decode one GetQueryResults page of rows into a typed Arrow RecordBatch"""
+    columns = [[] for _ in schema]
+    for row in rows:
+        for column, data in zip(columns, row['Data']):
+            # A missing VarCharValue is a NULL cell
+            column.append(data.get('VarCharValue'))
+    arrays = [_to_typed_array(values, field.type) for values, field in zip(columns, schema)]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def csv_convert_options(schema):
+    """ConvertOptions that parse an Athena result CSV straight into the given schema"""
+    return pa_csv.ConvertOptions(
+        column_types={field.name: field.type for field in schema},
+        # Athena writes NULL as an empty unquoted field and '' as a quoted empty string
+        strings_can_be_null=True,
+        quoted_strings_can_be_null=False
+    )
+
+
+def csv_read_options(schema, **kwargs):
+    """ReadOptions for an Athena result CSV (names come from the schema, header skipped)"""
+    return pa_csv.ReadOptions(column_names=schema.names, skip_rows=1, **kwargs)
+
+
+def to_dataframe(table):
+    """Convert a decoded Arrow table to pandas with NumPy-backed date/time columns"""
+    return table.to_pandas(date_as_object=False)
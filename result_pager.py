@@ -0,0 +1,202 @@
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pandas as pd
+
+from config import GRID_MAX_PAGES, GRID_PAGE_SIZE
+
+# Sort-key columns fetched for keyset paging but not shown in the grid
+HIDDEN_COLUMNS = ('join_key',)
+
+# Background page fetches for every session in the process
+_prefetch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='page-prefetch')
+
+
+class PageUnavailableError(Exception):
+    """Raised when a page could not be fetched"""
+
+
+def visible(df):
+    """df without the sort-key columns that are only there for paging"""
+    hidden = [column for column in HIDDEN_COLUMNS if column in df.columns]
+    return df.drop(columns=hidden) if hidden else df
+
+
+def sort_for_display(df):
+    """Rows in the grid's order_c order (stable, NULLs last), as the SQL ORDER BY would return them"""
+    if df is None or df.empty:
+        return df
+    return df.sort_values('order_c', kind='mergesort', na_position='last').reset_index(drop=True)
+
+
+class FramePages:
+    """Pages sliced from a complete result already in memory; the cursor is a row offset"""
+
+    start = 0
+    complete = True
+
+    def __init__(self, df):
+        self.df = df
+
+    def fetch(self, cursor, page_size):
+        return self.df.iloc[cursor:cursor + page_size].reset_index(drop=True)
+
+    def next_cursor(self, cursor, page):
+        return cursor + len(page)
+
+
+class KeysetPages:
+    """Pages fetched from Athena one at a time, each starting after the last (order_c, join_key) of the previous"""
+
+    start = None
+    complete = False
+
+    def __init__(self, connector, filters):
+        self.connector = connector
+        self.filters = filters
+
+    def fetch(self, cursor, page_size):
+        # Often called on the prefetch pool, so errors are raised for ResultPager.page to surface
+        # on the script thread rather than shown from here
+        page = self.connector.get_page(self.filters, after=cursor, page_size=page_size, report_errors=False)
+        if page is None:
+            raise PageUnavailableError("Page query failed")
+        return page
+
+    def next_cursor(self, cursor, page):
+        if page.empty:
+            return cursor
+        last = page.iloc[-1]
+        order_c = None if pd.isna(last['order_c']) else last['order_c']
+        return order_c, last['join_key']
+
+
+class ResultPager:
+    """A result shown one page at a time, with only a few pages in memory and the next one prefetched
+
+    Page n can be loaded once the cursor where it starts is known, i.e. page
+    n - 1 has been loaded at some point; cursors are kept for every page seen,
+    so evicted pages are fetched again from where they start.
+    """
+
+    def __init__(self, source, page_size=GRID_PAGE_SIZE, max_pages=GRID_MAX_PAGES, total_count=None,
+                 executor=_prefetch_pool):
+        self.source = source
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.total_count = len(source.df) if source.complete else total_count
+        self.executor = executor
+        self.fetches = 0
+        # Cursor where page i starts, for every page whose start is known
+        self._cursors = [source.start]
+        # Whether nothing matched, once the first page has been seen
+        self.empty = source.df.empty if source.complete else None
+        # Index of the last page, once a short (or empty) page has been seen
+        self._last_page = None
+        # Page number -> Future of the page's rows, least recently used first
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def complete(self):
+        """Whether every row is already in memory (so exports needn't query again)"""
+        return self.source.complete
+
+    @property
+    def page_count(self):
+        """Number of pages, or None while it isn't known"""
+        if self._last_page is not None:
+            return self._last_page + 1
+        if self.total_count is not None:
+            return max(1, math.ceil(self.total_count / self.page_size))
+        return None
+
+    def has_page(self, n):
+        """Whether page n exists and can be loaded now"""
+        count = self.page_count
+        if n < 0 or (count is not None and n >= count):
+            return False
+        if self.complete:
+            # Every page of an in-memory result starts at a known row offset
+            return True
+        with self._lock:
+            return n < len(self._cursors)
+
+    def put(self, n, page):
+        """Store page n fetched elsewhere (e.g. the first page, fetched alongside the metrics)"""
+        with self._lock:
+            self._store(n, page)
+            future = Future()
+            future.set_result(page)
+            self._pages[n] = future
+            self._pages.move_to_end(n)
+            self._evict(keep=n)
+
+    def page(self, n, prefetch=True):
+        """Rows of page n for display, fetching it if it isn't in memory; the next page is prefetched"""
+        if not self.has_page(n):
+            raise IndexError(f"Page {n} is not available")
+        future = self._load(n, background=False)
+        try:
+            page = future.result()
+        except Exception:
+            with self._lock:
+                if self._pages.get(n) is future:
+                    del self._pages[n]
+            raise
+        if prefetch and not self.complete and self.has_page(n + 1):
+            self._load(n + 1, background=True)
+        return visible(page)
+
+    def _load(self, n, background):
+        with self._lock:
+            future = self._pages.get(n)
+            if future is not None:
+                self._pages.move_to_end(n)
+                return future
+            # Registered before fetching, so anyone else asking for page n meanwhile waits on the future
+            future = Future()
+            self._pages[n] = future
+            self._pages.move_to_end(n)
+            self._evict(keep=n)
+        # Fetched without the lock held, since _fetch takes it to read the cursor and store the page
+        if background:
+            self.executor.submit(self._fill, future, n)
+        else:
+            self._fill(future, n)
+        return future
+
+    def _fill(self, future, n):
+        try:
+            future.set_result(self._fetch(n))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _fetch(self, n):
+        with self._lock:
+            cursor = n * self.page_size if self.complete else self._cursors[n]
+        page = self.source.fetch(cursor, self.page_size)
+        with self._lock:
+            self.fetches += 1
+            self._store(n, page)
+        return page
+
+    def _store(self, n, page):
+        """Record where page n + 1 starts, or that n is the last page (lock held)"""
+        if n + 1 == len(self._cursors):
+            self._cursors.append(self.source.next_cursor(self._cursors[n], page))
+        if n == 0:
+            self.empty = page.empty
+        if len(page) < self.page_size:
+            self._last_page = n
+
+    def _evict(self, keep):
+        """Drop the least recently used pages over max_pages (lock held)"""
+        for n in list(self._pages):
+            if len(self._pages) <= self.max_pages:
+                break
+            if n != keep:
+                del self._pages[n]
+
@@ -0,0 +1,137 @@
+import os
+import shutil
+import threading
+from urllib.parse import urlparse
+
+import pyarrow as pa
+from pyarrow import fs as pa_fs
+
+
+def split_s3_uri(uri):
+    """Split an s3://bucket/key URI into (bucket, key)"""
+    parsed = urlparse(uri)
+    if parsed.scheme != 's3' or not parsed.netloc:
+        raise ValueError(f"Not an S3 URI: {uri}")
+    return parsed.netloc, parsed.path.lstrip('/')
+
+
+class S3ResultStore:
+    """Reads the files Athena writes under ATHENA_S3_STAGING_DIR straight from S3"""
+
+    def __init__(self, session, client_config=None):
+        self.session = session
+        self.s3_client = session.client('s3', config=client_config)
+        self._filesystem = None
+        self._filesystem_lock = threading.Lock()
+
+    def open(self, uri):
+        """Open an object for streaming reads (a single GET, consumed as it arrives)"""
+        bucket, key = split_s3_uri(uri)
+        response = self.s3_client.get_object(Bucket=bucket, Key=key)
+        return response['Body']
+
+    def open_input_file(self, uri):
+        """Open an object for random access (ranged GETs), as Parquet readers need"""
+        bucket, key = split_s3_uri(uri)
+        return self._arrow_filesystem().open_input_file(f"{bucket}/{key}")
+
+    def list(self, prefix_uri):
+        """List the URIs of all objects under a prefix"""
+        bucket, prefix = split_s3_uri(prefix_uri)
+        uris = []
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                if item['Size'] > 0:
+                    uris.append(f"s3://{bucket}/{item['Key']}")
+        return sorted(uris)
+
+    def remove(self, prefix_uri):
+        """Delete every object under a prefix"""
+        bucket, prefix = split_s3_uri(prefix_uri)
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            objects = [{'Key': item['Key']} for item in page.get('Contents', [])]
+            if objects:
+                self.s3_client.delete_objects(Bucket=bucket, Delete={'Objects': objects})
+
+    def upload(self, path, uri):
+        """Upload a local file to the given URI, streamed from disk in multipart chunks"""
+        bucket, key = split_s3_uri(uri)
+        self.s3_client.upload_file(path, bucket, key)
+
+    def download_url(self, uri, file_name, expires_in):
+        """Presigned GET URL for an object, downloaded as file_name, valid for expires_in seconds"""
+        bucket, key = split_s3_uri(uri)
+        return self.s3_client.generate_presigned_url('get_object', ExpiresIn=expires_in, Params={
+            'Bucket': bucket, 'Key': key, 'ResponseContentDisposition': f'attachment; filename="{file_name}"'
+        })
+
+    def _arrow_filesystem(self):
+        """pyarrow S3 filesystem using the same credentials as the boto3 session"""
+        with self._filesystem_lock:
+            if self._filesystem is None:
+                credentials = self.session.get_credentials()
+                frozen = credentials.get_frozen_credentials() if credentials else None
+                self._filesystem = pa_fs.S3FileSystem(
+                    access_key=frozen.access_key if frozen else None,
+                    secret_key=frozen.secret_key if frozen else None,
+                    session_token=frozen.token if frozen else None,
+                    region=self.session.region_name
+                )
+            return self._filesystem
+
+
+class LocalResultStore:
+    """Stand-in for S3 that maps s3://bucket/key onto <root>/bucket/key on local disk"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _local_path(self, uri):
+        bucket, key = split_s3_uri(uri)
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def open(self, uri):
+        """Open a local file for reading"""
+        return open(self._local_path(uri), 'rb')
+
+    def open_input_file(self, uri):
+        """Open a local file for random access"""
+        return pa.memory_map(self._local_path(uri), 'r')
+
+    def list(self, prefix_uri):
+        """List the URIs of all non-empty files under a prefix"""
+        bucket, prefix = split_s3_uri(prefix_uri)
+        bucket_root = os.path.join(self.root, bucket)
+        uris = []
+        for directory, _, files in os.walk(bucket_root):
+            for name in files:
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, bucket_root).replace(os.sep, '/')
+                if key.startswith(prefix) and os.path.getsize(path) > 0:
+                    uris.append(f"s3://{bucket}/{key}")
+        return sorted(uris)
+
+    def put(self, uri, source):
+        """Copy a local file (or write bytes) to the given URI"""
+        path = self._local_path(uri)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(source, bytes):
+            with open(path, 'wb') as f:
+                f.write(source)
+        else:
+            shutil.copyfile(source, path)
+
+    def remove(self, prefix_uri):
+        """Delete every file under a prefix"""
+        for uri in self.list(prefix_uri):
+            os.remove(self._local_path(uri))
+
+    def upload(self, path, uri):
+        """Copy a local file to the given URI"""
+        self.put(uri, path)
+
+    def download_url(self, uri, file_name, expires_in):
+        """file:// URL of the local copy"""
+        return f"file://{os.path.abspath(self._local_path(uri))}"
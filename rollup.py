@@ -0,0 +1,229 @@
+import threading
+import time
+from datetime import date
+
+from config import (
+    ATHENA_DATABASE,
+    ATHENA_TABLE,
+    ATHENA_ROLLUP_TABLE,
+    ATHENA_ROLLUP_LOCATION,
+    ATHENA_ROLLUP_ENABLED,
+    ATHENA_ROLLUP_REFRESH_INTERVAL
+)
+from approximate import delay_digest, digest_percentile_columns
+from query_filters import compile_filters, day_string, sql_literal
+
+SOURCE_TABLE = f"{ATHENA_DATABASE}.{ATHENA_TABLE}"
+
+# Columns the rollup is grouped by besides departure_date, its partition column
+ROLLUP_DIMENSIONS = ('origin', 'destination', 'journey_type')
+
+# Athena writes at most 100 partitions per CTAS or INSERT INTO
+MAX_PARTITIONS_PER_WRITE = 100
+
+# Table property recording the last day whose partitions were fully written
+ROLLED_THROUGH_PROPERTY = 'rolled_through'
+
+
+def rollup_select(where):
+    """Aggregate the raw rows matching where into rollup rows (departure_date last, as partitioning needs)"""
+    return f"""
+    SELECT origin, destination, journey_type,
+           COUNT(*) AS record_count,
+           COUNT(CAST(dep_delayed AS DECIMAL(10,2))) AS delay_count,
+           SUM(CAST(dep_delayed AS DECIMAL(10,2))) AS delay_sum,
+           {delay_digest()} AS delay_digest,
+           SUM(CAST(order_c AS DECIMAL(10,2))) AS total_orders,
+           SUM(CAST(selling_price_sum AS DECIMAL(10,2))) AS total_revenue,
+           departure_date
+    FROM {SOURCE_TABLE}
+    WHERE {where}
+    GROUP BY departure_date, origin, destination, journey_type
+    """
+
+
+class DailyRollup:
+    """Daily rollup of the fact table that answers metrics and seeds the dimension catalog
+
+    One row per departure_date x origin x destination x journey_type holding
+    counts, delay sums and a mergeable delay digest (for percentiles), orders
+    and revenue, in a Parquet table partitioned by
+    departure_date. Finished partitions (before today) are added with INSERT
+    INTO as they appear, so a refresh only aggregates new days. Queries read the
+    rollup up to the last rolled-up day and the raw table after it, so answers
+    stay exact and current while scanning a fraction of the data.
+
+    The last rolled-up day is committed to a table property after each write.
+    Partitions after it were left by a write that failed partway, and are
+    deleted (files and partition) before their days are written again, so no
+    day is ever counted twice.
+    """
+
+    def __init__(self, run_statement, run_query, table_properties, remove_files, table=ATHENA_ROLLUP_TABLE,
+                 location=ATHENA_ROLLUP_LOCATION, enabled=ATHENA_ROLLUP_ENABLED,
+                 refresh_interval=ATHENA_ROLLUP_REFRESH_INTERVAL, today=date.today, clock=time.monotonic):
+        self.run_statement = run_statement
+        self.run_query = run_query
+        # Table name -> its table properties, or None if there is no such table
+        self.table_properties = table_properties
+        # Deletes every object under an S3 prefix
+        self.remove_files = remove_files
+        self.table = f"{ATHENA_DATABASE}.{table}"
+        self.table_name = table
+        self.location = location
+        self.enabled = enabled
+        self.refresh_interval = refresh_interval
+        self.today = today
+        self.clock = clock
+        # Last departure_date in the rollup (None until one is known)
+        self.rolled_through = None
+        self.last_error = None
+        self._refreshed_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self):
+        """Roll up every finished partition not in the rollup yet; returns the last rolled-up day"""
+        with self._refresh_lock:
+            properties = self.table_properties(self.table_name)
+            exists = properties is not None
+            if exists and self.rolled_through is None:
+                self.rolled_through = properties.get(ROLLED_THROUGH_PROPERTY) or None
+
+            # Today's partition is still being written; it is read from the raw table until tomorrow
+            conditions = ["departure_date IS NOT NULL",
+                          f"departure_date < {sql_literal(self.today().strftime('%Y-%m-%d'))}"]
+            if exists and self.rolled_through:
+                conditions.append(f"departure_date > {sql_literal(self.rolled_through)}")
+            new_days = self.run_query(f"""
+            SELECT DISTINCT departure_date
+            FROM {SOURCE_TABLE}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY departure_date
+            """)
+            days = [day_string(day) for day in new_days['departure_date']] if new_days is not None else []
+
+            for start in range(0, len(days), MAX_PARTITIONS_PER_WRITE):
+                chunk = days[start:start + MAX_PARTITIONS_PER_WRITE]
+                select = rollup_select(f"departure_date >= {sql_literal(chunk[0])} "
+                                       f"AND departure_date <= {sql_literal(chunk[-1])}")
+                if exists:
+                    self._remove_partitions_after(self.rolled_through, chunk[-1])
+                    self.run_statement(f"INSERT INTO {self.table} {select}")
+                else:
+                    # Files of a CTAS that failed would make the next one fail
+                    self.remove_files(self.location)
+                    self.run_statement(f"""
+                    CREATE TABLE {self.table}
+                    WITH (format = 'PARQUET', write_compression = 'SNAPPY',
+                          external_location = '{self.location}', partitioned_by = ARRAY['departure_date'])
+                    AS {select}
+                    """)
+                    exists = True
+                # Days are added in order, so the rollup always covers everything up to here
+                self.run_statement(f"ALTER TABLE {self.table} "
+                                   f"SET TBLPROPERTIES ('{ROLLED_THROUGH_PROPERTY}' = '{chunk[-1]}')")
+                self.rolled_through = chunk[-1]
+
+            with self._lock:
+                self._refreshed_at = self.clock()
+            return self.rolled_through
+
+    def _remove_partitions_after(self, after, through):
+        """Delete the partitions in (after, through], left by a write that failed before it was committed"""
+        conditions = [f"departure_date <= {sql_literal(through)}"]
+        if after:
+            conditions.append(f"departure_date > {sql_literal(after)}")
+        leftover = self.run_query(f"""
+        SELECT DISTINCT departure_date FROM {self.table}
+        WHERE {' AND '.join(conditions)}
+        """)
+        for day in leftover['departure_date'] if leftover is not None else []:
+            day = day_string(day)
+            self.remove_files(f"{self.location.rstrip('/')}/departure_date={day}/")
+            self.run_statement(f"ALTER TABLE {self.table} "
+                               f"DROP IF EXISTS PARTITION (departure_date = {sql_literal(day)})")
+
+    def maybe_refresh(self):
+        """Start a background refresh if the rollup wasn't refreshed within the refresh interval"""
+        with self._lock:
+            if not self.enabled or self._refreshing:
+                return
+            if self._refreshed_at is not None and self.clock() - self._refreshed_at < self.refresh_interval:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+            self.last_error = None
+        except Exception as e:
+            # Queries keep going to the raw table (and the rollup as far as it got); retried next interval
+            self.last_error = e
+            with self._lock:
+                self._refreshed_at = self.clock()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _ready(self):
+        """The last rolled-up day, if the rollup can be used (kicking off a refresh when due)"""
+        self.maybe_refresh()
+        return self.rolled_through if self.enabled else None
+
+    def metrics_query(self, filters):
+        """Same columns as AthenaConnector.build_metrics_query from the rollup, or None if filters need raw rows
+
+        Delay percentiles come from merging the per-group digests, with the
+        same accuracy as approx_percentile over the raw rows.
+        """
+        compiled = compile_filters(filters)
+        if compiled.flight_code or compiled.has_delay_range:
+            return None
+        last = self._ready()
+        if last is None:
+            return None
+        days = compiled.departure_dates or ()
+        first_day = compiled.date_from or (days[0] if days else None)
+        last_day = compiled.date_to or (days[-1] if days else None)
+        if first_day is not None and first_day > last:
+            return None
+
+        where = compiled.where_clause()
+        parts = [f"""
+            SELECT record_count, delay_count, delay_sum, delay_digest, total_orders, total_revenue
+            FROM {self.table}
+            WHERE {where} AND departure_date <= {sql_literal(last)}"""]
+        if last_day is None or last_day > last:
+            parts.append(f"""
+            SELECT COUNT(*), COUNT(CAST(dep_delayed AS DECIMAL(10,2))), SUM(CAST(dep_delayed AS DECIMAL(10,2))),
+                   {delay_digest()},
+                   SUM(CAST(order_c AS DECIMAL(10,2))), SUM(CAST(selling_price_sum AS DECIMAL(10,2)))
+            FROM {SOURCE_TABLE}
+            WHERE {where} AND departure_date > {sql_literal(last)}""")
+        return f"""
+        SELECT
+            COALESCE(SUM(record_count), 0) as total_count,
+            SUM(delay_sum) / NULLIF(SUM(delay_count), 0) as avg_delay,
+            SUM(total_orders) as total_orders,
+            SUM(total_revenue) as total_revenue,
+            {digest_percentile_columns('delay_digest')}
+        FROM ({' UNION ALL '.join(parts)})
+        """
+
+    def routes_query(self):
+        """Every distinct (journey_type, origin, destination) from the rollup, or None if it isn't ready"""
+        last = self._ready()
+        if last is None:
+            return None
+        return f"""
+        SELECT journey_type, origin, destination FROM {self.table}
+        WHERE departure_date <= {sql_literal(last)}
+        GROUP BY journey_type, origin, destination
+        UNION
+        SELECT journey_type, origin, destination FROM {SOURCE_TABLE}
+        WHERE departure_date > {sql_literal(last)}
+        GROUP BY journey_type, origin, destination
+        """
@@ -0,0 +1,138 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import SESSION_RESULT_MAX_BYTES, SESSION_RESULT_MAX_ENTRIES, SESSION_SPILL_DIR
+from query_filters import compile_filters
+
+
+def frame_bytes(df):
+    """Approximate in-memory size of a DataFrame"""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class SessionResultStore:
+    """Results one session has loaded, keyed by compiled filters, so reruns re-render without Athena
+
+    Recently used results stay in memory up to max_bytes; older ones are spilled
+    to Parquet in a per-session scratch dir and read back if they're needed
+    again. The scratch dir is removed when the store is garbage collected with
+    its session. Complete results (every matching row) can be applied again
+    from here without querying.
+    """
+
+    def __init__(self, max_bytes=SESSION_RESULT_MAX_BYTES, max_entries=SESSION_RESULT_MAX_ENTRIES,
+                 spill_dir=SESSION_SPILL_DIR, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir
+        self.clock = clock
+        self.spills = 0
+        # CompiledFilter -> {'df', 'metrics', 'charts', 'complete', 'stored_at', 'bytes', 'path'};
+        # exactly one of df/path is set
+        self._entries = OrderedDict()
+        self._scratch_dir = None
+        self._lock = threading.Lock()
+
+    def put(self, filters, df, metrics=None, charts=None, complete=False):
+        """Remember the result shown for filters, spilling older results if over the memory budget
+
+        complete says df is every matching row, not just the first page.
+        """
+        key = compile_filters(filters)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = {'df': df, 'metrics': metrics, 'charts': charts, 'complete': complete,
+                                  'stored_at': self.clock(), 'bytes': frame_bytes(df), 'path': None}
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            self._spill()
+
+    def get(self, filters):
+        """(df, metrics) previously stored for filters, or None"""
+        entry = self._load(compile_filters(filters))
+        return (entry['df'], entry['metrics']) if entry is not None else None
+
+    def complete_result(self, filters, max_age):
+        """(df, metrics, charts) of a complete result for filters stored at most max_age seconds ago, or None"""
+        key = compile_filters(filters)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry['complete'] or self.clock() - entry['stored_at'] > max_age:
+                return None
+        entry = self._load(key)
+        return (entry['df'], entry['metrics'], entry['charts']) if entry is not None else None
+
+    def _load(self, key):
+        """The entry for key with its rows in memory (read back if spilled), or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            if entry['df'] is None:
+                try:
+                    entry['df'] = pq.read_table(entry['path']).to_pandas(date_as_object=False)
+                except Exception:
+                    self._remove(key)
+                    return None
+                os.remove(entry['path'])
+                entry['path'] = None
+                self._spill()
+            return entry
+
+    def __contains__(self, filters):
+        with self._lock:
+            return compile_filters(filters) in self._entries
+
+    @property
+    def memory_bytes(self):
+        with self._lock:
+            return self._memory_bytes()
+
+    def clear(self):
+        """Forget every stored result"""
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def _memory_bytes(self):
+        return sum(entry['bytes'] for entry in self._entries.values() if entry['df'] is not None)
+
+    def _spill(self):
+        """Write least recently used in-memory results to disk while over budget; the newest always stays"""
+        total = self._memory_bytes()
+        for key, entry in list(self._entries.items())[:-1]:
+            if total <= self.max_bytes:
+                break
+            if entry['df'] is None:
+                continue
+            path = os.path.join(self._scratch(), f"{self.spills}.parquet")
+            pq.write_table(pa.Table.from_pandas(entry['df'], preserve_index=False), path)
+            entry['df'] = None
+            entry['path'] = path
+            total -= entry['bytes']
+            self.spills += 1
+
+    def _scratch(self):
+        if self._scratch_dir is None:
+            if self.spill_dir:
+                os.makedirs(self.spill_dir, exist_ok=True)
+            self._scratch_dir = tempfile.mkdtemp(prefix='session-', dir=self.spill_dir)
+            weakref.finalize(self, shutil.rmtree, self._scratch_dir, True)
+        return self._scratch_dir
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry['path']:
+            try:
+                os.remove(entry['path'])
+            except FileNotFoundError:
+                pass
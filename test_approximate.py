@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Tests for the sampled fast-mode metrics
+"""
+
+import math
+
+import pandas as pd
+
+from approximate import build_approximate_metrics_query, estimate_metrics
+
+
+def test_sample_is_only_added_below_100_percent():
+    assert "TABLESAMPLE BERNOULLI (10)" in build_approximate_metrics_query('db.t', 'x = 1', percent=10)
+    assert "TABLESAMPLE" not in build_approximate_metrics_query('db.t', 'x = 1', percent=100)
+
+
+def test_sampled_totals_are_scaled_with_bounds():
+    sample = pd.DataFrame([{
+        'sample_count': 100, 'delay_count': 100, 'avg_delay': 12.0, 'delay_stddev': 10.0,
+        'sample_orders': 300.0, 'sample_orders_sq': 1000.0, 'sample_revenue': 5000.0, 'sample_revenue_sq': 4e5,
+        'p50_delay': 8.0, 'p90_delay': 30.0, 'p99_delay': 90.0,
+    }])
+    metrics = estimate_metrics(sample, percent=10).iloc[0]
+    assert metrics['total_count'] == 1000 and metrics['total_orders'] == 3000.0
+    assert math.isclose(metrics['total_count_error'], 1.96 * math.sqrt(0.9) / 0.1 * 10)
+    assert math.isclose(metrics['avg_delay_error'], 1.96)
+    assert metrics['p90_delay'] == 30.0
+
+
+def test_a_full_sample_is_exact():
+    sample = pd.DataFrame([{'sample_count': 7, 'delay_count': 0, 'avg_delay': None, 'delay_stddev': None,
+                            'sample_orders': 7.0, 'sample_orders_sq': 7.0, 'sample_revenue': 70.0,
+                            'sample_revenue_sq': 700.0}])
+    metrics = estimate_metrics(sample, percent=100).iloc[0]
+    assert metrics['total_count'] == 7 and metrics['total_count_error'] == 0
+    assert metrics['avg_delay_error'] is None or pd.isna(metrics['avg_delay_error'])
@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+"""
+Tests for AthenaConnector against an in-memory Athena stand-in
+"""
+
+import csv
+import io
+import re
+import tempfile
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import athena_connector
+from athena_connector import AthenaConnector
+from query_handle import QueryHandle
+from query_scheduler import QueryScheduler
+from result_cache import ResultCache
+from result_store import LocalResultStore
+
+COLUMNS = [
+    ('flight_code', 'varchar'), ('origin', 'varchar'), ('dep_delayed', 'decimal(10,2)'),
+    ('order_c', 'bigint'), ('departure_date', 'date'),
+]
+ROWS = [
+    ['QR-1117', 'JED', '12.50', '3', '2024-05-01'],
+    ['SV-123', '', None, None, '2024-05-01'],
+    ['SV-456', 'RUH', '61.00', '1', '2024-05-02'],
+]
+
+
+class FakeAthenaClient:
+    """Answers every query with the same result, written as a CSV into a LocalResultStore"""
+
+    def __init__(self, store, columns=COLUMNS, rows=ROWS, page_size=2):
+        self.store = store
+        self.columns = columns
+        self.rows = rows
+        self.page_size = page_size
+        self.queries = []
+        self.workgroups = []
+        self.requests = []
+        self.stopped = []
+        self.result_calls = 0
+
+    def start_query_execution(self, **kwargs):
+        self.queries.append(kwargs['QueryString'])
+        self.workgroups.append(kwargs.get('WorkGroup'))
+        self.requests.append(kwargs)
+        query_execution_id = f"q{len(self.queries)}"
+        if kwargs['QueryString'].strip().startswith('UNLOAD'):
+            self._unload(kwargs['QueryString'])
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow([name for name, _ in self.columns])
+        for row in self.rows:
+            # Athena writes NULL as an empty unquoted field
+            buffer.write(','.join('' if v is None else f'"{v}"' for v in row) + '\n')
+        self.store.put(self._output_location(query_execution_id), buffer.getvalue().encode())
+        return {'QueryExecutionId': query_execution_id}
+
+    def _unload(self, query):
+        """Write the result rows as two Parquet files under the UNLOAD destination"""
+        location = re.search(r"TO '([^']+)'", query).group(1)
+        names = [name for name, _ in self.columns]
+        for part, rows in enumerate([self.rows[:2], self.rows[2:]]):
+            table = pa.table({name: [row[i] for row in rows] for i, name in enumerate(names)})
+            sink = pa.BufferOutputStream()
+            pq.write_table(table, sink)
+            self.store.put(f"{location}part-{part}", sink.getvalue().to_pybytes())
+
+    def _output_location(self, query_execution_id):
+        return f"s3://results-bucket/staging/{query_execution_id}.csv"
+
+    def stop_query_execution(self, QueryExecutionId):
+        self.stopped.append(QueryExecutionId)
+
+    def get_query_execution(self, QueryExecutionId):
+        # Queries mentioning FAIL finish in the FAILED state, SLOW ones run until they are stopped
+        query = self.queries[int(QueryExecutionId[1:]) - 1]
+        if QueryExecutionId in self.stopped:
+            status = {'State': 'CANCELLED'}
+        elif 'SLOW' in query:
+            status = {'State': 'RUNNING'}
+        elif 'FAIL' in query:
+            status = {'State': 'FAILED', 'StateChangeReason': 'boom'}
+        else:
+            status = {'State': 'SUCCEEDED'}
+        return {'QueryExecution': {
+            'QueryExecutionId': QueryExecutionId,
+            'Status': status,
+            'ResultConfiguration': {'OutputLocation': self._output_location(QueryExecutionId)},
+        }}
+
+    def batch_get_query_execution(self, QueryExecutionIds):
+        return {'QueryExecutions': [
+            self.get_query_execution(query_execution_id)['QueryExecution']
+            for query_execution_id in QueryExecutionIds
+        ]}
+
+    def get_query_results(self, QueryExecutionId, NextToken=None, MaxResults=None):
+        self.result_calls += 1
+        header = {'Data': [{'VarCharValue': name} for name, _ in self.columns]}
+        rows = [header] + [
+            {'Data': [{} if v is None else {'VarCharValue': v} for v in row]} for row in self.rows
+        ]
+        start = int(NextToken or 0)
+        size = MaxResults or self.page_size
+        response = {'ResultSet': {
+            'ResultSetMetadata': {'ColumnInfo': [{'Label': n, 'Name': n, 'Type': t} for n, t in self.columns]},
+            'Rows': rows[start:start + size],
+        }}
+        if start + size < len(rows):
+            response['NextToken'] = str(start + size)
+        return response
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalResultStore(str(tmp_path))
+
+
+def make_connector(store, **kwargs):
+    kwargs.setdefault('result_cache', ResultCache(tempfile.mkdtemp(dir=store.root)))
+    return AthenaConnector(athena_client=FakeAthenaClient(store), result_store=store, **kwargs)
+
+
+def test_s3_fetch_reads_the_result_file(store):
+    connector = make_connector(store)
+    df = connector.execute_query("SELECT 1")
+    assert list(df.columns) == ['flight_code', 'origin', 'dep_delayed', 'order_c', 'departure_date']
+    assert df['flight_code'].tolist() == ['QR-1117', 'SV-123', 'SV-456']
+    # Only the single metadata call goes through GetQueryResults
+    assert connector.athena_client.result_calls == 1
+
+
+def test_paginate_mode_matches_s3_mode(store):
+    s3_df = make_connector(store).execute_query("SELECT 1")
+    paged_connector = make_connector(store, result_fetch_mode='paginate')
+    paged_df = paged_connector.execute_query("SELECT 1")
+    assert paged_connector.athena_client.result_calls == 2
+    pd.testing.assert_frame_equal(paged_df, s3_df)
+
+
+def test_missing_result_file_falls_back_to_paging(store, tmp_path):
+    connector = make_connector(store)
+    connector.result_store = LocalResultStore(str(tmp_path / 'empty'))
+    df = connector.execute_query("SELECT 1")
+    assert len(df) == 3
+    assert connector.athena_client.result_calls == 3
+
+
+@pytest.mark.parametrize('fetch_mode', ['s3', 'paginate'])
+def test_results_are_typed_with_real_nulls(store, fetch_mode):
+    df = make_connector(store, result_fetch_mode=fetch_mode).execute_query("SELECT 1")
+    assert df['dep_delayed'].dtype == 'float64'
+    assert df['dep_delayed'].isna().tolist() == [False, True, False]
+    assert df['dep_delayed'].sum() == 73.5
+    assert str(df['departure_date'].dtype).startswith('datetime64')
+    # NULL and the empty string stay distinguishable in text columns
+    assert df['origin'].tolist() == ['JED', '', 'RUH']
+
+
+def test_execute_queries_yields_every_named_result(store):
+    connector = make_connector(store)
+    results = dict(connector.execute_queries({'data': "SELECT 1", 'metrics': "SELECT 2", 'bad': "SELECT FAIL"}))
+    assert set(results) == {'data', 'metrics', 'bad'}
+    assert len(results['data']) == 3 and len(results['metrics']) == 3
+    assert results['bad'] is None
+    # All three were submitted before any result was fetched
+    assert connector.athena_client.queries == ["SELECT 1", "SELECT 2", "SELECT FAIL"]
+
+
+def test_background_queries_raise_or_log_errors_instead_of_showing_them(store, monkeypatch):
+    shown = []
+    monkeypatch.setattr(athena_connector.st, 'error', shown.append)
+    connector = make_connector(store)
+    with pytest.raises(athena_connector.QueryFailedError):
+        connector.execute_athena_query("SELECT FAIL", max_age=0, report_errors=False)
+    results = dict(connector.execute_queries({'ok': "SELECT 1", 'bad': "SELECT FAIL"}, max_age=0,
+                                             report_errors=False))
+    assert results['bad'] is None and len(results['ok']) == 3
+    # Streamlit calls fail off the script thread, so nothing was shown from here
+    assert shown == []
+
+
+@pytest.mark.parametrize('fetch_mode', ['s3', 'paginate'])
+def test_streaming_export_runs_one_query_and_yields_bounded_batches(store, fetch_mode):
+    connector = make_connector(store, result_fetch_mode=fetch_mode)
+    connector.athena_client.rows = [[f'XY-{i}', 'JED', '1.00', str(i), '2024-05-01'] for i in range(25)]
+    batches = list(connector.stream_filtered_data({'origin': 'JED'}, batch_size=10))
+    assert sum(len(batch) for batch in batches) == 25
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    assert pd.concat(batches)['order_c'].tolist() == list(range(25))
+    # A single query: no COUNT and no LIMIT/OFFSET re-runs
+    assert len(connector.athena_client.queries) == 1
+    assert 'OFFSET' not in connector.athena_client.queries[0]
+    assert 'LIMIT' not in connector.athena_client.queries[0]
+
+
+def test_unload_export_reads_parquet_parts_in_batches(store):
+    connector = make_connector(store)
+    uris = connector.unload_filtered_data({'date_from': '2024-05-01'}, unload_dir='s3://results-bucket/unload/')
+    assert len(uris) == 2 and all(uri.startswith('s3://results-bucket/unload/') for uri in uris)
+    query = connector.athena_client.queries[0]
+    assert "format = 'PARQUET'" in query and "departure_date >= '2024-05-01'" in query
+    assert 'ORDER BY' not in query
+    batches = list(connector.iter_parquet_batches(uris, batch_size=1))
+    assert [batch.num_rows for batch in batches] == [1, 1, 1]
+    assert pa.Table.from_batches(batches)['flight_code'].to_pylist() == ['QR-1117', 'SV-123', 'SV-456']
+
+
+def test_repeated_queries_are_served_from_the_result_cache(store):
+    connector = make_connector(store)
+    first = connector.execute_query("SELECT  origin FROM t WHERE origin = 'JED'")
+    second = connector.execute_query("select origin\nfrom t where origin = 'JED';")
+    pd.testing.assert_frame_equal(first, second)
+    assert len(connector.athena_client.queries) == 1
+    # execute_queries shares the same cache
+    results = dict(connector.execute_queries({'data': "SELECT origin FROM t WHERE origin = 'JED'"}))
+    assert len(results['data']) == 3
+    assert len(connector.athena_client.queries) == 1
+    assert connector.result_cache.stats()['hits'] == 2
+
+
+class FailingResultCache(ResultCache):
+    def put(self, query, df, ttl=None):
+        raise OSError("No space left on device")
+
+
+def test_a_failed_cache_write_still_returns_the_result(store):
+    connector = make_connector(store, result_cache=FailingResultCache(tempfile.mkdtemp(dir=store.root)))
+    assert len(connector.execute_query("SELECT origin FROM t")) == 3
+    results = dict(connector.execute_queries({'data': "SELECT origin FROM t WHERE origin = 'JED'"}))
+    assert len(results['data']) == 3
+
+
+def test_max_age_zero_bypasses_the_result_cache(store):
+    connector = make_connector(store)
+    connector.execute_query("SELECT origin FROM t WHERE origin = 'JED'")
+    for _ in range(2):
+        dict(connector.execute_queries({'data': "SELECT origin FROM t WHERE origin = 'JED'"}, max_age=0))
+    assert len(connector.athena_client.queries) == 3
+
+
+def test_use_cache_false_neither_reads_nor_writes_the_result_cache(store):
+    connector = make_connector(store)
+    connector.execute_query("SELECT origin FROM t")
+    dict(connector.execute_queries({'a': "SELECT origin FROM t", 'b': "SELECT 2"}, max_age=0, use_cache=False))
+    assert len(connector.athena_client.queries) == 3
+    assert connector.result_cache.stats()['entries'] == 1
+
+
+def test_unlimited_plans_need_a_range_known_to_fit(store, monkeypatch):
+    connector = make_connector(store)
+    dates = {'date_from': '2024-05-01', 'date_to': '2024-05-02'}
+    # No summary yet: the size is unknown
+    monkeypatch.setattr(connector.data_summary, 'day_counts', lambda: {})
+    assert connector.plan_filtered_data(dates, limit=None) is None
+    monkeypatch.setattr(connector.data_summary, 'day_counts', lambda: {'2024-05-01': 10, '2024-05-02': 20})
+    assert connector.plan_filtered_data(dates, limit=None, max_rows=29) is None
+    assert connector.plan_filtered_data(dates, limit=None, max_rows=30).missing == ['2024-05-01', '2024-05-02']
+    # Limited plans don't load the whole range
+    assert connector.plan_filtered_data(dates, max_rows=0) is not None
+
+
+def test_published_downloads_get_a_fresh_prefix_and_a_url(store, tmp_path):
+    connector = make_connector(store)
+    path = tmp_path / 'export.csv'
+    path.write_text('origin\nJED\n')
+    uris = [connector.publish_download(str(path), 's3://results-bucket/downloads/') for _ in range(2)]
+    assert uris[0] != uris[1] and all(uri.endswith('/export.csv') for uri in uris)
+    url = connector.download_url(uris[0], 'flight_delays.csv')
+    assert open(url[len('file://'):]).read() == 'origin\nJED\n'
+
+
+def test_uncached_names_skip_the_result_cache(store):
+    connector = make_connector(store)
+    dict(connector.execute_queries({'chunk': "SELECT origin FROM t", 'metrics': "SELECT 2"}, uncached={'chunk'}))
+    assert connector.result_cache.get("SELECT origin FROM t") is None
+    assert connector.result_cache.get("SELECT 2") is not None
+
+
+def test_fast_mode_skips_the_sample_when_the_rollup_answers(store):
+    connector = make_connector(store)
+    connector.rollup.enabled = True
+    connector.rollup.rolled_through = '2024-05-31'
+    connector.rollup._refreshed_at = connector.rollup.clock()
+    assert connector.build_approximate_metrics_query({'origin': 'JED'}) is None
+    # Flight codes aren't in the rollup, so the raw table is sampled
+    assert 'TABLESAMPLE' in connector.build_approximate_metrics_query({'flight_code': 'QR-1117'})
+
+
+def test_shared_connector_is_created_once_per_process(monkeypatch):
+    created = []
+    monkeypatch.setattr(athena_connector, '_shared_connector', None)
+    monkeypatch.setattr(athena_connector, 'AthenaConnector', lambda: created.append(object()) or created[-1])
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(athena_connector.get_shared_connector()))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 1
+    assert all(result is created[0] for result in results)
+
+
+def test_clients_get_a_pooled_adaptive_retry_config(store):
+    connector = AthenaConnector(result_store=store, result_cache=ResultCache(str(store.root) + '/cache'))
+    config = connector.athena_client.meta.config
+    assert config.max_pool_connections == athena_connector.ATHENA_MAX_POOL_CONNECTIONS
+    assert config.retries['mode'] == 'adaptive'
+
+
+def test_concurrent_identical_queries_share_one_execution(store, monkeypatch):
+    connector = make_connector(store)
+    released = threading.Event()
+    wait = connector.poller.wait
+    monkeypatch.setattr(connector.poller, 'wait',
+                        lambda query_execution_id, handle=None: released.wait() and wait(query_execution_id, handle))
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(connector.execute_athena_query("SELECT origin FROM t")))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    while connector.scheduler.stats()['merged'] < 3:
+        pass
+    released.set()
+    for thread in threads:
+        thread.join()
+    assert len(connector.athena_client.queries) == 1
+    assert [len(df) for df in results] == [3, 3, 3, 3]
+    assert connector.scheduler.stats()['running'] == 0
+
+
+def test_exports_run_in_the_export_workgroup(store, monkeypatch):
+    monkeypatch.setattr(athena_connector, 'ATHENA_EXPORT_WORKGROUP', 'exports')
+    connector = make_connector(store)
+    connector.execute_athena_query("SELECT 1")
+    list(connector.stream_filtered_data({'origin': 'JED'}))
+    connector.unload_filtered_data({'origin': 'JED'}, unload_dir='s3://results-bucket/unload/')
+    dict(connector.execute_queries({'data': "SELECT 2"}))
+    assert connector.athena_client.workgroups == [athena_connector.ATHENA_WORKGROUP, 'exports', 'exports',
+                                                  athena_connector.ATHENA_WORKGROUP]
+    assert connector.scheduler.stats() == {'running': 0, 'running_exports': 0, 'waiting': 0, 'in_flight': 0,
+                                           'merged': 0}
+
+
+def test_index_queries_run_in_the_interactive_workgroup(store, monkeypatch):
+    monkeypatch.setattr(athena_connector, 'ATHENA_EXPORT_WORKGROUP', 'exports')
+    connector = make_connector(store)
+    assert connector.dimensions.run_query == connector._run_index_query
+    assert connector.flight_codes.run_query == connector._run_index_query
+    assert len(connector._run_index_query("SELECT DISTINCT origin FROM t")) == 3
+    assert connector.athena_client.workgroups == [athena_connector.ATHENA_WORKGROUP]
+
+
+def test_recent_executions_are_reused_without_starting_a_query(store):
+    connector = make_connector(store)
+    first = connector.execute_athena_query("SELECT origin FROM t")
+    assert connector.athena_client.requests[0]['ResultReuseConfiguration'] == {
+        'ResultReuseByAgeConfiguration': {'Enabled': True, 'MaxAgeInMinutes': 60}
+    }
+    # The result cache is bypassed here, so only the execution history avoids a second run
+    second = connector.execute_athena_query("SELECT origin FROM t")
+    results = dict(connector.execute_queries({'data': "SELECT origin FROM t"}))
+    pd.testing.assert_frame_equal(first, second)
+    pd.testing.assert_frame_equal(first, results['data'])
+    assert len(connector.athena_client.queries) == 1
+
+    # max_age=0 asks for fresh data: the query runs again, without Athena-side reuse either
+    connector.execute_athena_query("SELECT origin FROM t", max_age=0)
+    assert len(connector.athena_client.queries) == 2
+    assert 'ResultReuseConfiguration' not in connector.athena_client.requests[1]
+
+
+def test_failed_executions_are_not_reused(store):
+    connector = make_connector(store)
+    connector.execute_athena_query("SELECT FAIL")
+    connector.execute_athena_query("SELECT FAIL")
+    assert len(connector.athena_client.queries) == 2
+
+
+def wait_until(condition):
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.001)
+
+
+def test_queries_past_their_timeout_are_stopped(store):
+    connector = make_connector(store)
+    assert connector.execute_athena_query("SELECT SLOW", handle=QueryHandle(timeout=0.05)) is None
+    assert connector.athena_client.stopped == ['q1']
+    assert connector.scheduler.stats()['running'] == 0
+
+
+def test_cancelling_a_session_handle_stops_its_queries(store):
+    connector = make_connector(store)
+    handle = QueryHandle()
+    results = {}
+
+    def run():
+        # Collected one at a time, so the wait below sees metrics before data finishes
+        for name, df in connector.execute_queries({'metrics': "SELECT 1", 'data': "SELECT SLOW"}, handle=handle):
+            results[name] = df
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    # Only cancel once metrics is in, or it could be cancelled along with data
+    wait_until(lambda: 'metrics' in results and len(connector.athena_client.queries) == 2)
+    handle.cancel()
+    thread.join()
+    assert len(results['metrics']) == 3 and results['data'] is None
+    assert connector.athena_client.stopped == ['q2']
+    assert connector.scheduler.stats()['running'] == 0
+    # The next request for the same SQL starts a new execution
+    assert connector.execute_athena_query("SELECT SLOW", handle=QueryHandle(timeout=0.01)) is None
+    assert len(connector.athena_client.queries) == 3
+
+
+def test_a_leader_cancelled_while_queued_hands_the_query_to_a_joined_session(store):
+    connector = make_connector(store)
+    connector.scheduler = QueryScheduler(max_concurrent=1)
+    # Another query holds the only slot
+    connector.scheduler.acquire()
+    leader_handle, joined_handle = QueryHandle(), QueryHandle()
+    results = {}
+
+    def run(name, handle):
+        results[name] = connector.execute_athena_query("SELECT 42", handle=handle)
+
+    leader = threading.Thread(target=run, args=('leader', leader_handle))
+    leader.start()
+    wait_until(lambda: connector.scheduler.stats()['waiting'] == 1)
+    joined = threading.Thread(target=run, args=('joined', joined_handle))
+    joined.start()
+    wait_until(lambda: connector.scheduler.stats()['merged'] == 1)
+    leader_handle.cancel()
+    leader.join()
+    connector.scheduler.release()
+    joined.join()
+    assert results['leader'] is None and len(results['joined']) == 3
+    assert connector.athena_client.queries == ["SELECT 42"]
+    assert connector.scheduler.stats()['running'] == 0
+
+
+def test_closing_the_result_generator_stops_the_remaining_queries(store):
+    connector = make_connector(store)
+    results = connector.execute_queries({'metrics': "SELECT 1", 'data': "SELECT SLOW"})
+    assert next(results)[0] == 'metrics'
+    results.close()
+    assert connector.athena_client.stopped == ['q2']
+
+
+def test_shared_executions_keep_running_while_another_caller_waits(store):
+    connector = make_connector(store)
+    first, second = QueryHandle(), QueryHandle()
+    threads = [
+        threading.Thread(target=connector.execute_athena_query, args=("SELECT SLOW",), kwargs={'handle': handle})
+        for handle in (first, second)
+    ]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: connector.scheduler.stats()['merged'] == 1 and connector.athena_client.queries)
+    first.cancel()
+    threads[0].join()
+    assert connector.athena_client.stopped == []
+    second.cancel()
+    threads[1].join()
+    assert connector.athena_client.stopped == ['q1']
+    assert connector.scheduler.stats()['running'] == 0
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Tests for the aggregated chart views
+"""
+
+import pandas as pd
+
+from charts import CHART_NAMES, build_chart_queries, chart_frames
+
+
+def rows():
+    return pd.DataFrame({
+        'flight_code': ['QR-1', 'QR-1', 'SV-2', 'SV-2', 'SV-2', 'XY-9'],
+        'origin': ['JED', 'JED', 'RUH', 'RUH', 'RUH', 'DMM'],
+        'destination': ['RUH', 'RUH', 'JED', 'JED', 'JED', 'JED'],
+        'dep_delayed': ['5.00', '20.00', '60.00', None, '400.00', '-3.00'],
+        'departure_date': ['2024-05-01', '2024-05-01', '2024-05-02', '2024-05-02', '2024-05-03', '2024-05-03'],
+    })
+
+
+def test_every_chart_is_one_group_by_query():
+    queries = build_chart_queries('db.flights', "origin = 'JED'", top_n=10)
+    assert list(queries) == [f"chart:{name}" for name in CHART_NAMES]
+    for sql in queries.values():
+        assert "GROUP BY" in sql and "WHERE origin = 'JED'" in sql
+    assert "LIMIT 10" in queries['chart:worst_routes'] and "GROUP BY flight_code" in queries['chart:worst_flights']
+
+
+def test_local_frames_bin_clip_and_rank_like_the_queries():
+    frames = chart_frames(rows(), bin_minutes=15, clip=240, top_n=1, min_flights=2)
+    histogram = dict(zip(frames['delay_histogram']['delay_bin'], frames['delay_histogram']['flights']))
+    # 400 lands in the clipped end bin, an early departure in the bin below zero; NULL delays are left out
+    assert histogram == {-15.0: 1, 0.0: 1, 15.0: 1, 60.0: 1, 240.0: 1}
+
+    daily = frames['daily_delay']
+    assert daily['departure_date'].tolist() == ['2024-05-01', '2024-05-02', '2024-05-03']
+    assert daily['flights'].tolist() == [2, 2, 2]
+
+    # DMM -> JED has a single known delay, under min_flights
+    assert frames['worst_routes'][['origin', 'destination']].values.tolist() == [['RUH', 'JED']]
+    assert frames['worst_flights']['avg_delay'].tolist() == [230.0]
+
+
+def test_empty_rows_give_empty_frames():
+    frames = chart_frames(rows().iloc[0:0])
+    assert all(frames[name].empty for name in CHART_NAMES)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Tests for the incrementally maintained data summary
+"""
+
+from datetime import date
+
+import pandas as pd
+
+from data_summary import DataSummary, HyperLogLog, delay_buckets
+
+
+class FakeTable:
+    """Answers the summary queries from (departure_date, origin, destination, flight_code, delay) rows"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.wheres = []
+
+    def run_queries(self, queries):
+        where = queries['days'].split('WHERE')[1].split('GROUP BY')[0].strip()
+        self.wheres.append(where)
+        after = where.split("'")[1] if "'" in where else ''
+        rows = pd.DataFrame(self.rows, columns=['departure_date', 'origin', 'destination', 'flight_code', 'delay'])
+        rows = rows[rows['departure_date'] > after]
+        today = queries['values'].split("departure_date >= '")[1][:10]
+        days = rows.groupby('departure_date').size().rename('records').reset_index()
+        for i, (low, high) in enumerate(delay_buckets()):
+            in_bucket = rows['delay'].notna()
+            if low is not None:
+                in_bucket &= rows['delay'] >= low
+            if high is not None:
+                in_bucket &= rows['delay'] < high
+            days[f"delay_{i}"] = days['departure_date'].map(rows[in_bucket].groupby('departure_date').size()) \
+                .fillna(0).astype(int)
+        values = pd.concat([
+            pd.DataFrame({'dimension': column, 'value': rows[column],
+                          'recent': (rows['departure_date'] >= today).astype(int)}).drop_duplicates()
+            for column in ('origin', 'destination', 'flight_code')
+        ], ignore_index=True)
+        return {'days': days, 'values': values}
+
+
+def test_sketches_count_distinct_values_and_merge():
+    first, second = HyperLogLog(), HyperLogLog()
+    for i in range(300):
+        first.add(f"A{i}")
+        second.add(f"A{i + 150}")
+    assert abs(first.merge(second).estimate() - 450) < 450 * 0.05
+    assert HyperLogLog.from_json(first.to_json()).registers == first.registers
+
+
+def test_only_new_partitions_are_read_after_the_first_refresh(tmp_path):
+    table = FakeTable([
+        ('2024-05-30', 'JED', 'RUH', 'SV-1', 5.0),
+        ('2024-05-31', 'RUH', 'JED', 'SV-2', 60.0),
+        ('2024-06-01', 'DXB', 'JED', 'EK-1', None),
+    ])
+    path = str(tmp_path / 'summary.json')
+    today = [date(2024, 6, 1)]
+    summary = DataSummary(path, today=lambda: today[0])
+    first = summary.refresh(table.run_queries).iloc[0]
+    assert first['total_records'] == 3 and first['unique_dates'] == 3 and first['unique_origins'] == 3
+    assert first['earliest_date'] == '2024-05-30' and first['latest_date'] == '2024-06-01'
+    assert summary.day_counts() == {'2024-05-30': 1, '2024-05-31': 1, '2024-06-01': 1}
+    
+    # Today's partition grew and a new day was finished; the state is picked up again from disk
+    table.rows.append(('2024-06-01', 'JED', 'DXB', 'SV-1', -4.0))
+    second = DataSummary(path, today=lambda: today[0]).refresh(table.run_queries).iloc[0]
+    assert table.wheres[-1] == "departure_date > '2024-05-31'"
+    assert second['total_records'] == 4 and second['unique_dates'] == 3 and second['unique_flights'] == 3
+    
+    # Delay buckets per day, kept for finished days and today's alike
+    histogram = DataSummary(path, today=lambda: today[0]).delay_histogram()
+    assert histogram is not None and histogram['records'].sum() == 2
+    second_summary = DataSummary(path, today=lambda: today[0])
+    second_summary.refresh(table.run_queries)
+    histogram = second_summary.delay_histogram(date_from='2024-05-31')
+    counts = dict(zip(histogram['delay_min'].fillna(-1), histogram['records']))
+    assert counts[-1] == 1 and counts[60] == 1 and histogram['records'].sum() == 2
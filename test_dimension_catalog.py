@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-memory route catalog behind the sidebar dropdowns
+"""
+
+from datetime import date
+
+import pandas as pd
+
+from dimension_catalog import DimensionCatalog
+
+
+class FakeTable:
+    """Answers the catalog query from (journey_type, origin, destination, departure_date) rows"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def run_query(self, query):
+        self.queries.append(query)
+        rows = pd.DataFrame(self.rows, columns=['journey_type', 'origin', 'destination', 'departure_date'])
+        if "departure_date > '" in query:
+            rows = rows[rows['departure_date'] > query.split("departure_date > '")[1][:10]]
+        return rows[['journey_type', 'origin', 'destination']].drop_duplicates()
+
+
+class FakeRollup:
+    def routes_query(self):
+        return "SELECT journey_type, origin, destination FROM rollup"
+
+
+def make_catalog(rollup=None):
+    table = FakeTable([
+        ('oneway', 'JED', 'RUH', '2024-05-01'),
+        ('oneway', 'JED', 'DXB', '2024-05-02'),
+        ('return', 'RUH', 'JED', '2024-05-02'),
+        ('return', 'JED', 'CAI', '2024-05-03'),
+        (None, 'DMM', None, '2024-05-03'),
+    ])
+    catalog = DimensionCatalog(table.run_query, rollup=rollup, today=lambda: date(2024, 6, 1))
+    catalog.refresh()
+    return table, catalog
+
+
+def test_one_query_serves_every_dropdown_and_narrows_them():
+    table, catalog = make_catalog()
+    assert len(table.queries) == 1 and 'GROUP BY journey_type, origin, destination' in table.queries[0]
+    assert catalog.journey_types() == ['oneway', 'return']
+    assert catalog.origins() == ['DMM', 'JED', 'RUH']
+    assert catalog.origins('return') == ['JED', 'RUH']
+    assert catalog.destinations() == ['CAI', 'DXB', 'JED', 'RUH']
+    assert catalog.destinations(origin='JED') == ['CAI', 'DXB', 'RUH']
+    assert catalog.destinations('oneway', 'JED') == ['DXB', 'RUH']
+    assert catalog.destinations('charter') == []
+
+
+def test_refresh_reads_only_new_partitions_and_the_first_build_uses_the_rollup():
+    table, catalog = make_catalog()
+    table.rows.append(('oneway', 'RUH', 'AUH', '2024-06-01'))
+    catalog.refresh()
+    assert "departure_date > '2024-05-31'" in table.queries[-1]
+    assert catalog.destinations('oneway', 'RUH') == ['AUH']
+
+    table, catalog = make_catalog(FakeRollup())
+    assert table.queries[0].endswith('FROM rollup')
+    catalog.refresh()
+    assert "departure_date > '2024-05-31'" in table.queries[-1]
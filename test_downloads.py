@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Tests for batch-by-batch download file generation
+"""
+
+import gzip
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from downloads import SessionDownloads, iter_frame_batches, write_download
+
+
+def frame(rows):
+    return pd.DataFrame({'origin': ['JED'] * rows, 'order_c': range(rows)})
+
+
+def test_csv_written_in_batches_matches_a_single_pass(tmp_path):
+    path = str(tmp_path / 'out.csv')
+    assert write_download(iter_frame_batches(frame(25), batch_size=10), path, 'CSV') == 25
+    with open(path, encoding='utf-8') as f:
+        assert f.read() == frame(25).to_csv(index=False)
+
+
+def test_gzip_and_parquet_round_trip(tmp_path):
+    gz_path = str(tmp_path / 'out.csv.gz')
+    write_download(iter_frame_batches(frame(25), batch_size=10), gz_path, 'CSV (gzip)')
+    with gzip.open(gz_path, 'rt', encoding='utf-8') as f:
+        assert f.read() == frame(25).to_csv(index=False)
+    
+    parquet_path = str(tmp_path / 'out.parquet')
+    write_download(iter_frame_batches(frame(25), batch_size=10), parquet_path, 'Parquet')
+    pd.testing.assert_frame_equal(pq.read_table(parquet_path).to_pandas(), frame(25))
+
+
+def test_session_downloads_reuse_files_and_drop_the_oldest(tmp_path):
+    downloads = SessionDownloads(directory=str(tmp_path), max_files=2)
+    calls = []
+    
+    def batches():
+        calls.append(1)
+        return iter_frame_batches(frame(5))
+    
+    path, rows = downloads.get_or_write('a', batches)
+    assert downloads.get_or_write('a', batches) == (path, rows) and rows == 5
+    assert len(calls) == 1
+    downloads.write('b', iter_frame_batches(frame(1)))
+    downloads.write('c', iter_frame_batches(frame(1)))
+    assert downloads.get('a') is None and not os.path.exists(path)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tests for the flight code autocomplete index
+"""
+
+from datetime import date
+
+import pandas as pd
+
+from flight_codes import FlightCodeIndex
+
+
+class FakeTable:
+    """Answers the index query from (flight_code, departure_date) rows"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def run_query(self, query):
+        self.queries.append(query)
+        rows = pd.DataFrame(self.rows, columns=['flight_code', 'departure_date'])
+        if "departure_date > '" in query:
+            rows = rows[rows['departure_date'] > query.split("departure_date > '")[1][:10]]
+        return rows.groupby('flight_code')['departure_date'].agg(first_day='min', last_day='max').reset_index()
+
+
+def make_index():
+    table = FakeTable([
+        ('QR-1117', '2024-01-01'), ('QR-1117', '2024-05-31'),
+        ('QR-1118', '2024-05-01'), ('QR-1118', '2024-06-01'),
+        ('SV-2', '2024-01-01'), ('SV-2', '2024-02-01'),
+        ('EK-1', '2024-06-01'),
+    ])
+    index = FlightCodeIndex(table.run_query, today=lambda: date(2024, 6, 1))
+    index.refresh()
+    return table, index
+
+
+def test_prefix_matches_come_first_in_code_order_and_any_case():
+    _, index = make_index()
+    assert index.ready and len(index) == 4
+    assert index.complete('qr-11') == ['QR-1117', 'QR-1118']
+    assert index.complete('Q', limit=1) == ['QR-1117']
+    assert index.complete('') == []
+
+
+def test_misspellings_get_close_codes_and_windows_narrow_the_suggestions():
+    _, index = make_index()
+    assert 'QR-1117' in index.complete('QR-1171')
+    # QR-1117 was last flown on May 31, SV-2 in February
+    assert index.complete('QR', date_from='2024-06-01') == ['QR-1118']
+    assert index.complete('SV', date_from='2024-03-01') == []
+
+
+def test_refresh_reads_only_from_yesterday_on_and_widens_spans():
+    table, index = make_index()
+    table.rows += [('SV-2', '2024-06-01'), ('XY-9', '2024-06-01')]
+    index.refresh()
+    assert "departure_date > '2024-05-31'" in table.queries[-1]
+    assert 'XY-9' in index
+    assert index.complete('SV', date_from='2024-03-01') == ['SV-2']
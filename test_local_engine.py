@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Tests for the local vectorized filter engine
+"""
+
+import numpy as np
+import pandas as pd
+
+from local_engine import LocalQueryEngine
+
+WINDOW_FILTERS = {'date_from': '2024-05-01', 'date_to': '2024-05-03'}
+
+
+def window():
+    return pd.DataFrame({
+        'flight_code': ['QR-1', 'SV-2', 'SV-3', 'QR-1', 'XY-9', 'SV-2'],
+        'origin': ['JED', 'RUH', 'JED', 'JED', 'DMM', 'RUH'],
+        'destination': ['RUH', 'JED', 'DMM', 'RUH', 'JED', 'JED'],
+        'journey_type': ['DOM'] * 6,
+        'dep_delayed': ['5.00', '20.00', '60.00', None, '61.50', '45.00'],
+        'cal_dep_delayed_minutes': [5.0, 20.0, 60.0, None, 61.5, 45.0],
+        'order_c': [6, 5, 4, 3, 2, 1],
+        'selling_price_sum': ['100', '200', '300', '400', '500', '600'],
+        'departure_date': ['2024-05-01', '2024-05-01', '2024-05-02', '2024-05-02', '2024-05-03', '2024-05-03'],
+    })
+
+
+def test_covers_only_narrower_requests_inside_the_window():
+    engine = LocalQueryEngine(window(), {**WINDOW_FILTERS, 'journey_type': 'DOM'})
+    assert engine.covers({**WINDOW_FILTERS, 'journey_type': 'DOM', 'origin': 'JED'})
+    assert engine.covers({'date_from': '2024-05-02', 'date_to': '2024-05-02', 'journey_type': 'DOM'})
+    assert not engine.covers({**WINDOW_FILTERS, 'origin': 'JED'})
+    assert not engine.covers({'date_from': '2024-04-30', 'date_to': '2024-05-02', 'journey_type': 'DOM'})
+    assert not engine.covers({'date_from': '2024-05-01', 'journey_type': 'DOM'})
+
+
+def test_filter_combines_index_date_and_delay_masks_in_order_c_order():
+    engine = LocalQueryEngine(window(), WINDOW_FILTERS)
+    rows = engine.filter({'date_from': '2024-05-02', 'date_to': '2024-05-03', 'origin': 'JED'})
+    assert rows['order_c'].tolist() == [3, 4]
+    rows = engine.filter({**WINDOW_FILTERS, 'dep_delayed': 'Greater than 60 minutes'})
+    # Ranges include their lower bound, so exactly 60 matches; a NULL delay never does, as in the SQL filter
+    assert rows['flight_code'].tolist() == ['XY-9', 'SV-3']
+    rows = engine.filter({**WINDOW_FILTERS, 'delay_min': 15, 'delay_max': 60})
+    assert rows['flight_code'].tolist() == ['SV-2', 'SV-2']
+    assert engine.filter({**WINDOW_FILTERS, 'origin': 'CAI'}).empty
+    rows = engine.filter({**WINDOW_FILTERS, 'flight_code': 'SV-*, XY-9'})
+    assert rows['flight_code'].tolist() == ['SV-2', 'XY-9', 'SV-3', 'SV-2']
+    assert len(engine.filter(WINDOW_FILTERS, limit=2)) == 2
+
+
+def test_metrics_match_the_sql_aggregates():
+    engine = LocalQueryEngine(window(), WINDOW_FILTERS)
+    metrics = engine.metrics({**WINDOW_FILTERS, 'origin': 'JED'}).iloc[0]
+    assert metrics['total_count'] == 3
+    assert np.isclose(metrics['avg_delay'], 32.5)
+    assert metrics['total_orders'] == 13
+    assert metrics['total_revenue'] == 800
+    assert engine.metrics({**WINDOW_FILTERS, 'origin': 'CAI'}).iloc[0]['total_count'] == 0
+
+
+def test_metrics_include_exact_delay_percentiles():
+    engine = LocalQueryEngine(window(), WINDOW_FILTERS)
+    metrics = engine.metrics({**WINDOW_FILTERS, 'origin': 'JED'}).iloc[0]
+    # The NULL delay is left out, as approx_percentile would
+    assert metrics['p50_delay'] == 32.5
+    assert metrics['p99_delay'] == np.percentile([5.0, 60.0], 99)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-partition date-range cache
+"""
+
+from datetime import date
+
+import pandas as pd
+
+from partition_cache import PartitionCache, date_range_days, estimated_rows, scatter_chunks
+from result_cache import ResultCache
+
+
+def build_query(filters, limit=50000, ordered=True):
+    """Stand-in for AthenaConnector.build_filtered_query that just records the filters"""
+    return repr(sorted(filters.items()))
+
+
+def rows_for(days):
+    return pd.DataFrame({
+        'departure_date': [day for day in days for _ in range(2)],
+        'order_c': [i for i, _ in enumerate(days) for i in (i * 2 + 1, i * 2)],
+    })
+
+
+def make_cache(tmp_path):
+    return PartitionCache(ResultCache(str(tmp_path)), today=lambda: date(2024, 5, 10))
+
+
+def test_sliding_the_range_only_fetches_new_days(tmp_path):
+    cache = make_cache(tmp_path)
+    filters = {'date_from': '2024-05-01', 'date_to': '2024-05-03', 'origin': 'JED'}
+    plan = cache.plan(filters, build_query)
+    assert plan.missing == ['2024-05-01', '2024-05-02', '2024-05-03']
+    assert "'departure_dates'" in plan.sql and "'date_from'" not in plan.sql
+    assert len(plan.combine(rows_for(plan.missing))) == 6
+
+    plan = cache.plan({**filters, 'date_from': '2024-05-02', 'date_to': '2024-05-04'}, build_query, limit=3)
+    assert plan.missing == ['2024-05-04']
+    combined = plan.combine(rows_for(['2024-05-04']))
+    # Merged locally, re-sorted by order_c and limited like the single query would be
+    assert combined['order_c'].tolist() == [0, 1, 2]
+
+    plan = cache.plan({**filters, 'date_to': '2024-05-04'}, build_query)
+    assert plan.sql is None and len(plan.combine(None)) == 8
+
+
+def test_days_without_rows_are_cached_too(tmp_path):
+    cache = make_cache(tmp_path)
+    filters = {'date_from': '2024-05-01', 'date_to': '2024-05-02'}
+    cache.plan(filters, build_query).combine(rows_for(['2024-05-01']))
+    assert cache.plan(filters, build_query).sql is None
+
+
+def test_todays_partition_gets_the_short_ttl(tmp_path):
+    cache = make_cache(tmp_path)
+    plan = cache.plan({'date_from': '2024-05-09', 'date_to': '2024-05-10'}, build_query)
+    plan.combine(rows_for(plan.missing))
+    expiries = sorted(entry['expires_at'] for entry in cache.result_cache._index.values())
+    assert expiries[1] - expiries[0] > cache.history_ttl - cache.today_ttl - 60
+
+
+def test_open_ranges_are_not_partitioned(tmp_path):
+    assert make_cache(tmp_path).plan({'date_from': '2024-05-01'}, build_query) is None
+
+
+def test_reuse_window_is_short_only_when_todays_partition_can_match(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.reuse_max_age({'date_from': '2024-05-01', 'date_to': '2024-05-09'}) == cache.history_max_age
+    assert cache.reuse_max_age({'date_from': '2024-05-01', 'date_to': '2024-05-10'}) == cache.today_max_age
+    assert cache.reuse_max_age({'departure_dates': ['2024-05-02', '2024-05-03']}) == cache.history_max_age
+    # Open-ended ranges reach today
+    assert cache.reuse_max_age({'date_from': '2024-05-01'}) == cache.today_max_age
+
+
+def test_chunks_fetched_separately_combine_like_one_query(tmp_path):
+    cache = make_cache(tmp_path)
+    filters = {'date_from': '2024-05-01', 'date_to': '2024-05-04'}
+    plan = cache.plan(filters, build_query)
+    chunks = plan.chunk_queries([['2024-05-01', '2024-05-02'], ['2024-05-03', '2024-05-04']])
+    assert list(chunks) == ['chunk:2024-05-01', 'chunk:2024-05-03']
+    
+    plan.add(rows_for(['2024-05-03', '2024-05-04']), chunks['chunk:2024-05-03'][0])
+    assert len(plan.partial()) == 4
+    # Not every day has loaded yet
+    assert plan.combine(None) is None
+    
+    plan.add(rows_for(['2024-05-01', '2024-05-02']), chunks['chunk:2024-05-01'][0])
+    assert len(plan.combine(None)) == 8
+    assert cache.plan(filters, build_query).sql is None
+
+
+def test_a_failed_day_write_keeps_the_fetched_rows(tmp_path):
+    class FullDisk(ResultCache):
+        def put(self, query, df, ttl=None):
+            raise OSError("No space left on device")
+
+    cache = PartitionCache(FullDisk(str(tmp_path)), today=lambda: date(2024, 5, 10))
+    plan = cache.plan({'date_from': '2024-05-01', 'date_to': '2024-05-02'}, build_query)
+    plan.add(rows_for(plan.missing), plan.missing)
+    assert len(plan.combine(None)) == 4
+
+
+def test_scatter_chunks_follow_partition_row_counts():
+    days = date_range_days({'date_from': '2024-01-01', 'date_to': '2024-03-31'})
+    # Small ranges stay one query
+    assert scatter_chunks(days, {day: 10 for day in days}, target_rows=1000) == [days]
+    
+    # A month per chunk when a month fits the target
+    months = scatter_chunks(days, {day: 100 for day in days}, target_rows=3100)
+    assert [chunk[0] for chunk in months] == ['2024-01-01', '2024-02-01', '2024-03-01']
+    
+    # Weeks (ISO, Monday first) when months are too big, merged down to max_chunks
+    weeks = scatter_chunks(days, {day: 100 for day in days}, target_rows=700, max_chunks=100)
+    assert weeks[1][0] == '2024-01-08' and all(len(chunk) <= 7 for chunk in weeks)
+    merged = scatter_chunks(days, {day: 100 for day in days}, target_rows=700, max_chunks=4)
+    assert len(merged) == 4 and sum(merged, []) == days
+    
+    # Days without counts are assumed average
+    counts = {day: 100 for day in days[:31]}
+    assert len(scatter_chunks(days, counts, target_rows=3100)) == 3
+
+
+def test_estimated_rows_assume_the_average_for_unknown_days():
+    counts = {'2024-05-01': 100, '2024-05-02': 300}
+    assert estimated_rows(['2024-05-01', '2024-05-02', '2024-05-03'], counts) == 600
+    assert estimated_rows(['2024-05-01'], {}) is None
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Tests for the compiled filter layer and filter-subsumption reuse
+"""
+
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from local_engine import LocalQueryEngine
+from query_filters import compile_filters
+from query_planner import QueryPlanner
+
+DATES = {'date_from': '2024-05-01', 'date_to': '2024-05-31'}
+
+
+def test_equivalent_dicts_compile_to_the_same_predicate():
+    first = compile_filters({**DATES, 'origin': 'JED', 'flight_code': ' QR-1117 ', 'dep_delayed': 'All'})
+    second = compile_filters({'origin': 'JED', 'flight_code': 'QR-1117', **DATES})
+    assert first == second and hash(first) == hash(second)
+    assert first.where_clause() == (
+        "departure_date IS NOT NULL AND departure_date >= '2024-05-01' AND departure_date <= '2024-05-31'"
+        " AND origin = 'JED' AND flight_code = 'QR-1117'"
+    )
+
+
+def test_values_are_quoted_and_dates_validated():
+    assert "flight_code = 'QR''1'" in compile_filters({'flight_code': "QR'1"}).where_clause()
+    with pytest.raises(ValueError):
+        compile_filters({'date_from': "2024-05-01' OR '1'='1"})
+    with pytest.raises(ValueError):
+        compile_filters({'dep_delayed': 'Sometimes'})
+
+
+def test_broader_filters_cover_narrower_ones():
+    broad = compile_filters(DATES)
+    assert broad.covers(compile_filters({**DATES, 'origin': 'JED'}))
+    assert broad.covers(compile_filters({'date_from': '2024-05-10', 'date_to': '2024-05-11', 'origin': 'JED'}))
+    assert broad.covers(compile_filters({'departure_dates': ['2024-05-02', '2024-05-03']}))
+    assert not broad.covers(compile_filters({'date_from': '2024-04-30', 'date_to': '2024-05-02'}))
+    assert not broad.covers(compile_filters({'date_from': '2024-05-02'}))
+    assert not compile_filters({**DATES, 'origin': 'JED'}).covers(broad)
+    assert compile_filters({}).covers(broad)
+
+
+def test_delay_ranges_compare_the_numeric_column_without_casts():
+    where = compile_filters({'delay_min': '15', 'delay_max': 60.0}).where_clause()
+    assert where.endswith("cal_dep_delayed_minutes >= 15 AND cal_dep_delayed_minutes < 60")
+    assert 'CAST' not in where
+    # The former buckets are [min, max) ranges, so adjacent ones meet without a gap at 60
+    assert compile_filters({'dep_delayed': '30-60 minutes'}) == compile_filters({'delay_min': 30, 'delay_max': 60})
+    assert compile_filters({'dep_delayed': 'Greater than 60 minutes'}).delay_min == 60
+    assert compile_filters({'delay_min': float('-inf')}) == compile_filters({})
+    with pytest.raises(ValueError):
+        compile_filters({'delay_min': 30, 'delay_max': 30})
+
+    wide = compile_filters({'delay_min': 0})
+    assert wide.covers(compile_filters({'delay_min': 15, 'delay_max': 30}))
+    assert not wide.covers(compile_filters({'delay_max': 30}))
+    assert not compile_filters({'delay_max': 30}).covers(compile_filters({'delay_min': 0}))
+
+
+def test_flight_codes_can_be_lists_and_prefixes():
+    where = compile_filters({'flight_code': 'QR-*, SV-2 sv-1'}).where_clause()
+    assert where.endswith("(flight_code IN ('SV-2', 'sv-1') OR flight_code LIKE 'QR-%' ESCAPE '\\')")
+    assert compile_filters({'flight_code': 'SV-2, QR-*'}) == compile_filters({'flight_code': 'QR-* SV-2'})
+    assert "LIKE 'A\\_%'" in compile_filters({'flight_code': 'A_*'}).where_clause()
+    assert compile_filters({'flight_code': '*'}) == compile_filters({})
+
+    airline = compile_filters({'flight_code': 'QR-*'})
+    assert airline.covers(compile_filters({'flight_code': 'QR-1117, QR-12*'}))
+    assert not airline.covers(compile_filters({'flight_code': 'QR-1117, SV-2'}))
+    assert not compile_filters({'flight_code': 'QR-1117'}).covers(airline)
+
+
+def window():
+    return pd.DataFrame({
+        'flight_code': ['QR-1', 'SV-2'], 'origin': ['JED', 'RUH'], 'destination': ['RUH', 'JED'],
+        'journey_type': ['DOM', 'DOM'], 'dep_delayed': ['5', '20'], 'cal_dep_delayed_minutes': [5, 20],
+        'order_c': [1, 2],
+        'selling_price_sum': ['10', '20'], 'departure_date': ['2024-05-01', '2024-05-02'],
+    })
+
+
+def test_planner_answers_narrower_requests_from_a_broader_result():
+    planner = QueryPlanner()
+    assert planner.lookup({**DATES, 'origin': 'JED'}) is None
+    with planner.loading(DATES) as load:
+        load.set_result(LocalQueryEngine(window(), DATES))
+    engine = planner.lookup({**DATES, 'origin': 'JED'})
+    assert engine.filter({**DATES, 'origin': 'JED'})['flight_code'].tolist() == ['QR-1']
+    assert planner.lookup({'date_from': '2024-04-01', 'date_to': '2024-05-31'}) is None
+
+
+def test_planner_waits_for_a_covering_load_in_flight():
+    planner = QueryPlanner()
+    started = threading.Event()
+    release = threading.Event()
+
+    def load_broad():
+        with planner.loading(DATES) as load:
+            started.set()
+            release.wait()
+            load.set_result(LocalQueryEngine(window(), DATES))
+
+    loader = threading.Thread(target=load_broad)
+    loader.start()
+    started.wait()
+    threading.Timer(0.05, release.set).start()
+    engine = planner.lookup({**DATES, 'origin': 'RUH'}, timeout=5)
+    loader.join()
+    assert engine is not None and len(engine.filter({**DATES, 'origin': 'RUH'})) == 1
+
+
+def test_planner_windows_expire_after_their_max_age():
+    now = [0.0]
+    planner = QueryPlanner(max_age=lambda filters: 60, clock=lambda: now[0])
+    with planner.loading(DATES) as load:
+        load.set_result(LocalQueryEngine(window(), DATES))
+    now[0] = 59
+    assert planner.lookup({**DATES, 'origin': 'JED'}) is not None
+    now[0] = 60
+    assert planner.lookup({**DATES, 'origin': 'JED'}) is None
+
+
+def test_planner_waits_for_loads_in_flight_only_up_to_the_timeout():
+    planner = QueryPlanner()
+    with planner.loading(DATES):
+        started = time.monotonic()
+        assert planner.lookup({**DATES, 'origin': 'JED'}, timeout=0.05) is None
+        assert time.monotonic() - started < 1
+
+
+def test_failed_loads_are_forgotten():
+    planner = QueryPlanner()
+    with pytest.raises(RuntimeError):
+        with planner.loading(DATES):
+            raise RuntimeError("Athena is down")
+    assert planner.lookup({**DATES, 'origin': 'JED'}) is None
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Tests for adaptive Athena completion polling
+"""
+
+import pytest
+
+from query_handle import QueryHandle, QueryTimeoutError
+from query_poller import QueryPoller
+
+
+class ScriptedAthenaClient:
+    """Reports each query as RUNNING for a fixed number of polls, then SUCCEEDED"""
+
+    def __init__(self, polls_until_done):
+        self.polls_until_done = dict(polls_until_done)
+        self.calls = []
+
+    def batch_get_query_execution(self, QueryExecutionIds):
+        self.calls.append(list(QueryExecutionIds))
+        executions = []
+        for query_execution_id in QueryExecutionIds:
+            remaining = self.polls_until_done[query_execution_id]
+            self.polls_until_done[query_execution_id] = remaining - 1
+            state = 'SUCCEEDED' if remaining <= 0 else 'RUNNING'
+            executions.append({'QueryExecutionId': query_execution_id, 'Status': {'State': state}})
+        return {'QueryExecutions': executions}
+
+
+def test_fast_query_returns_without_sleeping():
+    sleeps = []
+    poller = QueryPoller(ScriptedAthenaClient({'a': 0}), sleep=sleeps.append)
+    assert poller.wait('a')['Status']['State'] == 'SUCCEEDED'
+    assert sleeps == []
+
+
+def test_delays_back_off_with_jitter_up_to_the_cap():
+    sleeps = []
+    poller = QueryPoller(ScriptedAthenaClient({'a': 6}), initial_delay=0.1, max_delay=1.0,
+                         sleep=sleeps.append)
+    poller.wait('a')
+    caps = [0.1, 0.2, 0.4, 0.8, 1.0, 1.0]
+    assert len(sleeps) == len(caps)
+    for delay, cap in zip(sleeps, caps):
+        assert cap * (1 - poller.jitter) <= delay <= cap
+
+
+def test_multi_query_wait_returns_in_completion_order_with_batched_polls():
+    client = ScriptedAthenaClient({'slow': 3, 'fast': 1, 'medium': 2})
+    poller = QueryPoller(client, sleep=lambda delay: None)
+    order = [query_execution_id for query_execution_id, _ in poller.iter_completed(['slow', 'fast', 'medium'])]
+    assert order == ['fast', 'medium', 'slow']
+    # One batched call per poll round rather than one call per query
+    assert client.calls[0] == ['slow', 'fast', 'medium']
+    assert len(client.calls) == 4
+
+
+def test_waiting_stops_when_the_handle_times_out():
+    now = [0.0]
+    handle = QueryHandle(timeout=1.0, clock=lambda: now[0])
+
+    def sleep(delay):
+        now[0] += delay
+
+    handle.sleep = lambda delay: (sleep(delay), handle.check())
+    poller = QueryPoller(ScriptedAthenaClient({'a': 100}), initial_delay=0.4, max_delay=0.4, jitter=0)
+    with pytest.raises(QueryTimeoutError):
+        poller.wait('a', handle=handle)
+    assert now[0] >= 1.0
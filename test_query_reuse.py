@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Tests for reusing earlier Athena executions
+"""
+
+from datetime import datetime, timezone
+
+from query_reuse import ExecutionHistory, completed_at, reuse_configuration
+
+
+def succeeded(query_execution_id, **extra):
+    return dict({'QueryExecutionId': query_execution_id, 'Status': {'State': 'SUCCEEDED'}}, **extra)
+
+
+def test_reuse_configuration_is_whole_minutes_within_athenas_limit():
+    assert reuse_configuration(0) is None
+    assert reuse_configuration(None) is None
+    # Rounded down, so Athena never hands back something older than asked for
+    assert reuse_configuration(59) is None
+    assert reuse_configuration(150)['ResultReuseByAgeConfiguration']['MaxAgeInMinutes'] == 2
+    assert reuse_configuration(30 * 24 * 3600)['ResultReuseByAgeConfiguration']['MaxAgeInMinutes'] == 7 * 24 * 60
+
+
+def test_history_returns_recent_successful_executions_only():
+    now = [1000.0]
+    history = ExecutionHistory(clock=lambda: now[0])
+    history.record('q', succeeded('a'))
+    history.record('bad', {'QueryExecutionId': 'b', 'Status': {'State': 'FAILED'}})
+    assert history.lookup('q', max_age=60) == 'a'
+    assert history.lookup('bad', max_age=60) is None
+    assert history.lookup('q', max_age=0) is None
+    now[0] += 61
+    assert history.lookup('q', max_age=60) is None
+    assert history.lookup('q', max_age=3600) == 'a'
+    history.forget('q')
+    assert history.lookup('q', max_age=3600) is None
+
+
+def test_results_athena_reused_are_assumed_as_old_as_the_window_allowed():
+    finished = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+    fresh = succeeded('a', Status={'State': 'SUCCEEDED', 'CompletionDateTime': finished})
+    assert completed_at(fresh) == finished.timestamp()
+    reused = dict(
+        fresh,
+        Statistics={'ResultReuseInformation': {'ReusedPreviousResult': True}},
+        ResultReuseConfiguration={'ResultReuseByAgeConfiguration': {'Enabled': True, 'MaxAgeInMinutes': 10}}
+    )
+    assert completed_at(reused) == finished.timestamp() - 600
+
+
+def test_history_is_bounded():
+    history = ExecutionHistory(max_entries=2, clock=lambda: 0.0)
+    for key in ('a', 'b', 'c'):
+        history.record(key, succeeded(key))
+    assert history.lookup('a', max_age=10) is None
+    assert history.lookup('c', max_age=10) == 'c'
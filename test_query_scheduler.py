@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Tests for the server-wide query scheduler
+"""
+
+import threading
+import time
+
+import pytest
+
+from query_handle import QueryHandle, QueryCancelledError
+from query_scheduler import QueryScheduler, INTERACTIVE, EXPORT
+
+
+def wait_until(condition):
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.001)
+
+
+def test_identical_queries_in_flight_share_one_execution():
+    scheduler = QueryScheduler()
+    flight, is_leader = scheduler.join_or_lead('q')
+    joined, joined_is_leader = scheduler.join_or_lead('q')
+    assert is_leader and not joined_is_leader and joined is flight
+    scheduler.acquire()
+    assert scheduler.started(flight, 'execution-1')
+    assert joined.started.result() == 'execution-1'
+    scheduler.close(flight)
+    assert scheduler.stats()['running'] == 0
+    # Once finished, the next request leads a fresh execution
+    assert scheduler.join_or_lead('q')[1]
+
+
+def test_start_errors_reach_everyone_who_joined():
+    scheduler = QueryScheduler()
+    flight, _ = scheduler.join_or_lead('q')
+    scheduler.join_or_lead('q')
+    scheduler.close(flight, error=RuntimeError('boom'))
+    with pytest.raises(RuntimeError):
+        flight.started.result()
+
+
+def test_only_the_last_caller_to_leave_may_stop_the_execution():
+    scheduler = QueryScheduler()
+    flight, _ = scheduler.join_or_lead('q')
+    scheduler.join_or_lead('q')
+    assert not scheduler.leave(flight)
+    assert scheduler.leave(flight)
+    # A flight closed while being submitted tells the leader to stop what it started
+    scheduler.close(flight)
+    assert not scheduler.started(flight, 'execution-1')
+
+
+def test_cancelled_callers_leave_the_slot_queue():
+    scheduler = QueryScheduler(max_concurrent=1)
+    scheduler.acquire()
+    handle = QueryHandle()
+    errors = []
+
+    def queued():
+        try:
+            scheduler.acquire(handle=handle)
+        except QueryCancelledError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=queued)
+    thread.start()
+    wait_until(lambda: scheduler.stats()['waiting'] == 1)
+    handle.cancel()
+    thread.join()
+    assert len(errors) == 1
+    assert scheduler.stats() == {'running': 1, 'running_exports': 0, 'waiting': 0, 'in_flight': 0, 'merged': 0}
+
+
+def test_concurrency_is_capped_and_interactive_queries_go_first():
+    scheduler = QueryScheduler(max_concurrent=1, max_exports=1)
+    scheduler.acquire(INTERACTIVE)
+    order = []
+
+    def run(name, priority):
+        scheduler.acquire(priority)
+        order.append(name)
+        scheduler.release(priority)
+
+    export = threading.Thread(target=run, args=('export', EXPORT))
+    export.start()
+    wait_until(lambda: scheduler.stats()['waiting'] == 1)
+    interactive = threading.Thread(target=run, args=('interactive', INTERACTIVE))
+    interactive.start()
+    wait_until(lambda: scheduler.stats()['waiting'] == 2)
+    assert order == []
+
+    scheduler.release(INTERACTIVE)
+    export.join()
+    interactive.join()
+    assert order == ['interactive', 'export']
+
+
+def test_exports_never_take_every_slot():
+    scheduler = QueryScheduler(max_concurrent=3, max_exports=1)
+    scheduler.acquire(EXPORT)
+    blocked = threading.Thread(target=scheduler.acquire, args=(EXPORT,))
+    blocked.start()
+    wait_until(lambda: scheduler.stats()['waiting'] == 1)
+    # Interactive queries still get the free slots while the second export waits
+    scheduler.acquire(INTERACTIVE, count=2)
+    assert scheduler.stats()['running'] == 3
+    scheduler.release(INTERACTIVE, count=2)
+    scheduler.release(EXPORT)
+    blocked.join()
+    assert scheduler.stats()['running_exports'] == 1
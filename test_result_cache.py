@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests for the on-disk Parquet result cache
+"""
+
+import pandas as pd
+
+from result_cache import INDEX_SAVE_INTERVAL, ResultCache, normalize_sql, query_fingerprint
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def frame(rows):
+    return pd.DataFrame({'origin': ['JED'] * rows, 'order_c': range(rows)})
+
+
+def test_normalize_sql_ignores_layout_but_not_literals():
+    assert normalize_sql("SELECT *\n  FROM t WHERE o = 'JED';") == normalize_sql("select * from t where o = 'JED'")
+    assert normalize_sql("SELECT * FROM t WHERE o = 'JED'") != normalize_sql("SELECT * FROM t WHERE o = 'jed'")
+
+
+def test_hits_misses_and_ttl_expiry(tmp_path):
+    clock = FakeClock()
+    cache = ResultCache(str(tmp_path), max_bytes=10 ** 9, default_ttl=60, clock=clock)
+    assert cache.get("SELECT 1") is None
+    cache.put("SELECT 1", frame(3))
+    cache.put("SELECT 2", frame(3), ttl=600)
+    pd.testing.assert_frame_equal(cache.get("SELECT 1"), frame(3))
+    clock.now += 61
+    assert cache.get("SELECT 1") is None
+    assert cache.get("SELECT 2") is not None
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 2
+
+
+def test_max_age_skips_entries_older_than_the_caller_accepts(tmp_path):
+    clock = FakeClock()
+    cache = ResultCache(str(tmp_path), max_bytes=10 ** 9, default_ttl=3600, clock=clock)
+    cache.put("SELECT 1", frame(3))
+    clock.now += 120
+    assert cache.get("SELECT 1", max_age=0) is None
+    assert cache.get("SELECT 1", max_age=60) is None
+    assert cache.get("SELECT 1", max_age=300) is not None
+    # Still there for callers that accept older results
+    assert cache.get("SELECT 1") is not None
+
+
+def test_least_recently_used_entries_are_evicted_over_budget(tmp_path):
+    clock = FakeClock()
+    cache = ResultCache(str(tmp_path), max_bytes=10 ** 9, default_ttl=3600, clock=clock)
+    for query in ("SELECT 1", "SELECT 2", "SELECT 3"):
+        clock.now += 1
+        cache.put(query, frame(100))
+    entry_size = cache.stats()['bytes'] // 3
+    clock.now += 1
+    cache.get("SELECT 1")
+    cache.max_bytes = entry_size * 3
+    clock.now += 1
+    cache.put("SELECT 4", frame(100))
+    # SELECT 2 was the least recently used once SELECT 1 was read again
+    assert cache.get("SELECT 2") is None
+    assert cache.get("SELECT 1") is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_hits_save_the_index_at_most_once_per_interval(tmp_path, monkeypatch):
+    clock = FakeClock()
+    cache = ResultCache(str(tmp_path), max_bytes=10 ** 9, default_ttl=3600, clock=clock)
+    cache.put("SELECT 1", frame(3))
+    saves = []
+    save = cache._save_index
+    monkeypatch.setattr(cache, '_save_index', lambda: saves.append(clock.now) or save())
+    for _ in range(100):
+        cache.get("SELECT 1")
+    assert saves == []
+    clock.now += INDEX_SAVE_INTERVAL
+    cache.get("SELECT 1")
+    cache.get("SELECT 1")
+    assert len(saves) == 1
+    # The access time is in memory meanwhile and persisted with the next save
+    assert ResultCache(str(tmp_path))._index[query_fingerprint("SELECT 1")]['last_access'] == clock.now
+
+
+def test_entries_survive_a_restart(tmp_path):
+    ResultCache(str(tmp_path)).put("SELECT 1", frame(5))
+    assert len(ResultCache(str(tmp_path)).get("SELECT 1")) == 5
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Tests for the keyset-paginated data grid
+"""
+
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from query_filters import keyset_condition
+from result_pager import FramePages, KeysetPages, ResultPager, sort_for_display
+
+
+def rows(count):
+    # Ties on order_c and a trailing NULL so only (order_c, join_key) is a stable key
+    order_c = [i // 3 for i in range(count - 1)] + [np.nan]
+    return pd.DataFrame({'order_c': order_c, 'join_key': [f"k{i:03d}" for i in range(count)]})
+
+
+class FakeConnector:
+    """Answers page queries from a frame, the way the keyset SQL would"""
+
+    def __init__(self, df):
+        self.df = df
+        self.calls = []
+        self.failures = 0
+
+    def get_page(self, filters, after=None, page_size=500, report_errors=True):
+        self.calls.append(after)
+        if self.failures:
+            self.failures -= 1
+            assert not report_errors, "Page errors must be raised, not shown, off the script thread"
+            raise RuntimeError("Query failed: boom")
+        df = self.df
+        if after is not None:
+            order_c, join_key = after
+            if order_c is None:
+                df = df[df['order_c'].isna() & (df['join_key'] > join_key)]
+            else:
+                df = df[(df['order_c'] > order_c) | ((df['order_c'] == order_c) & (df['join_key'] > join_key))
+                        | df['order_c'].isna()]
+        return df.head(page_size).reset_index(drop=True)
+
+
+class InlineExecutor:
+    """Runs each task before submit returns, failing instead of hanging if the task blocks"""
+
+    def submit(self, fn, *args):
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        worker.join(timeout=5)
+        assert not worker.is_alive(), "Submitted task blocked"
+        return future
+
+
+def test_keyset_condition_handles_ties_and_nulls():
+    assert keyset_condition((5, 'k1')) == \
+        "(order_c > 5 OR (order_c = 5 AND join_key > 'k1') OR order_c IS NULL)"
+    assert keyset_condition((None, "k'1")) == "(order_c IS NULL AND join_key > 'k''1')"
+
+
+def test_keyset_pages_cover_every_row_once():
+    df = rows(23)
+    connector = FakeConnector(df)
+    pager = ResultPager(KeysetPages(connector, {}), page_size=5, max_pages=2, executor=InlineExecutor())
+    pager.put(0, connector.get_page({}, page_size=5))
+    pages = []
+    n = 0
+    while pager.has_page(n):
+        pages.append(pager.page(n, prefetch=False))
+        n += 1
+    assert pager.page_count == 5
+    assert list(pd.concat(pages)['order_c'].fillna(-1)) == list(df['order_c'].fillna(-1))
+    # The sort key is only there for paging
+    assert 'join_key' not in pages[0].columns
+
+
+def test_next_page_is_prefetched_and_only_a_few_pages_kept():
+    connector = FakeConnector(rows(30))
+    pager = ResultPager(KeysetPages(connector, {}), page_size=5, max_pages=2, executor=InlineExecutor())
+    pager.put(0, connector.get_page({}, page_size=5))
+    pager.page(0)
+    assert pager.fetches == 1
+    pager.page(1)
+    assert pager.fetches == 2
+    assert len(pager._pages) == 2
+    # Page 0 was evicted and is fetched again from its cursor
+    pager.page(0, prefetch=False)
+    assert pager.fetches == 3
+
+
+def test_a_failed_prefetch_is_raised_when_the_page_is_shown_and_then_retried():
+    connector = FakeConnector(rows(23))
+    pager = ResultPager(KeysetPages(connector, {}), page_size=5, max_pages=3, executor=InlineExecutor())
+    pager.put(0, connector.get_page({}, page_size=5))
+    connector.failures = 1
+    pager.page(0)  # Prefetches page 1 in the background, which fails
+    with pytest.raises(RuntimeError, match="boom"):
+        pager.page(1, prefetch=False)
+    assert len(pager.page(1, prefetch=False)) == 5
+
+
+def test_complete_results_are_sliced_locally():
+    df = sort_for_display(pd.DataFrame({'order_c': [3, None, 1, 2]}))
+    pager = ResultPager(FramePages(df), page_size=3)
+    assert pager.page_count == 2 and pager.total_count == 4 and pager.empty is False
+    assert list(pager.page(1)['order_c'].isna()) == [True]
+    assert not pager.has_page(2)
+    # A fresh pager (as on every rerun) can go straight to any page
+    assert list(ResultPager(FramePages(df), page_size=3).page(1)['order_c'].isna()) == [True]
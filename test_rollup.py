@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Tests for the daily rollup and the queries it answers
+"""
+
+import re
+from datetime import date, timedelta
+
+import pandas as pd
+
+from rollup import MAX_PARTITIONS_PER_WRITE, DailyRollup
+
+
+class FakeAthena:
+    """Records statements and removed prefixes; answers the new-days and leftover-partition queries"""
+
+    def __init__(self, days, rolled_through=None, rolled=()):
+        self.days = days
+        # Table properties, None until the table exists
+        self.properties = None if rolled_through is None else {'rolled_through': rolled_through}
+        # Days with partitions in the rollup
+        self.rolled = set(rolled)
+        self.statements = []
+        self.removed = []
+
+    def run_statement(self, query):
+        statement = ' '.join(query.split())
+        self.statements.append(statement)
+        if statement.startswith('CREATE TABLE'):
+            self.properties = {}
+        committed = re.search(r"'rolled_through' = '([\d-]+)'", statement)
+        if committed:
+            self.properties['rolled_through'] = committed.group(1)
+
+    def run_query(self, query):
+        bounds = dict(re.findall(r"departure_date ([<>]=?) '([\d-]+)'", query))
+        days = self.rolled if '.rollup' in query else self.days
+        after, through = bounds.get('>', ''), bounds.get('<=', '9999')
+        return pd.DataFrame({'departure_date': sorted(day for day in days if after < day <= through)})
+
+    def rollup(self, **kwargs):
+        return DailyRollup(self.run_statement, self.run_query, lambda name: self.properties, self.removed.append,
+                           table='rollup', location='s3://bucket/rollup/', enabled=True,
+                           today=lambda: date(2024, 6, 1), **kwargs)
+
+    def writes(self):
+        return [statement for statement in self.statements if not statement.startswith('ALTER TABLE')]
+
+
+def test_first_refresh_builds_the_table_in_partition_limited_chunks():
+    days = [(date(2024, 1, 1) + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(150)]
+    athena = FakeAthena(days)
+    rollup = athena.rollup()
+    assert rollup.refresh() == days[-1]
+    writes = athena.writes()
+    assert writes[0].startswith('CREATE TABLE') and "partitioned_by = ARRAY['departure_date']" in writes[0]
+    assert all(statement.startswith('INSERT INTO') for statement in writes[1:])
+    assert 'AS delay_digest' in writes[0]
+    assert len(writes) == -(-len(days) // MAX_PARTITIONS_PER_WRITE)
+    # Leftovers of an earlier failed CTAS are cleared first
+    assert athena.removed == ['s3://bucket/rollup/']
+    assert athena.properties == {'rolled_through': days[-1]}
+
+
+def test_later_refreshes_only_insert_new_days():
+    athena = FakeAthena(['2024-05-30', '2024-05-31'], rolled_through='2024-05-30', rolled=['2024-05-30'])
+    rollup = athena.rollup()
+    assert rollup.refresh() == '2024-05-31'
+    assert athena.writes() == [statement for statement in athena.statements if 'INSERT INTO' in statement]
+    assert len(athena.writes()) == 1 and "departure_date >= '2024-05-31'" in athena.writes()[0]
+    assert athena.removed == [] and athena.properties == {'rolled_through': '2024-05-31'}
+
+
+def test_partitions_of_a_failed_insert_are_dropped_before_writing_them_again():
+    # An INSERT INTO for the 31st failed after writing some files, before the property was moved on
+    athena = FakeAthena(['2024-05-30', '2024-05-31'], rolled_through='2024-05-30', rolled=['2024-05-30', '2024-05-31'])
+    assert athena.rollup().refresh() == '2024-05-31'
+    assert athena.removed == ['s3://bucket/rollup/departure_date=2024-05-31/']
+    assert "DROP IF EXISTS PARTITION (departure_date = '2024-05-31')" in athena.statements[0]
+    assert athena.statements[1].startswith('INSERT INTO')
+
+
+def test_metrics_use_the_rollup_only_when_filters_allow():
+    rollup = FakeAthena([]).rollup(refresh_interval=10 ** 9)
+    rollup.rolled_through = '2024-05-31'
+    rollup._refreshed_at = rollup.clock()
+    assert rollup.metrics_query({'origin': 'JED', 'flight_code': 'QR-1117'}) is None
+    assert rollup.metrics_query({'dep_delayed': '15-30 minutes'}) is None
+    assert rollup.metrics_query({'date_from': '2024-06-01'}) is None
+    
+    closed = ' '.join(rollup.metrics_query({'date_from': '2024-05-01', 'date_to': '2024-05-31'}).split())
+    assert f'FROM {rollup.table} ' in closed and 'UNION ALL' not in closed
+    assert 'value_at_quantile(merge(CAST(delay_digest AS qdigest(double))), 0.9) as p90_delay' in closed
+    # Open ranges add the days after the rollup from the raw table
+    open_ended = ' '.join(rollup.metrics_query({'origin': 'JED', 'journey_type': 'oneway'}).split())
+    assert 'UNION ALL' in open_ended and "departure_date > '2024-05-31'" in open_ended
+    # The raw days contribute their own digest to the merged percentiles
+    assert open_ended.count('qdigest_agg(CAST(dep_delayed AS DOUBLE))') == 1
+
+
+def test_nothing_is_answered_before_the_rollup_exists():
+    rollup = FakeAthena([]).rollup()
+    rollup._refreshing = True  # Pretend a refresh is already running
+    assert rollup.metrics_query({}) is None
+    assert rollup.routes_query() is None
+    rollup.rolled_through = '2024-05-31'
+    assert 'UNION' in rollup.routes_query()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-session result store
+"""
+
+import os
+
+import pandas as pd
+
+from session_store import SessionResultStore, frame_bytes
+
+
+def frame(rows, origin='JED'):
+    return pd.DataFrame({'origin': [origin] * rows, 'order_c': range(rows)})
+
+
+def test_results_are_keyed_by_compiled_filters(tmp_path):
+    store = SessionResultStore(spill_dir=str(tmp_path))
+    store.put({'origin': 'JED', 'dep_delayed': 'All'}, frame(3), {'total_count': 3})
+    df, metrics = store.get({'origin': 'JED'})
+    pd.testing.assert_frame_equal(df, frame(3))
+    assert metrics == {'total_count': 3}
+    assert store.get({'origin': 'RUH'}) is None
+
+
+def test_older_results_spill_to_disk_and_come_back(tmp_path):
+    store = SessionResultStore(max_bytes=frame_bytes(frame(100)), spill_dir=str(tmp_path))
+    store.put({'origin': 'JED'}, frame(100, 'JED'))
+    store.put({'origin': 'RUH'}, frame(100, 'RUH'))
+    assert store.spills == 1
+    assert store.memory_bytes <= store.max_bytes
+    df, _ = store.get({'origin': 'JED'})
+    pd.testing.assert_frame_equal(df, frame(100, 'JED'))
+    # Reading JED back spilled RUH, the least recently used result now
+    assert store.spills == 2
+    assert {'origin': 'RUH'} in store
+
+
+def test_oldest_results_are_dropped_over_the_entry_limit(tmp_path):
+    store = SessionResultStore(max_bytes=0, max_entries=2, spill_dir=str(tmp_path))
+    for origin in ('JED', 'RUH', 'DXB'):
+        store.put({'origin': origin}, frame(10, origin))
+    assert store.get({'origin': 'JED'}) is None
+    store.clear()
+    assert all(not files for _, _, files in os.walk(str(tmp_path)))
+
+
+def test_only_recent_complete_results_can_be_applied_again(tmp_path):
+    now = [0.0]
+    store = SessionResultStore(spill_dir=str(tmp_path), clock=lambda: now[0])
+    store.put({'origin': 'JED'}, frame(3), {'total_count': 3}, charts={'daily_delay': frame(1)}, complete=True)
+    store.put({'origin': 'RUH'}, frame(3), {'total_count': 900})
+    df, metrics, charts = store.complete_result({'origin': 'JED'}, max_age=60)
+    assert len(df) == 3 and metrics == {'total_count': 3} and list(charts) == ['daily_delay']
+    # Only the first page of RUH is here
+    assert store.complete_result({'origin': 'RUH'}, max_age=60) is None
+    now[0] = 61
+    assert store.complete_result({'origin': 'JED'}, max_age=60) is None